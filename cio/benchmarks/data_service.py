@@ -0,0 +1,75 @@
+"""Repeated loads of minute bars: `ParquetDataFrameLoader` vs the cached `DataService`.
+
+Starts a `DataService` in process and loads the same data through both loaders, in full,
+as a range scan of the last sessions and as a few columns, then after a writer commit (the
+first load after a commit decodes the file again). Uses the SPY minute dataset if given,
+synthetic minute bars of the same shape otherwise.
+
+    poetry run python benchmarks/data_service.py --filename ~/data/spy_mins.parquet
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import threading
+
+import pandas as pd
+from parquet_layouts import make_minute_bars, timed
+
+from cio.data_loader import ParquetDataFrameLoader
+from cio.data_service import DataService, DataServiceLoader
+from cio.data_writer import ParquetWriter
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--filename", type=str, help="Minute bars parquet, e.g. SPY")
+parser.add_argument("--years", type=int, default=10, help="Synthetic data only")
+parser.add_argument(
+    "--sessions", type=int, default=20, help="Sessions of the range scan"
+)
+parser.add_argument("--repeat", type=int, default=10)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    data = (
+        pd.read_parquet(args.filename)
+        if args.filename
+        else make_minute_bars(args.years)
+    )
+    data = data.sort_index()
+    range_start = data.index.normalize().unique()[-args.sessions]
+    print(f"{len(data):,} rows, range scan of the last {args.sessions} sessions")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "data.parquet")
+        writer = ParquetWriter(
+            {
+                "filename": filename,
+                "writer_params": {"sort_index": True, "row_group_size": 100_000},
+            }
+        )
+        writer.write_data(data)
+        socket_path = os.path.join(tmp, "data_service.sock")
+        service = DataService(socket_path)
+        threading.Thread(target=service.serve_forever, daemon=True).start()
+
+        queries = {
+            "full": {},
+            "range": {"start": range_start},
+            "2 columns": {"columns": ["close", "volume"]},
+        }
+        print(f"{'query':>10} | {'parquet ms':>10} | {'service ms':>10}")
+        for name, query in queries.items():
+            config = {"filename": filename, **query}
+            service_config = {**config, "socket_path": socket_path, "fallback": False}
+            parquet = timed(ParquetDataFrameLoader(config).load_data, args.repeat)
+            cached = timed(DataServiceLoader(service_config).load_data, args.repeat)
+            print(f"{name:>10} | {parquet * 1e3:>10.1f} | {cached * 1e3:>10.1f}")
+
+        loader = DataServiceLoader({"filename": filename, "socket_path": socket_path})
+        writer.write_data(data)
+        reload = timed(loader.load_data, 1)
+        print(f"first full load after a commit: {reload * 1e3:.1f} ms")
+        service.shutdown()
+        service.server_close()
@@ -0,0 +1,83 @@
+"""Decoding of Binance kline pages: raw object DataFrame (before) vs typed columns (`cio.klines`).
+
+Reports rows / sec and the memory of the decoded DataFrame per 1000-kline page, with the
+standard library json parser and, if installed, with orjson.
+
+    poetry run python benchmarks/klines.py --pages 200
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import cio.klines
+from cio.klines import KLINE_COLUMNS, decode_klines
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--pages", type=int, default=200)
+parser.add_argument("--page-size", type=int, default=1000)
+
+
+def make_page(page_size: int, seed: int = 0) -> bytes:
+    """A page of 1m klines as returned by /api/v3/klines."""
+    rng = np.random.default_rng(seed)
+    open_time = 1745769120000 + 60000 * np.arange(page_size)
+    close = 95000 + np.cumsum(rng.normal(0, 5, page_size))
+    klines = [
+        [
+            int(open_time[i]),
+            f"{close[i] - 1:.8f}",
+            f"{close[i] + 3:.8f}",
+            f"{close[i] - 3:.8f}",
+            f"{close[i]:.8f}",
+            f"{rng.random() * 10:.8f}",
+            int(open_time[i]) + 59999,
+            f"{rng.random() * 1e6:.8f}",
+            int(rng.integers(100, 5000)),
+            f"{rng.random() * 5:.8f}",
+            f"{rng.random() * 5e5:.8f}",
+            "0",
+        ]
+        for i in range(page_size)
+    ]
+    return json.dumps(klines, separators=(",", ":")).encode()
+
+
+def decode_raw(payload: bytes) -> pd.DataFrame:
+    """Decoding before `cio.klines`: `response.json()` into an object DataFrame."""
+    return pd.DataFrame(json.loads(payload), columns=KLINE_COLUMNS)
+
+
+def decode_raw_typed(payload: bytes) -> pd.DataFrame:
+    """`decode_raw` followed by a cast, the cost of getting typed data before `cio.klines`."""
+    return decode_raw(payload).astype(cio.klines.KLINE_DTYPES)
+
+
+def bench(name: str, decode, payloads: list):
+    decode(payloads[0])
+    start = time.perf_counter()
+    for payload in payloads:
+        df = decode(payload)
+    elapsed = time.perf_counter() - start
+    rows = len(df) * len(payloads)
+    memory = df.memory_usage(deep=True).sum() / 1024
+    print(f"{name:>22}: {rows / elapsed:>12,.0f} rows/s | {memory:>8,.0f} KiB per page")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    payloads = [make_page(args.page_size, seed) for seed in range(args.pages)]
+    print(f"{args.pages} pages of {args.page_size} klines")
+
+    bench("raw (before)", decode_raw, payloads)
+    bench("raw + astype (before)", decode_raw_typed, payloads)
+    backend = cio.klines.orjson
+    cio.klines.orjson = None
+    bench("typed, json", decode_klines, payloads)
+    if backend is not None:
+        cio.klines.orjson = backend
+        bench("typed, orjson", decode_klines, payloads)
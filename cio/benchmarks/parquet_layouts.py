@@ -0,0 +1,145 @@
+"""Parquet layouts of a minute bar dataset: file size, write throughput and read latency.
+
+Writes the dataset once per layout with `ParquetWriter` and reads it back with
+`ParquetDataFrameLoader`, in full and as a range scan of the last sessions (the access pattern
+of `load_noise_area` / the live strategy). Uses the SPY minute dataset if given, synthetic
+minute bars of the same shape otherwise.
+
+    poetry run python benchmarks/parquet_layouts.py --filename ~/data/spy_mins.parquet
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from cio.data_loader import ParquetDataFrameLoader
+from cio.data_writer import ParquetWriter
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--filename", type=str, help="Minute bars parquet, e.g. SPY")
+parser.add_argument("--years", type=int, default=10, help="Synthetic data only")
+parser.add_argument(
+    "--sessions", type=int, default=5, help="Sessions of the range scan"
+)
+parser.add_argument("--repeat", type=int, default=5)
+
+LAYOUTS = {
+    "default": {},
+    "snappy, 100k rg": {"compression": "snappy", "row_group_size": 100_000},
+    "lz4, 100k rg": {"compression": "lz4", "row_group_size": 100_000},
+    "zstd-1, 100k rg": {
+        "compression": "zstd",
+        "compression_level": 1,
+        "row_group_size": 100_000,
+    },
+    "zstd-3, 100k rg": {
+        "compression": "zstd",
+        "compression_level": 3,
+        "row_group_size": 100_000,
+    },
+    "zstd-9, 100k rg": {
+        "compression": "zstd",
+        "compression_level": 9,
+        "row_group_size": 100_000,
+    },
+    "gzip, 100k rg": {"compression": "gzip", "row_group_size": 100_000},
+    "none, 100k rg": {"compression": "none", "row_group_size": 100_000},
+    "zstd-3, 10k rg": {
+        "compression": "zstd",
+        "compression_level": 3,
+        "row_group_size": 10_000,
+    },
+    "zstd-3, 100k rg, no dict": {
+        "compression": "zstd",
+        "compression_level": 3,
+        "row_group_size": 100_000,
+        "use_dictionary": False,
+    },
+    "zstd-3, 100k rg, no stats": {
+        "compression": "zstd",
+        "compression_level": 3,
+        "row_group_size": 100_000,
+        "write_statistics": False,
+    },
+}
+
+
+def make_minute_bars(years: int, seed: int = 0) -> pd.DataFrame:
+    """Synthetic regular trading hours minute bars, with the columns of the SPY dataset."""
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(end="2024-12-31", periods=252 * years)
+    minutes = np.arange(390) * np.timedelta64(1, "m") + np.timedelta64(570, "m")
+    index = pd.DatetimeIndex(
+        (days.values[:, None] + minutes[None, :]).ravel()
+    ).tz_localize("US/Eastern")
+    close = 400 * np.exp(np.cumsum(rng.normal(0, 5e-4, len(index))))
+    close = np.round(close, 2)
+    open_ = np.round(close * (1 + rng.normal(0, 1e-4, len(index))), 2)
+    volume = rng.integers(100, 100_000, len(index)).astype(float)
+    return pd.DataFrame(
+        {
+            "close": close,
+            "open": open_,
+            "low": np.minimum(open_, close) - 0.01,
+            "high": np.maximum(open_, close) + 0.01,
+            "volume": volume,
+            "count": (volume // 50).astype(np.int64),
+        },
+        index=index,
+    )
+
+
+def timed(f, repeat: int) -> float:
+    """Median wall time of `f` over `repeat` runs, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    data = (
+        pd.read_parquet(args.filename)
+        if args.filename
+        else make_minute_bars(args.years)
+    )
+    data = data.sort_index()
+    sessions = data.index.normalize().unique()
+    range_start = sessions[-args.sessions]
+    print(
+        f"{len(data):,} rows, {len(sessions)} sessions, "
+        f"range scan of the last {args.sessions} sessions from {range_start.date()}"
+    )
+    print(
+        f"{'layout':>26} | {'size MiB':>8} | {'write Mrows/s':>13} | "
+        f"{'full read ms':>12} | {'range read ms':>13}"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, layout in LAYOUTS.items():
+            filename = os.path.join(tmp, "data.parquet")
+            writer = ParquetWriter(
+                {"filename": filename, "writer_params": {"sort_index": True, **layout}}
+            )
+            write = timed(lambda: writer.write_data(data), args.repeat)
+
+            full = ParquetDataFrameLoader({"filename": filename})
+            scan = ParquetDataFrameLoader({"filename": filename, "start": range_start})
+            full_read = timed(full.load_data, args.repeat)
+            range_read = timed(scan.load_data, args.repeat)
+            assert len(scan.load_data()) == (data.index >= range_start).sum()
+
+            print(
+                f"{name:>26} | {os.path.getsize(filename) / 2**20:>8.1f} | "
+                f"{len(data) / write / 1e6:>13.2f} | {full_read * 1e3:>12.1f} | "
+                f"{range_read * 1e3:>13.1f}"
+            )
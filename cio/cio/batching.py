@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+
+def iter_sessions(batches: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Re-chunks a stream of time-ordered batches into one DataFrame per session (calendar date).
+
+    Only the rows of the session that is still open at the end of a batch are carried over to
+    the next batch, so memory is bounded by the largest batch plus one session.
+
+    Args:
+        batches (Iterable[pd.DataFrame]): DataFrames with a sorted DatetimeIndex. Timezone aware
+            indexes are split on their local date.
+
+    Yields:
+        pd.DataFrame: All rows of a single session.
+    """
+    carry = None
+    for batch in batches:
+        if carry is not None:
+            batch = pd.concat([carry, batch])
+            carry = None
+        if batch.empty:
+            continue
+
+        days = batch.index.normalize().asi8
+        starts = np.flatnonzero(days[1:] != days[:-1]) + 1
+        bounds = np.concatenate([[0], starts, [len(batch)]])
+        for i in range(len(bounds) - 2):
+            yield batch.iloc[bounds[i] : bounds[i + 1]]
+        carry = batch.iloc[bounds[-2] :]
+
+    if carry is not None and not carry.empty:
+        yield carry
+
+
+def iter_rows(
+    batches: Iterable[pd.DataFrame], batch_size: int
+) -> Iterator[pd.DataFrame]:
+    """Re-chunks a stream of batches into DataFrames of exactly `batch_size` rows (the last one may be shorter).
+
+    Args:
+        batches (Iterable[pd.DataFrame]): Input DataFrames.
+        batch_size (int): Number of rows per output batch.
+
+    Yields:
+        pd.DataFrame: Batches of `batch_size` rows.
+    """
+    assert batch_size > 0, f"batch_size has to be positive, got {batch_size}"
+    pending = []
+    n_pending = 0
+    for batch in batches:
+        pending.append(batch)
+        n_pending += len(batch)
+        if n_pending < batch_size:
+            continue
+
+        batch = pd.concat(pending)
+        stop = len(batch) - (len(batch) % batch_size)
+        for i in range(0, stop, batch_size):
+            yield batch.iloc[i : i + batch_size]
+        pending = [batch.iloc[stop:]]
+        n_pending = len(pending[0])
+
+    if n_pending:
+        yield pd.concat(pending)
+
+
+def iter_batches(
+    batches: Iterable[pd.DataFrame], config: dict
+) -> Iterator[pd.DataFrame]:
+    """Applies the batching options of a loader config to a stream of batches.
+
+    Example config:
+    {
+        "batch_by": "session",  # or "rows", together with "batch_size"
+        "batch_size": 100000
+    }
+
+    Without any batching option the batches are passed through as produced by the source.
+    """
+    batch_by = config.get("batch_by")
+    if batch_by is None and "batch_size" in config:
+        batch_by = "rows"
+
+    if batch_by is None:
+        return iter(batches)
+    if batch_by == "session":
+        return iter_sessions(batches)
+    if batch_by == "rows":
+        return iter_rows(batches, int(config["batch_size"]))
+    raise ValueError(f"Not a valid batch_by: {batch_by}")
+
+
+def iter_sorted(batches: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Sorts every batch by index and checks that the batches come in index order.
+
+    Raises:
+        ValueError: If a batch starts before the end of the previous batch.
+    """
+    last = None
+    for batch in batches:
+        if batch.empty:
+            continue
+        batch = batch.sort_index()
+        if last is not None and batch.index[0] < last:
+            raise ValueError(
+                f"Batches have to be in index order to be streamed, got {batch.index[0]} after {last}"
+            )
+        last = batch.index[-1]
+        yield batch
+
+
+def merge_sorted(
+    left: Iterable[pd.DataFrame], right: Iterable[pd.DataFrame]
+) -> Iterator[pd.DataFrame]:
+    """Merges two index-sorted streams of batches into one sorted stream.
+
+    Rows with equal index values are emitted in the same batch with the rows of `right` after
+    the rows of `left`, so `deduplicate_sorted` keeps the `right` rows (last wins).
+    """
+    left = (batch for batch in left if not batch.empty)
+    right = (batch for batch in right if not batch.empty)
+    lbatch, rbatch = next(left, None), next(right, None)
+    while lbatch is not None and rbatch is not None:
+        bound = min(lbatch.index[-1], rbatch.index[-1])
+        lmask = lbatch.index <= bound
+        rmask = rbatch.index <= bound
+        merged = pd.concat([lbatch[lmask], rbatch[rmask]]).sort_index(kind="stable")
+        if not merged.empty:
+            yield merged
+
+        lbatch = lbatch[~lmask]
+        if lbatch.empty:
+            lbatch = next(left, None)
+        rbatch = rbatch[~rmask]
+        if rbatch.empty:
+            rbatch = next(right, None)
+
+    for batch, rest in ((lbatch, left), (rbatch, right)):
+        if batch is not None:
+            yield batch
+            yield from rest
+
+
+def deduplicate_sorted(batches: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Drops duplicate index values from an index-sorted stream of batches, keeping the last row.
+
+    The last batch is held back until the next one arrives, so duplicates spanning a batch
+    boundary are dropped as well.
+    """
+    pending = None
+    for batch in batches:
+        batch = batch[~batch.index.duplicated(keep="last")]
+        if batch.empty:
+            continue
+        if pending is not None:
+            pending = pending[pending.index != batch.index[0]]
+            if not pending.empty:
+                yield pending
+        pending = batch
+
+    if pending is not None:
+        yield pending
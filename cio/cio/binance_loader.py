@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from urllib.parse import urlencode
+
+import pandas as pd
+import requests
+
+import external.binance as binance
+from cio.data_loader import BaseLoader
+from cio.klines import decode_klines
+
+# Binance returns 500 klines per page if no limit is set
+DEFAULT_LIMIT = 500
+
+
+class BinanceHistoricalDataLoader(BaseLoader):
+    """Loads historicla data from Binance Marketdata endpoint.
+
+    Example config:
+    {
+        "loader_class": "BinanceHistoricalDataLoader",
+        "endpoint_type": None # KEY | SIGNATURE
+        "params": {
+            "symbol": "BTCUSDT",
+            "interval": "1m",
+            "startTime": "1745769121",
+            "endTime": "1745769121",
+        }
+    }
+
+    Results are paged through, so a startTime / endTime range larger than "limit" klines
+    is loaded in full. Klines are decoded into typed columns, see `cio.klines`.
+    """
+
+    def iter_data(self):
+        """Yields one DataFrame per kline page.
+
+        If "startTime" is set, the loader keeps requesting pages after the last returned kline
+        until "endTime" is reached or a page comes back with less than "limit" klines.
+        """
+        params = dict(self.config["params"])
+        limit = int(params.get("limit", DEFAULT_LIMIT))
+
+        while True:
+            klines = decode_klines(self.request_klines(params))
+            if klines.empty:
+                return
+
+            yield klines
+
+            if len(klines) < limit or "startTime" not in params:
+                return
+            next_start = int(klines["kline_open_time"].iloc[-1]) + 1
+            if "endTime" in params and next_start > int(params["endTime"]):
+                return
+            params["startTime"] = str(next_start)
+
+    def request_klines(self, params: dict) -> bytes:
+        """Returns the raw JSON body of one klines request."""
+        endpoint = "/api/v3/klines"
+        query_string = urlencode(params)
+
+        # TODO: endpoint_type == "KEY"
+        signature = None
+        if (
+            "endpoint_type" in self.config
+            and self.config["endpoint_type"] == "SIGNATURE"
+        ):
+            signature = binance.get_query_signature(query_string)
+
+        if signature is None:
+            url = f"{binance.BASE_URL}{endpoint}?{query_string}"
+        else:
+            url = f"{binance.BASE_URL}{endpoint}?{query_string}&signature={signature}"
+
+        response = requests.get(url, headers=binance.get_default_headers())
+
+        response.raise_for_status()
+
+        return response.content
+
+    def load_data(self):
+        batches = list(self.iter_data())
+        if not batches:
+            return decode_klines([])
+        return pd.concat(batches, ignore_index=True)
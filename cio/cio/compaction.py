@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import argparse
+import itertools
+import os
+import time
+import uuid
+
+import pandas as pd
+
+from cio.batching import iter_rows
+from cio.dataset import (
+    delete_obsolete,
+    file_entry,
+    is_dataset,
+    iter_entries,
+    manifest_lock,
+    read_manifest,
+    retire,
+    write_manifest,
+)
+
+DEFAULT_ROW_GROUP_SIZE = 100_000
+# replaced part files stay readable this long for readers of the previous manifest
+DEFAULT_RETENTION = 3600
+
+parser = argparse.ArgumentParser(
+    description="Compact a parquet file or dataset directory of the cio store"
+)
+parser.add_argument("path", type=str, help="Parquet file or dataset directory")
+parser.add_argument(
+    "-r",
+    "--row-group-size",
+    type=int,
+    default=DEFAULT_ROW_GROUP_SIZE,
+    help="Target number of rows per row group",
+)
+parser.add_argument(
+    "--retention",
+    type=float,
+    default=DEFAULT_RETENTION,
+    help="Seconds before replaced part files are deleted",
+)
+parser.add_argument(
+    "--compression", type=str, default="zstd", help="Parquet compression codec"
+)
+parser.add_argument(
+    "-f",
+    "--force",
+    action=argparse.BooleanOptionalAction,
+    help="Rewrite partitions even if they are already compact",
+)
+
+
+def needs_compaction(entries: list, row_group_size: int) -> bool:
+    """True if the files of a partition are not a single sorted file of full row groups."""
+    if len(entries) != 1:
+        return True
+    entry = entries[0]
+    return not entry["sorted"] or entry["row_groups"] > -(
+        -entry["rows"] // row_group_size
+    )
+
+
+def write_sorted(batches, filename: str, row_group_size: int, **options) -> int:
+    """Writes index-sorted batches to `filename` in row groups of `row_group_size` rows.
+
+    The index is recorded as the sorting column, so readers can trust the order and prune row
+    groups on their statistics.
+
+    Returns:
+        int: Number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    rows = 0
+    try:
+        for batch in iter_rows(batches, row_group_size):
+            if writer is None:
+                table = pa.Table.from_pandas(batch)
+                index_columns = table.schema.pandas_metadata.get("index_columns", [])
+                if len(index_columns) != 1 or not isinstance(index_columns[0], str):
+                    raise ValueError(
+                        f"{filename}: compaction needs an index to sort on"
+                    )
+                writer = pq.ParquetWriter(
+                    filename,
+                    table.schema,
+                    sorting_columns=[
+                        pq.SortingColumn(table.schema.get_field_index(index_columns[0]))
+                    ],
+                    **options,
+                )
+            else:
+                table = pa.Table.from_pandas(batch, schema=writer.schema)
+            writer.write_table(table, row_group_size=row_group_size)
+            rows += len(batch)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(filename)
+        raise
+
+    if writer is not None:
+        writer.close()
+    return rows
+
+
+def compact_file(
+    filename: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE, **options
+) -> dict:
+    """Rewrites a single parquet file sorted, deduplicated and in full row groups.
+
+    The new file is written next to `filename` and renamed over it, readers that already
+    opened the old file keep reading it.
+
+    Returns:
+        dict: Statistics of the compaction.
+    """
+    root, path = os.path.split(filename)
+    entry = file_entry(root, path, 1)
+    tmp_filename = f"{filename}.tmp"
+    rows = write_sorted(
+        iter_entries(root, [entry]), tmp_filename, row_group_size, **options
+    )
+    os.replace(tmp_filename, filename)
+    after = file_entry(root, path, 1)
+    return {
+        "files": 1,
+        "rows_before": entry["rows"],
+        "rows_after": rows,
+        "row_groups_before": entry["row_groups"],
+        "row_groups_after": after["row_groups"],
+    }
+
+
+def compact_dataset(
+    root: str,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    retention: float = DEFAULT_RETENTION,
+    force: bool = False,
+    **options,
+) -> dict:
+    """Merges the part files of every partition of a dataset into one file.
+
+    The part files of a partition are merged in index order, rows of later writes win on
+    duplicate index values (like "deduplicate_index" on append) and the result is written in
+    row groups of `row_group_size` rows. Readers keep using the old part files until the
+    manifest listing the compacted files, with their new statistics, replaces the old one in
+    a single rename. The old part files are deleted by a later compaction, once they have been
+    obsolete for `retention` seconds.
+
+    Appends to the dataset wait for the compaction to finish.
+
+    Args:
+        root (str): Dataset directory.
+        row_group_size (int, optional): Target number of rows per row group.
+        retention (float, optional): Seconds before replaced part files are deleted.
+        force (bool, optional): Rewrite partitions that are already a single compact file.
+        **options: pyarrow writer options, for ex. compression.
+
+    Returns:
+        dict: Statistics of the compaction.
+    """
+    stats = {
+        "partitions": 0,
+        "files": 0,
+        "rows_before": 0,
+        "rows_after": 0,
+        "row_groups_before": 0,
+        "row_groups_after": 0,
+        "deleted": 0,
+    }
+    with manifest_lock(root):
+        manifest = read_manifest(root)
+        partitions = itertools.groupby(
+            sorted(manifest["files"], key=lambda entry: os.path.dirname(entry["path"])),
+            key=lambda entry: os.path.dirname(entry["path"]),
+        )
+
+        files = []
+        for partition, entries in partitions:
+            entries = list(entries)
+            if not force and not needs_compaction(entries, row_group_size):
+                files.extend(entries)
+                continue
+
+            seq = max(entry["seq"] for entry in entries)
+            path = os.path.join(
+                partition, f"part-{seq:08d}-{uuid.uuid4().hex[:8]}.parquet"
+            )
+            rows = write_sorted(
+                iter_entries(root, entries),
+                os.path.join(root, path),
+                row_group_size,
+                **options,
+            )
+            retire(manifest, entries)
+            stats["partitions"] += 1
+            stats["files"] += len(entries)
+            stats["rows_before"] += sum(entry["rows"] for entry in entries)
+            stats["row_groups_before"] += sum(entry["row_groups"] for entry in entries)
+            if rows:
+                entry = file_entry(root, path, seq)
+                files.append(entry)
+                stats["rows_after"] += entry["rows"]
+                stats["row_groups_after"] += entry["row_groups"]
+
+        manifest["files"] = files
+        write_manifest(root, manifest)
+        # only delete once no manifest lists them anymore
+        stats["deleted"] = len(delete_obsolete(root, manifest, retention))
+        if stats["deleted"]:
+            write_manifest(root, manifest)
+    return stats
+
+
+def compact(
+    path: str,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    retention: float = DEFAULT_RETENTION,
+    force: bool = False,
+    **options,
+) -> dict:
+    """Compacts a parquet file or a dataset directory, see `compact_file` / `compact_dataset`."""
+    if is_dataset(path):
+        return compact_dataset(path, row_group_size, retention, force, **options)
+    return compact_file(path, row_group_size, **options)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(f"Input args: {args.__dict__}")
+
+    start = time.perf_counter()
+    stats = compact(
+        args.path,
+        args.row_group_size,
+        args.retention,
+        bool(args.force),
+        compression=args.compression,
+    )
+    print(pd.Series(stats).to_string())
+    print(f"Compacted in {time.perf_counter() - start:.2f}s")
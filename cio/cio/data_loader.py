@@ -1,17 +1,13 @@
 from __future__ import annotations
 
-import threading
-import time
 from abc import ABC, abstractmethod
-from urllib.parse import urlencode
+from typing import Iterator
 
 import pandas as pd
-import requests
-from ibapi.contract import Contract
 
 import cio.constants as c
-import external.binance as binance
-import external.ibkr as ibkr
+from cio.batching import iter_batches
+from cio.registry import loaders
 
 
 class BaseLoader(ABC):
@@ -21,6 +17,10 @@ class BaseLoader(ABC):
         To begin with, we will stick to cross-sectional dataframes for data and all data classes
         will returns a None / pd.DataFrame
 
+        Loaders produce their data as a stream of DataFrame batches in `iter_data` (parquet row
+        groups, API pages, ...). `iter_batches` re-chunks that stream as per the "batch_by" /
+        "batch_size" config keys and `load_data` collects the whole stream into one DataFrame.
+
         Args:
             config (dict): Dictionary with values related to the source and other details
                 of the data loader
@@ -28,9 +28,22 @@ class BaseLoader(ABC):
         self.config = config
 
     @abstractmethod
-    def load_data(self):
+    def iter_data(self) -> Iterator[pd.DataFrame]:
+        """Yields the data as DataFrame batches in the natural chunking of the source."""
         pass
 
+    def iter_batches(self) -> Iterator[pd.DataFrame]:
+        """Yields the data in batches as configured by "batch_by" / "batch_size"."""
+        return iter_batches(self.iter_data(), self.config)
+
+    def load_data(self):
+        batches = list(self.iter_data())
+        if not batches:
+            return pd.DataFrame()
+        if len(batches) == 1:
+            return batches[0]
+        return pd.concat(batches)
+
 
 class ParquetDataFrameLoader(BaseLoader):
     """Loads data from a parquet file as a dataframe.
@@ -38,171 +51,112 @@ class ParquetDataFrameLoader(BaseLoader):
     Example config:
     {
         "loader_class": "ParquetDataFrameLoader",
-        "filename": "../data/instruments_token.parquet"
+        "filename": "../data/instruments_token.parquet",
+        "columns": ["open", "close"],  # optional
+        "start": "2024-01-02",  # optional, first index value to load
+        "end": "2024-01-31 23:59",  # optional, last index value to load
+        "timeframe": "30min"  # optional, 5min | 30min | daily view of the minute data
     }
-    """
-
-    def load_data(self):
-        data = pd.read_parquet(self.config["filename"])
-        return data
 
+    `iter_data` yields one DataFrame per parquet row group. With "start" / "end", row groups
+    whose index statistics fall outside of the range are not read at all, so range scans of
+    recent sessions only read the last row groups of a file sorted by index.
 
-class BinanceHistoricalDataLoader(BaseLoader):
-    """Loads historicla data from Binance Marketdata endpoint.
+    "filename" can also be a dataset directory written by `ParquetWriter` with "dataset",
+    its part files are read in index order, last write wins on duplicate index values.
 
-    Example config:
-    {
-        "loader_class": "BinanceHistoricalDataLoader",
-        "endpoint_type": None # KEY | SIGNATURE
-        "params": {
-            "symbol": "BTCUSDT",
-            "interval": "1m",
-            "startTime": "1745769121",
-            "endTime": "1745769121",
-        }
-    }
+    With "timeframe" the bars are read from the view of that timeframe maintained by the ETL
+    next to the minute data (see `cio.dataset.view_filename`), instead of the minute data.
     """
 
-    def load_data(self):
-        endpoint = "/api/v3/klines"
-        query_string = urlencode(self.config["params"])
-
-        # TODO: endpoint_type == "KEY"
-        signature = None
-        if (
-            "endpoint_type" in self.config
-            and self.config["endpoint_type"] == "SIGNATURE"
-        ):
-            signature = binance.get_query_signature(query_string)
-
-        if signature is None:
-            url = f"{binance.BASE_URL}{endpoint}?{query_string}"
-        else:
-            url = f"{binance.BASE_URL}{endpoint}?{query_string}&signature={signature}"
-
-        response = requests.get(url, headers=binance.DEFAULT_HEADERS)
-
-        response.raise_for_status()
-
-        # convert into DF
-        df = pd.DataFrame(
-            response.json(),
-            columns=[
-                "kline_open_time",
-                "open_price",
-                "high_price",
-                "low_price",
-                "close_price",
-                "volume",
-                "kline_close_time",
-                "quote_asset_volume",
-                "number_of_trades",
-                "taker_buy_base_asset_volume",
-                "taker_buy_quote_asset_volume",
-                "NIL",
-            ],
-        )
-
-        # Do the following in the ETL script. Save copy of raw data.
-        # Timezone aware datetime index
-        # required fields: close, open, low, high, volume, count
-
-        # Return raw data
-        return df
-
-
-class IBKRHistoricalDataLoader(BaseLoader):
-    """Loads historical data from IBKR based on config.
-
-    This IBKR implementation connects to the app, loads and disconnects. This makes the app
-    synchronous. What is an ideal solution that can use the same app but can pass custom hanndler functions
-    for each function, for ex, load historical data, send order etc?
+    @property
+    def filename(self) -> str:
+        from cio.dataset import view_filename
 
-    Example config:
-    {
-        "loader_class": "IBKRHistoricalDataLoader",
-        "contract": {
-            "symbol": "SPY",
-            "secType": "STK",
-            "exchange": "SMART",
-            "currency": "USD"
-        },
-        "ibkr_params": {
-            "endDateTime": "20241211 09:30:00 US/Eastern",
-            "durationStr": "1 D",
-            "barSizeSetting": "1 min",
-            "whatToShow": "TRADES",
-            "useRTH": True,
-            "formatDate": 2, #2 stands for epoch seconds - use `localize_index` under loader params
-            "keepUpToDate": False,
-            "chartOptions": []
-        }
-    }
-    """
+        return view_filename(self.config["filename"], self.config.get("timeframe"))
 
-    def __init__(self, config: dict):
-        self.config = config
-        self.data = pd.DataFrame()
-        self.historical_query_end = False
-
-    class IBKRHistoricalDataApp(ibkr.IBBaseApp):
-        def __init__(self, main):
-            super().__init__()
-            self.main = main
-
-        # override function from base class
-        def historicalData(self, reqId, bar):
-            """Handler function that gets triggered when IBKR App recieves data for query
-
-            Args:
-                reqId (int): Unique ID passed to identify IBKR contract that data is for
-                bar (IBKR bar): Has fields
-                Date: 12345678, Open: 222.97, High: 222.97, Low: 222.96,
-                    Close: 222.97, Volume: 300, WAP: 222.965, BarCount: 2
-            """
-            df = {}
-            bar_data = {
-                "close": bar.close,
-                "open": bar.open,
-                "low": bar.low,
-                "high": bar.high,
-                "volume": bar.volume,
-                "count": bar.barCount,
-            }
-            df[bar.date] = bar_data
-            df = pd.DataFrame.from_dict(df, orient="index")
-            self.main.data = pd.concat([self.main.data, df])
-
-        def historicalDataEnd(self, reqId, start, end):
-            print(
-                f"Historical Data Ended for {reqId}. Started at {start}, ending at {end}"
-            )
-            self.cancelHistoricalData(reqId)
-            self.main.historical_query_end = True
+    def iter_data(self):
+        import pyarrow.parquet as pq
 
-    def load_data(self):
-        # Init App
-        app = self.IBKRHistoricalDataApp(self)
-        app.connect("127.0.0.1", 4002, 0)
+        from cio.dataset import is_dataset, iter_dataset
 
-        threading.Thread(target=app.run).start()
-        time.sleep(1)
+        if is_dataset(self.filename):
+            yield from iter_dataset(self.filename, self.config)
+            return
 
-        # Send Query
-        ibkr_params = self.config["ibkr_params"]
-        ibkr_params["reqId"] = app.nextId()
-        ibkr_params["contract"] = Contract()
-        for k, v in self.config["contract"].items():
-            setattr(ibkr_params["contract"], k, v)
-        app.reqHistoricalData(**ibkr_params)
+        columns = self.config.get("columns")
+        parquet_file = pq.ParquetFile(self.filename)
+        if columns is not None:
+            # index columns are stored as regular columns, keep them
+            columns = list(columns) + parquet_file.schema_arrow.pandas_metadata.get(
+                "index_columns", []
+            )
+            columns = [col for col in columns if isinstance(col, str)]
+        start, end = self.index_range(parquet_file)
+        for i in self.row_groups(parquet_file, start, end):
+            df = parquet_file.read_row_group(i, columns=columns).to_pandas()
+            if start is not None:
+                df = df[df.index >= start]
+            if end is not None:
+                df = df[df.index <= end]
+            yield df
 
-        # Run while loop until self.historical_query_end is set to True
-        while not self.historical_query_end:
-            time.sleep(1)
-        time.sleep(15)
+    def load_data(self):
+        from cio.dataset import is_dataset
 
-        app.disconnect()
-        return self.data
+        if "start" in self.config or "end" in self.config or is_dataset(self.filename):
+            return super().load_data()
+        data = pd.read_parquet(self.filename, columns=self.config.get("columns"))
+        return data
+
+    def index_range(self, parquet_file) -> tuple:
+        """Returns the "start" / "end" keys as timestamps in the timezone of the index."""
+        bounds = [self.config.get("start"), self.config.get("end")]
+        if bounds == [None, None]:
+            return None, None
+
+        field = self.index_field(parquet_file)
+        tz = getattr(field.type, "tz", None) if field is not None else None
+        return tuple(localize_bound(bound, tz) for bound in bounds)
+
+    def index_field(self, parquet_file):
+        """Returns the arrow field of the index column, None for a RangeIndex or no index."""
+        schema = parquet_file.schema_arrow
+        index_columns = (schema.pandas_metadata or {}).get("index_columns", [])
+        if len(index_columns) != 1 or not isinstance(index_columns[0], str):
+            return None
+        return schema.field(index_columns[0])
+
+    def row_groups(self, parquet_file, start=None, end=None) -> list:
+        """Returns the row groups that may hold index values in [start, end], from their statistics."""
+        n_row_groups = parquet_file.num_row_groups
+        field = self.index_field(parquet_file)
+        if (start is None and end is None) or field is None:
+            return list(range(n_row_groups))
+
+        col = parquet_file.schema_arrow.get_field_index(field.name)
+        row_groups = []
+        for i in range(n_row_groups):
+            stats = parquet_file.metadata.row_group(i).column(col).statistics
+            if stats is not None and stats.has_min_max:
+                if start is not None and pd.Timestamp(stats.max) < start:
+                    continue
+                if end is not None and pd.Timestamp(stats.min) > end:
+                    continue
+            row_groups.append(i)
+        return row_groups
+
+
+def localize_bound(bound, tz: str | None) -> pd.Timestamp | None:
+    """Returns a "start" / "end" config value as a timestamp comparable to an index in `tz`."""
+    if bound is None:
+        return None
+    bound = pd.Timestamp(bound)
+    if tz is not None and bound.tz is None:
+        bound = bound.tz_localize(tz)
+    elif tz is None and bound.tz is not None:
+        bound = bound.tz_localize(None)
+    return bound
 
 
 def load_data(config: dict):
@@ -211,15 +165,29 @@ def load_data(config: dict):
     Args:
         config (dict): Config Dict object
     """
-    source = config[c.loader_class]
-    if source == "ParquetDataFrameLoader":
-        loader = ParquetDataFrameLoader(config)
-    elif source == "IBKRHistoricalDataLoader":
-        loader = IBKRHistoricalDataLoader(config)
-    elif source == "BinanceHistoricalDataLoader":
-        loader = BinanceHistoricalDataLoader(config)
-    else:
-        raise ValueError("Not a valid data source for data loader")
+    loader = loaders.get(config[c.loader_class])(config)
 
     data = loader.load_data()
     return data
+
+
+def iter_data(config: dict) -> Iterator[pd.DataFrame]:
+    """Based on config, stream data from the relevant data loader in batches.
+
+    Use the "batch_by" ("session" | "rows") and "batch_size" keys of the config to control
+    the batches, for ex. to process histories that do not fit in memory.
+
+    Args:
+        config (dict): Config Dict object
+    """
+    loader = loaders.get(config[c.loader_class])(config)
+
+    return loader.iter_batches()
+
+
+def __getattr__(name: str):
+    # Backends used to live in this module, keep `from cio.data_loader import XLoader` working
+    # without importing their dependencies until they are actually asked for.
+    if name in ("BinanceHistoricalDataLoader", "IBKRHistoricalDataLoader"):
+        return loaders.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import glob
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from cio.data_loader import BaseLoader, ParquetDataFrameLoader, localize_bound
+from cio.dataset import MANIFEST, is_dataset, view_filename
+
+DEFAULT_SOCKET_PATH = "/tmp/cio_data_service.sock"
+DEFAULT_CACHE_BYTES = 4 * 2**30
+# rows per record batch on the wire, `DataServiceLoader.iter_data` yields one per batch
+WIRE_BATCH_ROWS = 100_000
+
+# request: 4 byte length + JSON, response: status byte + 8 byte length + payload
+REQUEST_HEADER = struct.Struct("!I")
+RESPONSE_HEADER = struct.Struct("!BQ")
+OK, ERROR = 0, 1
+
+parser = argparse.ArgumentParser(
+    description="Serve parquet data from an in-memory cache over a local socket"
+)
+parser.add_argument(
+    "-s", "--socket-path", type=str, default=DEFAULT_SOCKET_PATH, help="Socket path"
+)
+parser.add_argument(
+    "-c",
+    "--cache-mb",
+    type=int,
+    default=DEFAULT_CACHE_BYTES // 2**20,
+    help="Size budget of the cache, in MiB",
+)
+parser.add_argument(
+    "--symbol",
+    action="append",
+    default=[],
+    metavar="SYMBOL=FILENAME",
+    help="Minute data of a symbol, for requests by symbol. Can be repeated",
+)
+
+
+def signature(path: str) -> tuple:
+    """Identifies the committed version of a parquet file or dataset.
+
+    Writers commit by moving complete files in place (and datasets by replacing their
+    manifest), so the inode, mtime and size of the file / manifest change with every commit.
+
+    Raises:
+        FileNotFoundError: If there is no file / dataset at `path`.
+    """
+    if is_dataset(path):
+        manifest = os.path.join(path, MANIFEST)
+        if os.path.isfile(manifest):
+            paths = [manifest]
+        else:
+            paths = sorted(
+                glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True)
+            )
+    else:
+        paths = [path]
+    return tuple((st.st_ino, st.st_mtime_ns, st.st_size) for st in map(os.stat, paths))
+
+
+class CachedTable:
+    def __init__(self, filename: str, version: tuple):
+        """A parquet file or dataset decoded in memory, sorted by index.
+
+        Args:
+            filename (str): Parquet file or dataset directory.
+            version (tuple): `signature` of `filename` before it was read.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.version = version
+        if is_dataset(filename):
+            # part files are merged in index order, last write wins
+            data = ParquetDataFrameLoader({"filename": filename}).load_data()
+            table = pa.Table.from_pandas(data)
+        else:
+            table = pq.read_table(filename)
+
+        index_columns = (table.schema.pandas_metadata or {}).get("index_columns", [])
+        self.index_column = None
+        self.index = None
+        self.tz = None
+        if len(index_columns) == 1 and isinstance(index_columns[0], str):
+            self.index_column = index_columns[0]
+            field = table.schema.field(self.index_column)
+            self.tz = getattr(field.type, "tz", None)
+            index = table.column(self.index_column).to_numpy()
+            if len(index) > 1 and (index[1:] < index[:-1]).any():
+                table = table.sort_by(self.index_column)
+                index = table.column(self.index_column).to_numpy()
+            self.index = index
+        self.table = table
+        self.nbytes = table.nbytes + (0 if self.index is None else self.index.nbytes)
+
+    def query(self, columns: list | None = None, start=None, end=None):
+        """Returns the rows with index in [`start`, `end`] and the `columns` (+ index).
+
+        Same rows and columns as `ParquetDataFrameLoader` with the same config keys, as a
+        zero-copy slice of the cached table.
+        """
+        table = self.table
+        if self.index is not None and (start is not None or end is not None):
+            lo, hi = 0, len(self.index)
+            if start is not None:
+                lo = np.searchsorted(self.index, self.datetime64(start), side="left")
+            if end is not None:
+                hi = np.searchsorted(self.index, self.datetime64(end), side="right")
+            table = table.slice(lo, max(hi - lo, 0))
+        if columns is not None:
+            columns = [col for col in columns if col != self.index_column]
+            if self.index_column is not None:
+                columns.append(self.index_column)
+            table = table.select(columns)
+        return table
+
+    def datetime64(self, bound) -> np.datetime64:
+        """A "start" / "end" bound as a value of the index array (UTC if tz-aware)."""
+        bound = localize_bound(bound, self.tz)
+        if bound.tz is not None:
+            bound = bound.tz_convert("UTC").tz_localize(None)
+        return bound.to_datetime64()
+
+
+class TableCache:
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        """LRU cache of `CachedTable`s with a size budget.
+
+        Every lookup checks the `signature` of the file (a stat), so data committed by a
+        writer is picked up by the next request. Tables larger than the budget are served
+        but not kept.
+        """
+        self.max_bytes = max_bytes
+        self.tables = collections.OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        # one lock per file, concurrent requests of a cold file decode it once
+        self.file_locks = collections.defaultdict(threading.Lock)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename: str) -> CachedTable:
+        filename = os.path.abspath(filename)
+        with self.file_locks[filename]:
+            version = signature(filename)
+            with self.lock:
+                cached = self.tables.get(filename)
+                if cached is not None and cached.version == version:
+                    self.tables.move_to_end(filename)
+                    self.hits += 1
+                    return cached
+                self.misses += 1
+
+            cached = CachedTable(filename, version)
+            with self.lock:
+                self.evict(filename)
+                if cached.nbytes <= self.max_bytes:
+                    while self.nbytes + cached.nbytes > self.max_bytes:
+                        self.evict(next(iter(self.tables)))
+                    self.tables[filename] = cached
+                    self.nbytes += cached.nbytes
+            return cached
+
+    def evict(self, filename: str):
+        cached = self.tables.pop(filename, None)
+        if cached is not None:
+            self.nbytes -= cached.nbytes
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "files": list(self.tables),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class DataService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: str = DEFAULT_SOCKET_PATH,
+        max_bytes: int = DEFAULT_CACHE_BYTES,
+        symbols: dict | None = None,
+    ):
+        """Local historical data service, keeps hot parquet data decoded in memory.
+
+        Answers `DataServiceLoader` requests (a loader config: "filename" or "symbol",
+        "timeframe", "columns", "start", "end") with the rows as an Arrow IPC stream over
+        the unix socket `socket_path`, one thread per connection.
+
+        Args:
+            socket_path (str, optional): Socket to listen on.
+            max_bytes (int, optional): Size budget of the cache. Defaults to 4 GiB.
+            symbols (dict, optional): Symbol to the filename of its minute data.
+        """
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.cache = TableCache(max_bytes)
+        self.symbols = symbols or {}
+        super().__init__(socket_path, DataServiceHandler)
+        os.chmod(socket_path, 0o600)
+
+    def resolve(self, request: dict) -> str:
+        """Returns the file of a request, from its "filename" or "symbol"."""
+        filename = request.get("filename")
+        if filename is None:
+            symbol = request.get("symbol")
+            if symbol not in self.symbols:
+                raise ValueError(f"Unknown symbol: {symbol}")
+            filename = self.symbols[symbol]
+        return view_filename(filename, request.get("timeframe"))
+
+    def query(self, request: dict):
+        cached = self.cache.get(self.resolve(request))
+        return cached.query(
+            request.get("columns"), request.get("start"), request.get("end")
+        )
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class DataServiceHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        import pyarrow as pa
+
+        while True:
+            header = recv_exactly(self.request, REQUEST_HEADER.size)
+            if header is None:
+                return
+            request = json.loads(
+                recv_exactly(self.request, *REQUEST_HEADER.unpack(header))
+            )
+            try:
+                if request.get("command") == "stats":
+                    status, payload = OK, json.dumps(self.server.cache.stats()).encode()
+                else:
+                    table = self.server.query(request)
+                    sink = pa.BufferOutputStream()
+                    with pa.ipc.new_stream(sink, table.schema) as writer:
+                        writer.write_table(table, max_chunksize=WIRE_BATCH_ROWS)
+                    status, payload = OK, sink.getvalue()
+            except Exception as e:
+                error = {"type": type(e).__name__, "message": str(e)}
+                status, payload = ERROR, json.dumps(error).encode()
+            self.request.sendall(RESPONSE_HEADER.pack(status, len(payload)))
+            self.request.sendall(memoryview(payload))
+
+
+def recv_exactly(sock: socket.socket, n: int) -> bytearray | None:
+    """Reads `n` bytes from `sock`, None if it is closed before the first byte."""
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        size = sock.recv_into(view[received:])
+        if size == 0:
+            if received == 0:
+                return None
+            raise ConnectionError("Connection closed by the data service")
+        received += size
+    return buffer
+
+
+def raise_error(payload: bytes):
+    """Raises the exception sent by the data service, as a builtin exception if possible."""
+    import builtins
+
+    error = json.loads(payload)
+    exc_type = getattr(builtins, error["type"], None)
+    if not (isinstance(exc_type, type) and issubclass(exc_type, Exception)):
+        exc_type = RuntimeError
+    raise exc_type(error["message"])
+
+
+class DataServiceLoader(BaseLoader):
+    """Loads data through the local `DataService`, from its in-memory cache.
+
+    Example config:
+    {
+        "loader_class": "DataServiceLoader",
+        "socket_path": "/tmp/cio_data_service.sock",  # optional
+        "filename": "../data/spy_mins.parquet",  # or "symbol": "SPY" if known by the service
+        "columns": ["open", "close"],  # optional
+        "start": "2024-01-02",  # optional
+        "end": "2024-01-31 23:59",  # optional
+        "timeframe": "30min",  # optional
+        "fallback": true  # optional, read the file directly if the service is not running
+    }
+
+    Same data as `ParquetDataFrameLoader` with the same config. The first load of a file
+    decodes it in the service, later loads only slice the cached table and send it over the
+    socket, until a writer commits new data to the file.
+    """
+
+    def request(self, sock: socket.socket, request: dict) -> bytearray:
+        payload = json.dumps(request, default=str).encode()
+        sock.sendall(REQUEST_HEADER.pack(len(payload)) + payload)
+        header = recv_exactly(sock, RESPONSE_HEADER.size)
+        if header is None:
+            raise ConnectionError("Connection closed by the data service")
+        status, size = RESPONSE_HEADER.unpack(header)
+        payload = recv_exactly(sock, size) if size else bytearray()
+        if status == ERROR:
+            raise_error(payload)
+        return payload
+
+    def read_table(self):
+        """Returns the requested rows as an arrow table, None if the service is not running."""
+        import pyarrow as pa
+
+        request = {
+            k: self.config[k]
+            for k in ("filename", "symbol", "columns", "start", "end", "timeframe")
+            if self.config.get(k) is not None
+        }
+        if "filename" in request:
+            request["filename"] = os.path.abspath(request["filename"])
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.config.get("socket_path", DEFAULT_SOCKET_PATH))
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if not self.config.get("fallback", True) or "filename" not in self.config:
+                raise
+            return None
+        with sock:
+            payload = self.request(sock, request)
+        return pa.ipc.open_stream(pa.py_buffer(payload)).read_all()
+
+    def iter_data(self) -> Iterator[pd.DataFrame]:
+        import pyarrow as pa
+
+        table = self.read_table()
+        if table is None:
+            yield from ParquetDataFrameLoader(self.config).iter_data()
+            return
+        for batch in table.to_batches():
+            yield pa.Table.from_batches([batch], table.schema).to_pandas()
+
+    def load_data(self):
+        table = self.read_table()
+        if table is None:
+            return ParquetDataFrameLoader(self.config).load_data()
+        return table.to_pandas()
+
+
+def service_stats(socket_path: str = DEFAULT_SOCKET_PATH) -> dict:
+    """Files, size and hit / miss counts of the cache of the service at `socket_path`."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        payload = DataServiceLoader({}).request(sock, {"command": "stats"})
+    return json.loads(payload)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    symbols = dict(symbol.split("=", 1) for symbol in args.symbol)
+    with DataService(args.socket_path, args.cache_mb * 2**20, symbols) as service:
+        print(f"Serving on {args.socket_path}, cache of {args.cache_mb} MiB")
+        service.serve_forever()
@@ -1,11 +1,15 @@
 from __future__ import annotations
 
+import itertools
 import os.path
 from abc import ABC, abstractmethod
+from typing import Iterable
 
 import pandas as pd
 
 import cio.constants as c
+from cio.batching import deduplicate_sorted, iter_rows, iter_sorted, merge_sorted
+from cio.registry import writers
 
 
 class BaseWriter(ABC):
@@ -22,6 +26,16 @@ class BaseWriter(ABC):
     def write_data(self):
         pass
 
+    def write_batches(self, batches: Iterable[pd.DataFrame]):
+        """Writes a stream of DataFrame batches.
+
+        Writers that can write incrementally override this to keep memory bounded, the default
+        collects all batches and calls `write_data`.
+        """
+        batches = list(batches)
+        if batches:
+            self.write_data(pd.concat(batches))
+
 
 class ParquetWriter(BaseWriter):
     """Writes data to Parquet files.
@@ -33,12 +47,107 @@ class ParquetWriter(BaseWriter):
         "writer_params": {
             "append_if_exists": True,
             "sort_index": True,
-            "deduplicate_index": True
+            "deduplicate_index": True,
+            # optional layout, pyarrow defaults otherwise. See benchmarks/parquet_layouts.py
+            "compression": "zstd",  # snappy | zstd | lz4 | gzip | brotli | none
+            "compression_level": 3,
+            "row_group_size": 100000,
+            "use_dictionary": False,
+            "write_statistics": True,
+            # optional, write a dataset directory of part files instead of a single file
+            "dataset": True,
+            "partition_by": "month"  # year | month | day, with "dataset"
         }
     }
+
+    With "sort_index" the index is recorded as the sorting column of every row group, and
+    with "write_statistics" (the default) readers can skip row groups outside of a range,
+    see the "start" / "end" keys of `ParquetDataFrameLoader`.
+
+    With "dataset" the filename is a directory and every write adds new part files to it
+    instead of rewriting the existing data, see `cio.dataset`. Duplicate index values across
+    part files are resolved when reading (last write wins) and by `cio.compaction`, which
+    merges the part files back into large sorted ones.
     """
 
+    # writer_params passed through to pyarrow as is
+    LAYOUT_PARAMS = (
+        "compression",
+        "compression_level",
+        "use_dictionary",
+        "write_statistics",
+    )
+
+    def parquet_options(self, schema) -> dict:
+        """pyarrow writer options from the writer_params, for a table with `schema`."""
+        import pyarrow.parquet as pq
+
+        writer_params = self.config.get("writer_params", {})
+        options = {
+            k: writer_params[k] for k in self.LAYOUT_PARAMS if k in writer_params
+        }
+        index_columns = (schema.pandas_metadata or {}).get("index_columns", [])
+        if (
+            writer_params.get("sort_index", False)
+            and len(index_columns) == 1
+            and isinstance(index_columns[0], str)
+        ):
+            options["sorting_columns"] = [
+                pq.SortingColumn(schema.get_field_index(index_columns[0]))
+            ]
+        return options
+
+    def write_table(self, data: pd.DataFrame, filename: str):
+        """Writes `data` to `filename` with the layout of the writer_params.
+
+        The file is written next to the target and moved in place once complete, so readers
+        (and the cache of `cio.data_service`) never see a partly written file.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(data)
+        tmp_filename = f"{filename}.tmp"
+        try:
+            pq.write_table(
+                table,
+                tmp_filename,
+                row_group_size=self.config.get("writer_params", {}).get(
+                    "row_group_size"
+                ),
+                **self.parquet_options(table.schema),
+            )
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        os.replace(tmp_filename, filename)
+
+    def write_part(self, data: pd.DataFrame, replace: bool = False):
+        """Adds `data` to the dataset directory as new part files."""
+        from cio.dataset import write_parts
+
+        writer_params = self.config.get("writer_params", {})
+        if writer_params.get("sort_index", False):
+            data = data.sort_index(kind="stable")
+        if writer_params.get("deduplicate_index", False):
+            data = data[~data.index.duplicated(keep="last")]
+        write_parts(
+            self.config["filename"],
+            data,
+            self.write_table,
+            partition_by=writer_params.get("partition_by"),
+            replace=replace,
+        )
+
     def write_data(self, data):
+        writer_params = self.config.get("writer_params", {})
+        if writer_params.get("dataset", False):
+            self.write_part(
+                data, replace=not writer_params.get("append_if_exists", False)
+            )
+            return
+
         if "writer_params" in self.config:
             if (
                 "append_if_exists" in self.config["writer_params"]
@@ -47,22 +156,110 @@ class ParquetWriter(BaseWriter):
                 # TODO: For this, assert existing data.schema == new data.schema
                 if os.path.isfile(self.config["filename"]):
                     df = pd.read_parquet(self.config["filename"])
-                    data = pd.concat([df, data])
+                    data = pd.concat([cast_like(df, data), data])
             if (
                 "sort_index" in self.config["writer_params"]
                 and self.config["writer_params"]["sort_index"]
             ):
-                data = data.sort_index()
+                data = data.sort_index(kind="stable")
             if (
                 "deduplicate_index" in self.config["writer_params"]
                 and self.config["writer_params"]["deduplicate_index"]
             ):
                 data = data[~data.index.duplicated(keep="last")]
 
-        data.to_parquet(self.config["filename"])
+        self.write_table(data, self.config["filename"])
 
         return
 
+    def write_batches(self, batches):
+        """Writes the batches one row group at a time, so only one batch is held in memory.
+
+        With "sort_index" the batches have to come in index order. With "append_if_exists" the
+        existing file is merged in as a sorted stream as well, so "deduplicate_index" keeps the
+        new rows. The file is written next to the target and moved in place once complete.
+        With "row_group_size" the batches are re-chunked so every row group has that size.
+
+        With "dataset", every "row_group_size" rows (or every batch) are added as new part
+        files instead.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        from cio.data_loader import ParquetDataFrameLoader
+
+        filename = self.config["filename"]
+        writer_params = self.config.get("writer_params", {})
+        if writer_params.get("dataset", False):
+            if "row_group_size" in writer_params:
+                batches = iter_rows(batches, int(writer_params["row_group_size"]))
+            replace = not writer_params.get("append_if_exists", False)
+            for batch in batches:
+                self.write_part(batch, replace=replace)
+                replace = False
+            return
+
+        sort_index = writer_params.get("sort_index", False)
+        deduplicate_index = writer_params.get("deduplicate_index", False)
+        if deduplicate_index and not sort_index:
+            raise ValueError("deduplicate_index needs sort_index to write batches")
+
+        # peek at the first batch, the existing data is cast to its dtypes
+        batches = iter(batches)
+        first = next(batches, None)
+        if first is not None:
+            batches = itertools.chain([first], batches)
+
+        if sort_index:
+            batches = iter_sorted(batches)
+        if writer_params.get("append_if_exists", False) and os.path.isfile(filename):
+            existing = ParquetDataFrameLoader({"filename": filename}).iter_data()
+            if first is not None:
+                existing = (cast_like(batch, first) for batch in existing)
+            if sort_index:
+                batches = merge_sorted(existing, batches)
+            else:
+                batches = itertools.chain(existing, batches)
+        if deduplicate_index:
+            batches = deduplicate_sorted(batches)
+        if "row_group_size" in writer_params:
+            batches = iter_rows(batches, int(writer_params["row_group_size"]))
+
+        tmp_filename = f"{filename}.tmp"
+        writer = None
+        try:
+            for batch in batches:
+                if writer is None:
+                    table = pa.Table.from_pandas(batch)
+                    writer = pq.ParquetWriter(
+                        tmp_filename, table.schema, **self.parquet_options(table.schema)
+                    )
+                else:
+                    table = pa.Table.from_pandas(batch, schema=writer.schema)
+                writer.write_table(table)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+                os.remove(tmp_filename)
+            raise
+
+        if writer is not None:
+            writer.close()
+            os.replace(tmp_filename, filename)
+
+
+def cast_like(df: pd.DataFrame, like: pd.DataFrame) -> pd.DataFrame:
+    """Casts the columns of `df` to the dtypes of the same columns in `like`.
+
+    Used when appending, for ex. raw klines used to be written as strings and are now typed.
+    """
+    dtypes = {
+        col: like[col].dtype
+        for col in like.columns.intersection(df.columns)
+        if df[col].dtype != like[col].dtype
+    }
+    return df.astype(dtypes) if dtypes else df
+
 
 def write_data(data, config: dict):
     """Based on config, call relevant data writer function.
@@ -71,11 +268,20 @@ def write_data(data, config: dict):
         config (dict): Config Dict object
         data (any): input data to write
     """
-    target = config[c.writer_class]
-    if target == "ParquetWriter":
-        writer = ParquetWriter(config)
-    else:
-        raise ValueError("Not a valid target for data writer")
+    writer = writers.get(config[c.writer_class])(config)
 
     writer.write_data(data)
     return
+
+
+def write_batches(batches: Iterable[pd.DataFrame], config: dict):
+    """Based on config, stream batches of data to the relevant data writer.
+
+    Args:
+        batches (Iterable[pd.DataFrame]): input data to write, in batches
+        config (dict): Config Dict object
+    """
+    writer = writers.get(config[c.writer_class])(config)
+
+    writer.write_batches(batches)
+    return
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import contextlib
+import fcntl
+import functools
+import glob
+import itertools
+import json
+import os
+import time
+import uuid
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from cio.batching import deduplicate_sorted, merge_sorted
+
+MANIFEST = "_manifest.json"
+MANIFEST_LOCK = "_manifest.lock"
+MANIFEST_VERSION = 1
+
+# partition_by -> number of leading characters of an ISO date
+PARTITION_LENGTHS = {"year": 4, "month": 7, "day": 10}
+
+
+def view_filename(filename: str, timeframe: str | None) -> str:
+    """Filename of the `timeframe` view ("5min", "30min", "daily") of the minute data at `filename`.
+
+    Views sit next to the minute data: data/spy_mins.parquet -> data/spy_mins.30min.parquet,
+    data/spy_mins (a dataset directory) -> data/spy_mins.30min.
+    """
+    if timeframe is None:
+        return filename
+    stem, ext = os.path.splitext(filename.rstrip(os.sep))
+    return f"{stem}.{timeframe}{ext}"
+
+
+def is_dataset(path: str) -> bool:
+    """A dataset is a directory of parquet part files, optionally in partition sub-directories."""
+    return os.path.isdir(path)
+
+
+@contextlib.contextmanager
+def manifest_lock(root: str):
+    """Serializes the writers of a dataset (appends and compaction), readers never lock."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, MANIFEST_LOCK), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_manifest(root: str) -> dict:
+    """Reads the manifest of the dataset at `root`.
+
+    The manifest lists the live part files of the dataset with their statistics:
+    {
+        "version": 1,
+        "files": [
+            {
+                "path": "2024-01/part-00000001-1a2b3c4d.parquet",  # relative to root
+                "seq": 1,  # write order, for last-wins between files
+                "rows": 8190,
+                "row_groups": 1,
+                "min": "2024-01-02T09:30:00-05:00",  # index statistics
+                "max": "2024-01-31T15:59:00-05:00",
+                "sorted": true
+            }
+        ],
+        "obsolete": [{"path": "...", "since": 1717171717.0}]  # replaced, deleted later
+    }
+
+    Datasets without a manifest (for ex. written by hand) list all their parquet files,
+    oldest name first.
+    """
+    filename = os.path.join(root, MANIFEST)
+    if os.path.isfile(filename):
+        with open(filename) as f:
+            return json.load(f)
+
+    paths = sorted(
+        os.path.relpath(path, root)
+        for path in glob.glob(os.path.join(root, "**", "*.parquet"), recursive=True)
+    )
+    return {
+        "version": MANIFEST_VERSION,
+        "files": [file_entry(root, path, seq) for seq, path in enumerate(paths, 1)],
+        "obsolete": [],
+    }
+
+
+def write_manifest(root: str, manifest: dict):
+    """Replaces the manifest atomically, readers see either the old or the new dataset."""
+    filename = os.path.join(root, MANIFEST)
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def file_entry(root: str, path: str, seq: int) -> dict:
+    """Manifest entry of the part file `path`, with its index statistics from the footer."""
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(os.path.join(root, path))
+    metadata = parquet_file.metadata
+    entry = {
+        "path": path,
+        "seq": seq,
+        "rows": metadata.num_rows,
+        "row_groups": metadata.num_row_groups,
+        "min": None,
+        "max": None,
+        "sorted": False,
+    }
+
+    schema = parquet_file.schema_arrow
+    index_columns = (schema.pandas_metadata or {}).get("index_columns", [])
+    if len(index_columns) != 1 or not isinstance(index_columns[0], str):
+        return entry
+    col = schema.get_field_index(index_columns[0])
+    mins, maxs = [], []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        stats = row_group.column(col).statistics
+        if stats is None or not stats.has_min_max:
+            return entry
+        mins.append(pd.Timestamp(stats.min))
+        maxs.append(pd.Timestamp(stats.max))
+        if i == 0:
+            sorting = row_group.sorting_columns or ()
+            entry["sorted"] = any(
+                s.column_index == col and not s.descending for s in sorting
+            )
+
+    tz = getattr(schema.field(col).type, "tz", None)
+    if mins:
+        entry["min"], entry["max"] = (
+            (ts.tz_convert(tz) if tz is not None else ts).isoformat()
+            for ts in (min(mins), max(maxs))
+        )
+    return entry
+
+
+def partitions(index: pd.DatetimeIndex, partition_by: str | None) -> np.ndarray:
+    """Partition name ("2024", "2024-01" or "2024-01-02") of every index value, local time."""
+    if partition_by is None:
+        return np.full(len(index), "", dtype=object)
+    length = PARTITION_LENGTHS[partition_by]
+    days = index.normalize()
+    names = pd.Index(days.unique().strftime("%Y-%m-%d").str[:length])
+    return names[days.unique().get_indexer(days)].to_numpy()
+
+
+def write_parts(
+    root: str,
+    data: pd.DataFrame,
+    write_table,
+    partition_by: str | None = None,
+    replace: bool = False,
+):
+    """Adds `data` to the dataset as new part files, one per partition.
+
+    Part files are written first and only become visible to readers once the manifest
+    listing them is in place.
+
+    Args:
+        root (str): Dataset directory.
+        data (pd.DataFrame): Data with a DatetimeIndex, already sorted / deduplicated as needed.
+        write_table (Callable): Writes a DataFrame to a parquet filename.
+        partition_by (str, optional): "year" | "month" | "day". Defaults to no partitioning.
+        replace (bool, optional): Replace all the data of the dataset instead of appending.
+    """
+    with manifest_lock(root):
+        manifest = read_manifest(root)
+        seq = max((entry["seq"] for entry in manifest["files"]), default=0)
+        if replace:
+            retire(manifest, manifest["files"])
+            manifest["files"] = []
+
+        names = partitions(data.index, partition_by)
+        for name in pd.unique(names):
+            seq += 1
+            path = os.path.join(name, f"part-{seq:08d}-{uuid.uuid4().hex[:8]}.parquet")
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+            write_table(data[names == name], os.path.join(root, path))
+            manifest["files"].append(file_entry(root, path, seq))
+
+        write_manifest(root, manifest)
+
+
+def retire(manifest: dict, entries: list):
+    """Moves `entries` to the obsolete files of `manifest`, they are deleted later."""
+    now = time.time()
+    manifest["obsolete"].extend(
+        {"path": entry["path"], "since": now} for entry in entries
+    )
+
+
+def delete_obsolete(root: str, manifest: dict, retention: float) -> list:
+    """Deletes the obsolete files retired more than `retention` seconds ago.
+
+    Readers that listed them in an older manifest have `retention` seconds to open them.
+
+    Returns:
+        list: Paths of the deleted files.
+    """
+    now = time.time()
+    deleted, kept = [], []
+    for entry in manifest["obsolete"]:
+        if now - entry["since"] < retention:
+            kept.append(entry)
+            continue
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(root, entry["path"]))
+        deleted.append(entry["path"])
+    manifest["obsolete"] = kept
+    return deleted
+
+
+def overlap(entries: list) -> bool:
+    """True if the index ranges of `entries` overlap (or are unknown)."""
+    if any(entry["min"] is None for entry in entries):
+        return len(entries) > 1
+    entries = sorted(entries, key=lambda entry: pd.Timestamp(entry["min"]))
+    return any(
+        pd.Timestamp(a["max"]) >= pd.Timestamp(b["min"])
+        for a, b in zip(entries[:-1], entries[1:])
+    )
+
+
+def iter_file(root: str, entry: dict, config: dict) -> Iterator[pd.DataFrame]:
+    """Yields the row groups of one part file, in index order."""
+    from cio.data_loader import ParquetDataFrameLoader
+
+    loader = ParquetDataFrameLoader(
+        {**config, "filename": os.path.join(root, entry["path"]), "timeframe": None}
+    )
+    if entry["sorted"]:
+        yield from loader.iter_data()
+        return
+
+    batches = list(loader.iter_data())
+    if batches:
+        yield pd.concat(batches).sort_index(kind="stable")
+
+
+def iter_entries(
+    root: str, entries: list, config: dict | None = None, deduplicate: bool = True
+) -> Iterator[pd.DataFrame]:
+    """Yields the data of the part files `entries` as one index-sorted stream.
+
+    Files that overlap are merged, rows of later files (higher "seq") come after the rows of
+    earlier files for the same index value, so `deduplicate` keeps the last written row.
+
+    Args:
+        root (str): Dataset directory.
+        entries (list): Manifest entries to read.
+        config (dict, optional): Loader config, for ex. "columns", "start", "end".
+        deduplicate (bool, optional): Drop duplicate index values, last wins. Defaults to
+            True.
+    """
+    config = {} if config is None else config
+    if overlap(entries):
+        entries = sorted(entries, key=lambda entry: entry["seq"])
+        streams: Iterable[Iterable[pd.DataFrame]] = (
+            iter_file(root, entry, config) for entry in entries
+        )
+        batches = functools.reduce(merge_sorted, streams)
+    else:
+        # disjoint files are read one after the other
+        entries = sorted(entries, key=lambda entry: pd.Timestamp(entry["min"]))
+        batches = itertools.chain.from_iterable(
+            iter_file(root, entry, config) for entry in entries
+        )
+    yield from deduplicate_sorted(batches) if deduplicate else batches
+
+
+def select(manifest: dict, start=None, end=None) -> list:
+    """Manifest entries that may hold index values in [start, end]."""
+    entries = []
+    for entry in manifest["files"]:
+        if entry["min"] is not None:
+            if start is not None and pd.Timestamp(entry["max"]) < start:
+                continue
+            if end is not None and pd.Timestamp(entry["min"]) > end:
+                continue
+        entries.append(entry)
+    return entries
+
+
+def iter_dataset(root: str, config: dict) -> Iterator[pd.DataFrame]:
+    """Yields the data of a dataset in index order, last write wins on duplicate index values.
+
+    Only the files and row groups that may hold the "start" / "end" range of `config` are
+    read.
+    """
+    import pyarrow.parquet as pq
+
+    from cio.data_loader import ParquetDataFrameLoader
+
+    manifest = read_manifest(root)
+    start = end = None
+    first = next((entry for entry in manifest["files"] if entry["min"]), None)
+    if first is not None:
+        # localize naive bounds in the timezone of the index field of the parts (the
+        # statistics only hold a fixed UTC offset, an hour off across DST)
+        loader = ParquetDataFrameLoader(
+            {**config, "filename": os.path.join(root, first["path"]), "timeframe": None}
+        )
+        start, end = loader.index_range(pq.ParquetFile(loader.filename))
+    entries = select(manifest, start, end)
+    if entries:
+        yield from iter_entries(root, entries, config)
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import threading
+import time
+from queue import Queue
+
+import pandas as pd
+from ibapi.contract import Contract
+
+import external.ibkr as ibkr
+from cio.data_loader import BaseLoader
+
+BAR_COLUMNS = ["close", "open", "low", "high", "volume", "count"]
+
+DEFAULT_PAGE_SIZE = 10000
+
+
+class IBKRHistoricalDataLoader(BaseLoader):
+    """Loads historical data from IBKR based on config.
+
+    This IBKR implementation connects to the app, loads and disconnects. This makes the app
+    synchronous. What is an ideal solution that can use the same app but can pass custom hanndler functions
+    for each function, for ex, load historical data, send order etc?
+
+    Example config:
+    {
+        "loader_class": "IBKRHistoricalDataLoader",
+        "contract": {
+            "symbol": "SPY",
+            "secType": "STK",
+            "exchange": "SMART",
+            "currency": "USD"
+        },
+        "ibkr_params": {
+            "endDateTime": "20241211 09:30:00 US/Eastern",
+            "durationStr": "1 D",
+            "barSizeSetting": "1 min",
+            "whatToShow": "TRADES",
+            "useRTH": True,
+            "formatDate": 2, #2 stands for epoch seconds - use `localize_index` under loader params
+            "keepUpToDate": False,
+            "chartOptions": []
+        },
+        "page_size": 10000  # optional, bars per yielded batch
+    }
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.bars = Queue()
+        self.historical_query_end = False
+
+    class IBKRHistoricalDataApp(ibkr.IBBaseApp):
+        def __init__(self, main):
+            super().__init__()
+            self.main = main
+
+        # override function from base class
+        def historicalData(self, reqId, bar):
+            """Handler function that gets triggered when IBKR App recieves data for query
+
+            Args:
+                reqId (int): Unique ID passed to identify IBKR contract that data is for
+                bar (IBKR bar): Has fields
+                Date: 12345678, Open: 222.97, High: 222.97, Low: 222.96,
+                    Close: 222.97, Volume: 300, WAP: 222.965, BarCount: 2
+            """
+            self.main.bars.put(
+                (
+                    bar.date,
+                    (bar.close, bar.open, bar.low, bar.high, bar.volume, bar.barCount),
+                )
+            )
+
+        def historicalDataEnd(self, reqId, start, end):
+            print(
+                f"Historical Data Ended for {reqId}. Started at {start}, ending at {end}"
+            )
+            self.cancelHistoricalData(reqId)
+            self.main.historical_query_end = True
+            self.main.bars.put(None)
+
+    def iter_data(self):
+        """Yields the bars of the query window as they arrive, "page_size" bars at a time."""
+        page_size = int(self.config.get("page_size", DEFAULT_PAGE_SIZE))
+
+        # Init App
+        app = self.IBKRHistoricalDataApp(self)
+        app.connect("127.0.0.1", 4002, 0)
+
+        threading.Thread(target=app.run).start()
+        time.sleep(1)
+
+        try:
+            # Send Query
+            ibkr_params = self.config["ibkr_params"]
+            ibkr_params["reqId"] = app.nextId()
+            ibkr_params["contract"] = Contract()
+            for k, v in self.config["contract"].items():
+                setattr(ibkr_params["contract"], k, v)
+            app.reqHistoricalData(**ibkr_params)
+
+            # Consume bars until historicalDataEnd puts the sentinel
+            dates, rows = [], []
+            while True:
+                item = self.bars.get()
+                if item is not None:
+                    dates.append(item[0])
+                    rows.append(item[1])
+                if rows and (item is None or len(rows) >= page_size):
+                    yield pd.DataFrame(rows, index=dates, columns=BAR_COLUMNS)
+                    dates, rows = [], []
+                if item is None:
+                    break
+        finally:
+            app.disconnect()
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import json
+
+import numpy as np
+import pandas as pd
+
+try:
+    # optional, faster JSON parser: `poetry install -E fast-json`
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Column name and dtype of every field of a Binance kline, in payload order
+KLINE_DTYPES = {
+    "kline_open_time": np.int64,
+    "open_price": np.float64,
+    "high_price": np.float64,
+    "low_price": np.float64,
+    "close_price": np.float64,
+    "volume": np.float64,
+    "kline_close_time": np.int64,
+    "quote_asset_volume": np.float64,
+    "number_of_trades": np.int64,
+    "taker_buy_base_asset_volume": np.float64,
+    "taker_buy_quote_asset_volume": np.float64,
+    "NIL": np.float64,
+}
+KLINE_COLUMNS = list(KLINE_DTYPES)
+
+
+def loads(payload: bytes | str):
+    """Parses a JSON payload, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def decode_klines(payload: bytes | str | list) -> pd.DataFrame:
+    """Decodes a Binance klines response into typed columns.
+
+    Binance sends prices and volumes as JSON strings. They are converted column by column
+    straight into numpy arrays (int64 times and trade counts, float64 prices and volumes),
+    without going through a DataFrame of Python objects.
+
+    Args:
+        payload (bytes | str | list): Raw response body, or the already parsed list of klines.
+
+    Returns:
+        pd.DataFrame: One row per kline, with the columns and dtypes of `KLINE_DTYPES`.
+    """
+    klines = payload if isinstance(payload, list) else loads(payload)
+    if not klines:
+        return pd.DataFrame(
+            {col: np.empty(0, dtype=dtype) for col, dtype in KLINE_DTYPES.items()}
+        )
+
+    columns = zip(*klines)
+    return pd.DataFrame(
+        {
+            col: np.array(values, dtype=dtype)
+            for (col, dtype), values in zip(KLINE_DTYPES.items(), columns)
+        }
+    )
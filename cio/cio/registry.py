@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import importlib
+
+LOADER_ENTRY_POINT_GROUP = "cio.loaders"
+WRITER_ENTRY_POINT_GROUP = "cio.writers"
+
+
+class Registry:
+    def __init__(self, kind: str, entry_point_group: str, builtins: dict):
+        """Lazy registry mapping a `loader_class` / `writer_class` name to its implementation.
+
+        Backends are registered as "module:attribute" strings and are only imported the first
+        time their name is requested, so importing `cio.data_loader` does not pull in the
+        HTTP / IBKR stacks (or Binance credentials) of backends that are never used.
+
+        Third-party backends register through the `entry_point_group` entry points, for ex.
+        in the backend's pyproject.toml:
+
+            [tool.poetry.plugins."cio.loaders"]
+            "MyLoader" = "my_package.my_module:MyLoader"
+
+        Args:
+            kind (str): Human-readable kind of backend, used in error messages.
+            entry_point_group (str): Entry point group scanned for third-party backends.
+            builtins (dict): Name to "module:attribute" target for the built-in backends.
+        """
+        self.kind = kind
+        self.entry_point_group = entry_point_group
+        self._targets = dict(builtins)
+        self._classes = {}
+        self._entry_points_loaded = False
+
+    def register(self, name: str, target: str | type):
+        """Register a backend under `name`.
+
+        Args:
+            name (str): Value of `loader_class` / `writer_class` in the config.
+            target (str | type): Either the class itself or a "module:attribute" string
+                that is imported on first use.
+        """
+        self._classes.pop(name, None)
+        if isinstance(target, str):
+            self._targets[name] = target
+        else:
+            self._targets[name] = f"{target.__module__}:{target.__qualname__}"
+            self._classes[name] = target
+
+    def names(self) -> list:
+        """Returns all registered backend names, including entry point backends."""
+        self._load_entry_points()
+        return sorted(self._targets)
+
+    def get(self, name: str) -> type:
+        """Returns the backend class registered under `name`, importing it if needed."""
+        if name in self._classes:
+            return self._classes[name]
+        if name not in self._targets:
+            self._load_entry_points()
+        if name not in self._targets:
+            raise ValueError(f"Not a valid {self.kind}: {name}")
+
+        target = self._targets[name]
+        if isinstance(target, str):
+            module_name, _, attr = target.partition(":")
+            obj = importlib.import_module(module_name)
+            for part in attr.split("."):
+                obj = getattr(obj, part)
+        else:
+            # importlib.metadata.EntryPoint
+            obj = target.load()
+
+        self._classes[name] = obj
+        return obj
+
+    def _load_entry_points(self):
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+        from importlib.metadata import entry_points
+
+        for ep in entry_points(group=self.entry_point_group):
+            # built-ins and explicit registrations win over plugins
+            self._targets.setdefault(ep.name, ep)
+
+
+loaders = Registry(
+    "data source for data loader",
+    LOADER_ENTRY_POINT_GROUP,
+    {
+        "ParquetDataFrameLoader": "cio.data_loader:ParquetDataFrameLoader",
+        "DataServiceLoader": "cio.data_service:DataServiceLoader",
+        "BinanceHistoricalDataLoader": "cio.binance_loader:BinanceHistoricalDataLoader",
+        "IBKRHistoricalDataLoader": "cio.ibkr_loader:IBKRHistoricalDataLoader",
+    },
+)
+
+writers = Registry(
+    "target for data writer",
+    WRITER_ENTRY_POINT_GROUP,
+    {
+        "ParquetWriter": "cio.data_writer:ParquetWriter",
+    },
+)
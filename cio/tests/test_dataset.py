@@ -0,0 +1,35 @@
+import pandas as pd
+
+from cio.data_loader import ParquetDataFrameLoader
+from cio.data_writer import ParquetWriter
+
+
+def minute_bars(*days: str) -> pd.DataFrame:
+    index = pd.DatetimeIndex(
+        [
+            ts
+            for day in days
+            for ts in pd.date_range(f"{day} 09:30", f"{day} 15:59", freq="min")
+        ]
+    ).tz_localize("US/Eastern")
+    return pd.DataFrame({"close": range(len(index))}, index=index.rename("date"))
+
+
+def test_naive_range_across_dst_change(tmp_path):
+    # the first part is in EST (-05:00), the range in EDT (-04:00)
+    data = minute_bars("2024-01-02", "2024-06-27", "2024-06-28")
+    filename = str(tmp_path / "spy_mins")
+    ParquetWriter(
+        {
+            "filename": filename,
+            "writer_params": {"dataset": True, "partition_by": "day"},
+        }
+    ).write_data(data)
+
+    loaded = ParquetDataFrameLoader(
+        {"filename": filename, "start": "2024-06-28 15:30", "end": "2024-06-28 16:00"}
+    ).load_data()
+
+    expected = data.loc["2024-06-28 15:30":"2024-06-28 16:00"]
+    assert len(expected) == 30
+    pd.testing.assert_frame_equal(loaded, expected, check_freq=False)
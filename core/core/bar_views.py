@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from core.minute_grid import NS_PER_DAY, NS_PER_MINUTE
+from core.noise_area_index import NoiseAreaIndex
+
+BAR_COLUMNS = ["open", "high", "low", "close", "volume", "vwap"]
+DAILY_COLUMNS = BAR_COLUMNS + ["prev_close", "mu", "sigma"]
+# bar size of the intraday views, in minutes
+TIMEFRAMES = {"5min": 5, "30min": 30}
+
+
+def _aggregate(df: pd.DataFrame, keys: np.ndarray) -> tuple[np.ndarray, dict]:
+    """OHLCV and vwap of every run of equal `keys`, for rows sorted by `keys`.
+
+    Returns:
+        np.ndarray, dict: First row of every bar and the bar columns.
+    """
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+
+    high = df["high"].to_numpy(dtype=float)
+    low = df["low"].to_numpy(dtype=float)
+    close = df["close"].to_numpy(dtype=float)
+    volume = df["volume"].to_numpy(dtype=float)
+    typical_px = (high + low + close) / 3
+
+    bar_volume = np.add.reduceat(volume, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vwap = np.add.reduceat(typical_px * volume, starts) / bar_volume
+    columns = {
+        "open": df["open"].to_numpy(dtype=float)[starts],
+        "high": np.maximum.reduceat(high, starts),
+        "low": np.minimum.reduceat(low, starts),
+        "close": close[ends],
+        "volume": bar_volume,
+        "vwap": vwap,
+    }
+    return starts, columns
+
+
+def resample_bars(df: pd.DataFrame, minutes: int) -> pd.DataFrame:
+    """Aggregates minute bars into `minutes` bars, like `df.resample(f"{minutes}min")`.
+
+    Bars are aligned on local midnight, so 30 minute bars start at 09:30, 10:00, ... and no
+    bar spans two sessions. Empty bars are not returned.
+
+    Args:
+        df (pd.DataFrame): Minute bars with a sorted datetime index and at least the fields
+            'open', 'high', 'low', 'close', 'volume'.
+        minutes (int): Bar size in minutes.
+
+    Returns:
+        pd.DataFrame: One row per bar, indexed by bar start in the timezone of `df`, with the
+            `BAR_COLUMNS`. vwap is the volume weighted typical price of the bar.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=BAR_COLUMNS, index=df.index[:0], dtype=float)
+
+    local = df.index.tz_localize(None) if df.index.tz is not None else df.index
+    ns = local.as_unit("ns").asi8
+    keys = ns // (minutes * NS_PER_MINUTE)
+    starts, columns = _aggregate(df, keys)
+
+    # bar start, from the first row of the bar to keep its timezone / UTC offset
+    offset = ns[starts] - keys[starts] * (minutes * NS_PER_MINUTE)
+    index = df.index[starts] - pd.to_timedelta(offset, unit="ns").as_unit(df.index.unit)
+    return pd.DataFrame(columns, index=index.rename(df.index.name))
+
+
+def daily_bars(df: pd.DataFrame, lookback_days: int) -> pd.DataFrame:
+    """Aggregates minute bars into one bar per session, with the daily stats of the strategy.
+
+    Args:
+        df (pd.DataFrame): Minute bars, see `resample_bars`. Sessions are local dates.
+        lookback_days (int): Lookback of mu and sigma, see `daily_stats`.
+
+    Returns:
+        pd.DataFrame: One row per session, indexed by session date (local midnight, in the
+            timezone of `df`), with the `DAILY_COLUMNS`.
+    """
+    local = df.index.tz_localize(None) if df.index.tz is not None else df.index
+    days = local.as_unit("ns").asi8 // NS_PER_DAY
+    starts, columns = _aggregate(df, days)
+
+    index = df.index[starts].normalize()
+    daily = pd.DataFrame(columns, index=index.rename(df.index.name))
+    return daily_stats(daily, lookback_days)
+
+
+def daily_stats(daily: pd.DataFrame, lookback_days: int) -> pd.DataFrame:
+    """Adds prev_close, mu and sigma to daily bars.
+
+    mu and sigma of a session only use the closes of the sessions before it, with the same
+    definition as `load_noise_area` (see `NoiseAreaIndex.mu` / `NoiseAreaIndex.sigma`), so
+    they can be read from the daily bars instead of recomputed from minute bars.
+
+    Args:
+        daily (pd.DataFrame): Daily bars, one row per session in order, with a 'close' field.
+        lookback_days (int): Number of sessions mu and sigma are calculated over.
+
+    Returns:
+        pd.DataFrame: `daily` with the `DAILY_COLUMNS`.
+    """
+    day_close = daily["close"].to_numpy(dtype=float)
+    sessions = np.arange(len(daily))
+    index = NoiseAreaIndex.from_day_close(day_close, daily.index)
+
+    daily = daily[BAR_COLUMNS].copy()
+    daily["prev_close"] = daily["close"].shift(1)
+    daily["mu"] = index.mu(sessions, lookback_days)
+    daily["sigma"] = index.sigma(sessions, lookback_days)
+    return daily
@@ -0,0 +1,392 @@
+from __future__ import annotations
+
+import datetime
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from core.minute_grid import (
+    MINUTES_PER_DAY,
+    NS_PER_DAY,
+    NS_PER_MINUTE,
+    SessionSpec,
+    factorize,
+)
+
+WEEKDAYS = (0, 1, 2, 3, 4)
+# examples of every kind of anomaly kept in the report, the counts are always exact
+MAX_EXAMPLES = 100
+GAP_KINDS = ("open", "intraday", "close")
+ANOMALY_KINDS = ("duplicate", "unsorted", "outside_session", "ohlc", "zero_volume")
+GAP_COLUMNS = ["session", "start", "end", "minutes", "kind"]
+SESSION_COLUMNS = [
+    "session",
+    "rows",
+    "expected",
+    "missing",
+    "first_minute",
+    "last_minute",
+    "gaps",
+    "zero_volume",
+    "ohlc_errors",
+]
+
+
+class QualityReport:
+    def __init__(
+        self,
+        sessions: pd.DataFrame,
+        gaps: pd.DataFrame,
+        anomalies: pd.DataFrame,
+        anomaly_counts: dict,
+        missing_sessions: pd.DatetimeIndex,
+        session: SessionSpec,
+    ):
+        """Gaps and anomalies of a minute bar dataset, see `scan`.
+
+        Args:
+            sessions (pd.DataFrame): One row per session (`SESSION_COLUMNS`): rows, expected
+                minutes, missing minutes, first and last minute of the session with data,
+                number of gaps, zero volume bars and bars with inconsistent OHLC.
+            gaps (pd.DataFrame): Runs of missing minutes (`GAP_COLUMNS`), wall time of the
+                first and last missing minute. Kinds: "open" (session starting late),
+                "intraday", "close" (session ending early).
+            anomalies (pd.DataFrame): Examples of bad rows (timestamp, kind), at most
+                `MAX_EXAMPLES` per kind. Kinds: "duplicate", "unsorted", "outside_session",
+                "ohlc", "zero_volume".
+            anomaly_counts (dict): Number of rows of every anomaly kind.
+            missing_sessions (pd.DatetimeIndex): Expected sessions without any data.
+            session (SessionSpec): Session definition the data was checked against.
+        """
+        self.sessions = sessions
+        self.gaps = gaps
+        self.anomalies = anomalies
+        self.anomaly_counts = anomaly_counts
+        self.missing_sessions = missing_sessions
+        self.session = session
+
+    @property
+    def ok(self) -> bool:
+        return not (
+            len(self.gaps)
+            or len(self.missing_sessions)
+            or any(self.anomaly_counts.values())
+        )
+
+    def summary(self) -> dict:
+        """Counts of the report, JSON serializable."""
+        sessions = self.sessions
+        first = last = late_by = None
+        if len(sessions):
+            first, last = str(sessions["session"].iloc[0]), str(
+                sessions["session"].iloc[-1]
+            )
+        late = sessions.loc[sessions["first_minute"] > 0, "first_minute"]
+        if len(late):
+            late_by = int(late.mode().iloc[0])
+        return {
+            "session": repr(self.session),
+            "sessions": len(sessions),
+            "first_session": first,
+            "last_session": last,
+            "rows": int(sessions["rows"].sum()),
+            "missing_minutes": int(sessions["missing"].sum()),
+            "missing_sessions": len(self.missing_sessions),
+            "gaps": {
+                kind: int((self.gaps["kind"] == kind).sum()) for kind in GAP_KINDS
+            },
+            # timezone / DST mistakes show up as many sessions opening late by one offset
+            "late_open_sessions": len(late),
+            "most_common_late_open_minutes": late_by,
+            **{kind: int(count) for kind, count in self.anomaly_counts.items()},
+        }
+
+    def __str__(self) -> str:
+        return "\n".join(f"{key}: {value}" for key, value in self.summary().items())
+
+
+class DataQualityScanner:
+    def __init__(
+        self,
+        session: SessionSpec | dict | None = None,
+        weekdays: Iterable[int] | None = None,
+        holidays: Iterable | None = None,
+        early_closes: dict | None = None,
+        end: pd.Timestamp | str | None = None,
+    ):
+        """Checks minute bars against the expected minute grid of their sessions, batch by batch.
+
+        Every session is expected to hold a bar for every minute from its start to its end
+        (`session`), or to its early close, and the dataset a session for every trading day
+        between its first and last session. The checks are array operations over the int64
+        timestamps, O(n) for sorted data, so decades of minute bars scan in seconds.
+
+        Batches (for ex. the row groups or partitions of a parquet dataset) have to come in time
+        order. The rows of the last session of a batch are carried over to the next batch, so
+        sessions split across batches are checked as a whole.
+
+        Args:
+            session (SessionSpec | dict, optional): Session definition, see `SessionSpec`.
+                Defaults to calendar dates in the timezone of the data.
+            weekdays (Iterable[int], optional): Trading weekdays, Monday is 0. Defaults to
+                Monday to Friday for sessions shorter than a day, every day otherwise.
+            holidays (Iterable, optional): Dates (session start dates) without session.
+            early_closes (dict, optional): Session start date to wall time of its close, for
+                ex. {"2024-11-29": "13:00"}.
+            end (pd.Timestamp | str, optional): End of the data, minutes after it are not
+                expected, for ex. the last fetched bar of a session still trading.
+        """
+        self.session = SessionSpec.from_config(session) or SessionSpec()
+        if weekdays is None:
+            weekdays = WEEKDAYS if self.session.length < MINUTES_PER_DAY else range(7)
+        self.weekdays = np.array(sorted(weekdays))
+        self.holidays = _days(pd.DatetimeIndex(list(holidays or [])))
+        # sorted by day, like `_days`
+        early_closes = sorted(
+            (pd.Timestamp(date), datetime.time.fromisoformat(str(close)))
+            for date, close in (early_closes or {}).items()
+        )
+        self.early_close_days = _days(
+            pd.DatetimeIndex([date for date, _ in early_closes])
+        )
+        self.early_close_lengths = np.array(
+            [
+                close.hour * 60 + close.minute - self.session.anchor_minute
+                for _, close in early_closes
+            ],
+            dtype=np.int64,
+        )
+        self.end = None
+        if end is not None:
+            end_day, end_offset = self.session.bucket(
+                pd.DatetimeIndex([pd.Timestamp(end)])
+            )
+            self.end = (int(end_day[0]), int(end_offset[0]))
+
+        self.tail = None
+        self.results = {"sessions": [], "gaps": []}
+        self.examples = {}
+        self.counts = {kind: 0 for kind in ANOMALY_KINDS}
+
+    def update(self, batch: pd.DataFrame):
+        """Scans the complete sessions of `batch`, keeps its last session for the next batch."""
+        if batch.empty:
+            return
+        if self.tail is not None:
+            batch = pd.concat([self.tail, batch])
+        days = self.session.bucket(batch.index)[0]
+        in_last = days == days[-1]
+        self.tail = batch[in_last]
+        self.scan(batch[~in_last])
+
+    def report(self) -> QualityReport:
+        """Scans the carried over last session and returns the report of all batches."""
+        if self.tail is not None:
+            self.scan(self.tail)
+            self.tail = None
+        sessions = _concat(self.results["sessions"], SESSION_COLUMNS)
+        gaps = _concat(self.results["gaps"], GAP_COLUMNS)
+        anomalies = _concat(list(self.examples.values()), ["timestamp", "kind"])
+        return QualityReport(
+            sessions,
+            gaps,
+            anomalies,
+            dict(self.counts),
+            self.missing_sessions(sessions),
+            self.session,
+        )
+
+    def missing_sessions(self, sessions: pd.DataFrame) -> pd.DatetimeIndex:
+        """Trading days between the first and last session without a session."""
+        if sessions.empty:
+            return pd.DatetimeIndex([])
+        observed = _days(pd.DatetimeIndex(sessions["session"]))
+        days = np.arange(observed.min(), observed.max() + 1)
+        # 1970-01-01, day 0, was a Thursday
+        expected = np.isin((days + 3) % 7, self.weekdays) & ~np.isin(
+            days, self.holidays
+        )
+        missing = days[expected & ~np.isin(days, observed)]
+        return pd.DatetimeIndex(
+            missing * NS_PER_DAY + self.session.anchor_minute * NS_PER_MINUTE,
+            dtype="datetime64[ns]",
+        )
+
+    def add_anomalies(self, kind: str, timestamps: pd.Index):
+        self.counts[kind] += len(timestamps)
+        examples = self.examples.get(kind)
+        n_kept = 0 if examples is None else len(examples)
+        if len(timestamps) and n_kept < MAX_EXAMPLES:
+            new = pd.DataFrame(
+                {"timestamp": timestamps[: MAX_EXAMPLES - n_kept], "kind": kind}
+            )
+            self.examples[kind] = (
+                new
+                if examples is None
+                else pd.concat([examples, new], ignore_index=True)
+            )
+
+    def scan(self, df: pd.DataFrame):
+        """Checks the rows of whole sessions."""
+        if df.empty:
+            return
+        ts = df.index.as_unit("ns").asi8
+
+        # order and duplicates, on the timestamps, then on sorted unique rows only
+        unsorted = np.flatnonzero(ts[1:] < ts[:-1]) + 1
+        self.add_anomalies("unsorted", df.index[unsorted])
+        if len(unsorted):
+            order = np.argsort(ts, kind="stable")
+            df, ts = df.iloc[order], ts[order]
+        duplicate = np.zeros(len(ts), dtype=bool)
+        duplicate[1:] = ts[1:] == ts[:-1]
+        self.add_anomalies("duplicate", df.index[duplicate])
+        if duplicate.any():
+            df = df[~duplicate]
+
+        days, offsets = self.session.bucket(df.index)
+        session_days, codes = factorize(days)
+        expected = self.expected_lengths(session_days)
+        inside = offsets < expected[codes]
+        self.add_anomalies("outside_session", df.index[~inside])
+        if not inside.all():
+            df, days, offsets = df[inside], days[inside], offsets[inside]
+            session_days, codes = factorize(days)
+            expected = self.expected_lengths(session_days)
+        if df.empty:
+            return
+
+        n_sessions = len(session_days)
+        starts = np.flatnonzero(np.diff(codes, prepend=-1))
+        ends = np.append(starts[1:], len(codes))
+        rows = ends - starts
+        first, last = offsets[starts], offsets[ends - 1]
+        session_starts = pd.DatetimeIndex(
+            session_days * NS_PER_DAY + self.session.anchor_minute * NS_PER_MINUTE,
+            dtype="datetime64[ns]",
+        )
+
+        # runs of missing minutes: before the first bar, between bars and after the last bar
+        between = np.flatnonzero((np.diff(offsets) > 1) & (codes[1:] == codes[:-1]))
+        late = np.flatnonzero(first > 0)
+        early = np.flatnonzero(last < expected - 1)
+        gaps = pd.DataFrame(
+            {
+                "session": np.concatenate([late, codes[between], early]),
+                "start": np.concatenate(
+                    [
+                        np.zeros(len(late), dtype=np.int64),
+                        offsets[between] + 1,
+                        last[early] + 1,
+                    ]
+                ),
+                "end": np.concatenate(
+                    [first[late] - 1, offsets[between + 1] - 1, expected[early] - 1]
+                ),
+                "kind": np.repeat(GAP_KINDS, [len(late), len(between), len(early)]),
+            }
+        ).sort_values(["session", "start"], ignore_index=True)
+        gap_sessions = gaps["session"].to_numpy()
+        gaps["minutes"] = gaps["end"] - gaps["start"] + 1
+        for column in ("start", "end"):
+            gaps[column] = session_starts[gap_sessions] + pd.to_timedelta(
+                gaps[column].to_numpy(), unit="min"
+            )
+        gaps["session"] = session_starts[gap_sessions]
+        self.results["gaps"].append(gaps[GAP_COLUMNS])
+
+        zero_volume = np.zeros(len(df), dtype=bool)
+        if "volume" in df:
+            zero_volume = df["volume"].to_numpy(dtype=float) == 0
+            self.add_anomalies("zero_volume", df.index[zero_volume])
+        ohlc_errors = np.zeros(len(df), dtype=bool)
+        if {"open", "high", "low", "close"}.issubset(df.columns):
+            open_px, high, low, close = (
+                df[c].to_numpy(dtype=float) for c in ("open", "high", "low", "close")
+            )
+            # negated comparisons so NaN prices count as errors
+            ohlc_errors = ~(
+                (low <= np.minimum(open_px, close))
+                & (high >= np.maximum(open_px, close))
+                & (low > 0)
+            )
+            self.add_anomalies("ohlc", df.index[ohlc_errors])
+
+        self.results["sessions"].append(
+            pd.DataFrame(
+                {
+                    "session": session_starts,
+                    "rows": rows,
+                    "expected": expected,
+                    "missing": expected - rows,
+                    "first_minute": first,
+                    "last_minute": last,
+                    "gaps": np.bincount(gap_sessions, minlength=n_sessions),
+                    "zero_volume": np.bincount(
+                        codes, weights=zero_volume, minlength=n_sessions
+                    ).astype(np.int64),
+                    "ohlc_errors": np.bincount(
+                        codes, weights=ohlc_errors, minlength=n_sessions
+                    ).astype(np.int64),
+                }
+            )
+        )
+
+    def expected_lengths(self, session_days: np.ndarray) -> np.ndarray:
+        """Expected minutes of every session, shortened by early closes and `end`."""
+        expected = np.full(len(session_days), self.session.length, dtype=np.int64)
+        if len(self.early_close_days):
+            position = np.searchsorted(self.early_close_days, session_days)
+            position = np.minimum(position, len(self.early_close_days) - 1)
+            early = self.early_close_days[position] == session_days
+            expected[early] = self.early_close_lengths[position[early]]
+        if self.end is not None:
+            end_day, end_offset = self.end
+            expected[session_days == end_day] = np.minimum(
+                expected[session_days == end_day], end_offset + 1
+            )
+        return expected
+
+
+def _days(dates: pd.DatetimeIndex) -> np.ndarray:
+    """Days since epoch of the (wall time) dates, sorted."""
+    dates = dates.tz_localize(None) if dates.tz is not None else dates
+    return np.sort(dates.as_unit("ns").asi8 // NS_PER_DAY)
+
+
+def _concat(frames: list, columns: list) -> pd.DataFrame:
+    frames = [frame for frame in frames if not frame.empty]
+    return (
+        pd.concat(frames, ignore_index=True)
+        if frames
+        else pd.DataFrame(columns=columns)
+    )
+
+
+def scan(df: pd.DataFrame, **kwargs) -> QualityReport:
+    """Scans minute bars with a datetime index for gaps and anomalies.
+
+    Checks every session against its expected minute grid and reports runs of missing
+    minutes, missing sessions, duplicate and unsorted timestamps, rows outside of the
+    sessions, zero volume bars and bars with inconsistent OHLC (low above open / close, high
+    below open / close, non positive or NaN prices). Timezone mistakes show up as rows outside
+    of the sessions and as many sessions opening late by the same number of minutes.
+
+    Args:
+        df (pd.DataFrame): Minute bars with a datetime index and 'open', 'high', 'low',
+            'close', 'volume' columns (checks of missing columns are skipped).
+        kwargs: See `DataQualityScanner`.
+
+    Returns:
+        QualityReport: Gaps and anomalies, `str(report)` gives a compact summary.
+    """
+    return scan_batches([df], **kwargs)
+
+
+def scan_batches(batches: Iterable[pd.DataFrame], **kwargs) -> QualityReport:
+    """`scan` of minute bars streamed in time ordered batches, for ex. the partitions of a dataset."""
+    scanner = DataQualityScanner(**kwargs)
+    for batch in batches:
+        scanner.update(batch)
+    return scanner.report()
@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+NS_PER_MINUTE = 60 * 10**9
+MINUTES_PER_DAY = 24 * 60
+NS_PER_DAY = MINUTES_PER_DAY * NS_PER_MINUTE
+
+
+class SessionSpec:
+    def __init__(
+        self,
+        anchor: str | datetime.time = "00:00",
+        length: int = MINUTES_PER_DAY,
+        timezone: str | None = None,
+    ):
+        """Definition of the sessions of a market: start time, length and timezone.
+
+        A session starts every day at `anchor`, wall time of `timezone`, and lasts `length`
+        minutes. The default, midnight to midnight in the timezone of the data, is the
+        calendar date session used for RTH equities. For 24/7 markets the anchor picks the
+        session boundary, for ex. `SessionSpec("00:00", timezone="UTC")` for the Binance
+        daily candle or `SessionSpec("17:00", timezone="America/New_York")` for CME hours.
+
+        Minutes are offsets from the session start in wall time, so on DST changes a session
+        anchored in a DST timezone keeps its local start and the repeated hour (if any)
+        lands on the same offsets.
+
+        Args:
+            anchor (str | datetime.time, optional): Session start, "HH:MM". Defaults to
+                "00:00".
+            length (int, optional): Session length in minutes, at most a day. Defaults to a
+                day.
+            timezone (str, optional): Timezone of the anchor, tz aware indexes are converted
+                to it and naive indexes are taken as wall time of it. Defaults to the
+                timezone of the index.
+        """
+        if isinstance(anchor, str):
+            anchor = datetime.time.fromisoformat(anchor)
+        if not 0 < length <= MINUTES_PER_DAY:
+            raise ValueError(f"Session length has to be in (0, 1440] minutes: {length}")
+        self.anchor = anchor
+        self.length = int(length)
+        self.timezone = timezone
+
+    @classmethod
+    def from_config(cls, config: dict | SessionSpec | None) -> SessionSpec | None:
+        """Session from a config like {"anchor": "00:00", "length": 1440, "timezone": "UTC"}."""
+        if config is None or isinstance(config, SessionSpec):
+            return config
+        return cls(**config)
+
+    @property
+    def anchor_minute(self) -> int:
+        """Minute of the day of the session start."""
+        return self.anchor.hour * 60 + self.anchor.minute
+
+    def __repr__(self):
+        return (
+            f"SessionSpec(anchor={self.anchor:%H:%M}, length={self.length}, "
+            f"timezone={self.timezone})"
+        )
+
+    def wall_time(self, index: pd.DatetimeIndex) -> np.ndarray:
+        """Wall time of `index` in the session timezone, as int64 ns."""
+        if self.timezone is not None:
+            if index.tz is None:
+                index = index.tz_localize(self.timezone)
+            else:
+                index = index.tz_convert(self.timezone)
+        local = index.tz_localize(None) if index.tz is not None else index
+        return local.as_unit("ns").asi8
+
+    def bucket(self, index: pd.DatetimeIndex) -> tuple[np.ndarray, np.ndarray]:
+        """Session and minute of the session of every timestamp, in one vectorized pass.
+
+        Returns:
+            np.ndarray: Session of every timestamp, as days since epoch of its start date.
+            np.ndarray: Minutes since the session start, >= `length` outside of the session.
+        """
+        shifted = self.wall_time(index) - self.anchor_minute * NS_PER_MINUTE
+        days = shifted // NS_PER_DAY
+        return days, (shifted - days * NS_PER_DAY) // NS_PER_MINUTE
+
+    def contains(self, index: pd.DatetimeIndex) -> np.ndarray:
+        """True for the timestamps of `index` within a session."""
+        return self.bucket(index)[1] < self.length
+
+
+def factorize(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """`np.unique(values, return_inverse=True)` of int values, in O(n) if sorted."""
+    if len(values) and (values[1:] >= values[:-1]).all():
+        is_new = np.empty(len(values), dtype=bool)
+        is_new[0] = True
+        np.not_equal(values[1:], values[:-1], out=is_new[1:])
+        return values[is_new], np.cumsum(is_new) - 1
+    return np.unique(values, return_inverse=True)
+
+
+class MinuteGrid:
+    def __init__(
+        self,
+        values: np.ndarray,
+        mask: np.ndarray,
+        sessions: pd.DatetimeIndex,
+        minutes: np.ndarray,
+        rows: np.ndarray | None = None,
+        cols: np.ndarray | None = None,
+        index: pd.DatetimeIndex | None = None,
+        groups: np.ndarray | None = None,
+        anchor: int = 0,
+    ):
+        """Dense sessions x minute-of-session grid of intraday values.
+
+        Row `i` is the session `sessions[i]`, column `j` is the minute `minutes[j]` (minutes
+        since the session start, that is since midnight local time for calendar date
+        sessions, see `SessionSpec`). `mask` flags the cells that were observed, `values` is
+        NaN for the cells that were not (unless filled, for ex. with `ffill`).
+
+        Grids built from long format data keep the position of every source row (`rows`,
+        `cols`), so values can be mapped back to the long format with `to_long` without any
+        merge. Grids derived from one another share that layout.
+
+        A grid can stack several independent series, for ex. one per symbol: `groups` then
+        holds the group of every row, rows are sorted by group then session, and operations
+        across sessions (`ffill`, `rolling_mean`, `group_tail_mean`) stay within a group.
+
+        Args:
+            values (np.ndarray): 2-D float array, shape (n_sessions, n_minutes).
+            mask (np.ndarray): 2-D bool array, True where a value was observed.
+            sessions (pd.DatetimeIndex): Session starts (wall time, tz naive), one per row.
+            minutes (np.ndarray): Minute of the session of each column, int.
+            rows (np.ndarray, optional): Row of each source row in long format.
+            cols (np.ndarray, optional): Column of each source row in long format.
+            index (pd.DatetimeIndex, optional): Index of the long format source.
+            groups (np.ndarray, optional): Group of each row, int codes. Defaults to a
+                single group.
+            anchor (int, optional): Minute of the day of the session start. Defaults to
+                midnight.
+        """
+        self.values = values
+        self.mask = mask
+        self.sessions = sessions
+        self.minutes = minutes
+        self.rows = rows
+        self.cols = cols
+        self.index = index
+        self.groups = groups
+        self.anchor = anchor
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @classmethod
+    def from_index(
+        cls,
+        index: pd.DatetimeIndex,
+        groups: np.ndarray | None = None,
+        session: SessionSpec | None = None,
+    ) -> MinuteGrid:
+        """Builds an empty grid with one row per session and one column per minute in `index`.
+
+        Sessions are the local calendar dates of `index` by default, tz aware indexes are
+        bucketed on their local wall time, or the sessions of `session`. Everything is
+        derived from the int64 representation of the index in a single vectorized pass, in
+        O(n) for a sorted index.
+
+        Args:
+            index (pd.DatetimeIndex): Intraday timestamps, for ex. the index of minute bars.
+            groups (np.ndarray, optional): Group of each timestamp as int codes, for ex. the
+                symbol of a panel. Rows are then one per (group, session).
+            session (SessionSpec, optional): Session definition. Defaults to calendar dates.
+
+        Returns:
+            MinuteGrid: Grid with all values NaN and nothing observed. Use `scatter` to fill it.
+        """
+        session = SessionSpec() if session is None else session
+        days, offsets = session.bucket(index)
+        if len(offsets) and offsets.max() >= session.length:
+            raise ValueError(
+                f"Timestamps outside of the sessions of {session}, "
+                "select them with `SessionSpec.contains`"
+            )
+
+        row_groups = None
+        if groups is None:
+            days, rows = factorize(days)
+        else:
+            # one key per (group, day), sorted by group then day
+            first_day = days.min() if len(days) else 0
+            span = days.max() - first_day + 1 if len(days) else 1
+            keys = np.asarray(groups, dtype=np.int64) * span + (days - first_day)
+            keys, rows = np.unique(keys, return_inverse=True)
+            row_groups, days = keys // span, keys % span + first_day
+        # observed minutes of the session, by counting instead of sorting
+        observed = np.bincount(offsets, minlength=session.length) > 0
+        minutes = np.flatnonzero(observed)
+        cols = (np.cumsum(observed) - 1)[offsets]
+        sessions = pd.DatetimeIndex(
+            days * NS_PER_DAY + session.anchor_minute * NS_PER_MINUTE,
+            dtype="datetime64[ns]",
+        )
+
+        shape = (len(sessions), len(minutes))
+        return cls(
+            np.full(shape, np.nan),
+            np.zeros(shape, dtype=bool),
+            sessions,
+            minutes,
+            rows,
+            cols,
+            index,
+            row_groups,
+            session.anchor_minute,
+        )
+
+    @classmethod
+    def from_series(cls, s: pd.Series) -> MinuteGrid:
+        """Builds a grid from a long format series with an intraday datetime index."""
+        return cls.from_index(s.index).scatter(s.to_numpy(dtype=float))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, columns: list | None = None) -> dict:
+        """Builds one grid per column of a long format DataFrame, all sharing one layout.
+
+        Returns:
+            dict: Column name to MinuteGrid.
+        """
+        layout = cls.from_index(df.index)
+        columns = df.columns if columns is None else columns
+        return {col: layout.scatter(df[col].to_numpy(dtype=float)) for col in columns}
+
+    @classmethod
+    def from_wide(cls, wide: pd.DataFrame) -> MinuteGrid:
+        """Builds a grid from a wide DataFrame, dates as index and `datetime.time` as columns."""
+        sessions = pd.DatetimeIndex(pd.to_datetime(wide.index)).as_unit("ns")
+        minutes = np.array([t.hour * 60 + t.minute for t in wide.columns])
+        values = wide.to_numpy(dtype=float)
+        return cls(values, ~np.isnan(values), sessions, minutes)
+
+    def scatter(self, values: np.ndarray) -> MinuteGrid:
+        """Returns a grid with the same layout holding `values`, given in long format order."""
+        assert self.rows is not None, "Grid has no long format layout to scatter into"
+        grid = np.full(self.shape, np.nan)
+        grid[self.rows, self.cols] = values
+        mask = np.zeros(self.shape, dtype=bool)
+        mask[self.rows, self.cols] = True
+        return self.like(grid, mask)
+
+    def like(self, values: np.ndarray, mask: np.ndarray | None = None) -> MinuteGrid:
+        """Returns a grid with the same layout and new values."""
+        mask = self.mask if mask is None else mask
+        return MinuteGrid(
+            values,
+            mask,
+            self.sessions,
+            self.minutes,
+            self.rows,
+            self.cols,
+            self.index,
+            self.groups,
+            self.anchor,
+        )
+
+    def to_long(self) -> np.ndarray:
+        """Returns the values at the positions of the long format source rows."""
+        assert self.rows is not None, "Grid has no long format layout to gather from"
+        return self.values[self.rows, self.cols]
+
+    def to_series(self, name: str | None = None) -> pd.Series:
+        """Returns the values in long format, indexed like the source (or by timestamp of the observed cells)."""
+        if self.rows is not None:
+            return pd.Series(self.to_long(), index=self.index, name=name)
+
+        rows, cols = np.nonzero(self.mask)
+        index = pd.DatetimeIndex(
+            self.sessions.asi8[rows] + self.minutes[cols] * NS_PER_MINUTE,
+            dtype="datetime64[ns]",
+        )
+        return pd.Series(self.values[rows, cols], index=index, name=name)
+
+    def to_wide(self) -> pd.DataFrame:
+        """Returns the grid as a wide DataFrame with session dates as index and `datetime.time` as columns."""
+        return pd.DataFrame(
+            self.values,
+            index=pd.Index(self.session_dates(), name="date"),
+            columns=pd.Index(self.minute_times(), name="minute"),
+        )
+
+    def session_dates(self) -> np.ndarray:
+        """Session dates as `datetime.date` objects, one per row."""
+        return self.sessions.date
+
+    def minute_times(self) -> np.ndarray:
+        """Minutes as `datetime.time` objects (wall time), one per column."""
+        minute_of_day = (self.anchor + self.minutes) % MINUTES_PER_DAY
+        return pd.DatetimeIndex(
+            minute_of_day * NS_PER_MINUTE, dtype="datetime64[ns]"
+        ).time
+
+    def first(self) -> np.ndarray:
+        """First observed value of every session."""
+        first_col = self.mask.argmax(axis=1)
+        return self.values[np.arange(self.shape[0]), first_col]
+
+    def last(self) -> np.ndarray:
+        """Last observed value of every session."""
+        last_col = self.shape[1] - 1 - self.mask[:, ::-1].argmax(axis=1)
+        return self.values[np.arange(self.shape[0]), last_col]
+
+    def group_starts(self) -> np.ndarray:
+        """Row of the first session of the group of every row."""
+        n_rows = self.shape[0]
+        if self.groups is None:
+            return np.zeros(n_rows, dtype=np.int64)
+        is_start = np.ones(n_rows, dtype=bool)
+        is_start[1:] = self.groups[1:] != self.groups[:-1]
+        return np.flatnonzero(is_start)[np.cumsum(is_start) - 1]
+
+    def session_cumsum(self) -> MinuteGrid:
+        """Cumulative sum within every session, in minute order, skipping unobserved cells."""
+        csum = np.cumsum(np.where(self.mask, self.values, 0), axis=1)
+        return self.like(np.where(self.mask, csum, np.nan))
+
+    def ffill(self) -> MinuteGrid:
+        """Forward fills every minute column with the last observed value of previous sessions."""
+        values = self.values
+        valid = ~np.isnan(values)
+        last_valid = np.where(valid, np.arange(values.shape[0])[:, None], -1)
+        last_valid = np.maximum.accumulate(last_valid, axis=0)
+        filled = values[np.maximum(last_valid, 0), np.arange(values.shape[1])]
+        # never fill from the previous group
+        filled[last_valid < self.group_starts()[:, None]] = np.nan
+        return self.like(filled)
+
+    def rolling_mean(self, window: int, shift: int = 0) -> MinuteGrid:
+        """Rolling mean over the last `window` sessions of each minute column.
+
+        Like `DataFrame.rolling(window, min_periods=window).mean().shift(shift)`: the mean is
+        NaN unless all `window` sessions hold a value.
+        """
+        values = self.values
+        valid = ~np.isnan(values)
+        n_cols = values.shape[1]
+        csum = np.vstack(
+            [np.zeros(n_cols), np.cumsum(np.where(valid, values, 0), axis=0)]
+        )
+        count = np.vstack([np.zeros(n_cols), np.cumsum(valid, axis=0)])
+
+        mean = np.full(values.shape, np.nan)
+        if window <= values.shape[0]:
+            wsum = csum[window:] - csum[:-window]
+            wcount = count[window:] - count[:-window]
+            mean[window - 1 :] = np.where(wcount == window, wsum / window, np.nan)
+        # windows never span two groups
+        rows, starts = np.arange(values.shape[0]), self.group_starts()
+        mean[rows - window + 1 < starts] = np.nan
+        if shift:
+            mean = np.vstack([np.full((shift, n_cols), np.nan), mean[:-shift]])
+            mean[rows - shift < starts] = np.nan
+        return self.like(mean)
+
+    def tail_mean(self, n: int) -> pd.Series:
+        """Mean of the last `n` sessions of each minute column, skipping NaN, indexed by `datetime.time`."""
+        tail = self.values[-n:]
+        count = (~np.isnan(tail)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.nansum(tail, axis=0) / count
+        mean[count == 0] = np.nan
+        return pd.Series(mean, index=pd.Index(self.minute_times(), name="minute"))
+
+    def group_tail_mean(self, n: int) -> np.ndarray:
+        """`tail_mean` of every group, shape (groups, minutes), groups in row order."""
+        values = self.values
+        valid = ~np.isnan(values)
+        n_cols = values.shape[1]
+        csum = np.vstack(
+            [np.zeros(n_cols), np.cumsum(np.where(valid, values, 0), axis=0)]
+        )
+        count = np.vstack([np.zeros(n_cols), np.cumsum(valid, axis=0)])
+
+        starts = np.unique(self.group_starts())
+        ends = np.append(starts[1:], values.shape[0])
+        tail_starts = np.maximum(ends - n, starts)
+        total = csum[ends] - csum[tail_starts]
+        total_count = count[ends] - count[tail_starts]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(total_count > 0, total / total_count, np.nan)
+
+    def broadcast(self, per_session: np.ndarray) -> np.ndarray:
+        """Maps one value per session to the long format source rows."""
+        assert self.rows is not None, "Grid has no long format layout to broadcast to"
+        return np.asarray(per_session)[self.rows]
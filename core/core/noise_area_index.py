@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from core.minute_grid import MinuteGrid
+
+
+def _prefix_sums(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns prefix sums of `values` along the first axis, skipping NaN, and prefix counts of non NaN values.
+
+    Both have one extra leading row of zeros, so the sum over rows [a, b) is `sums[b] - sums[a]`.
+    """
+    valid = ~np.isnan(values)
+    zeros = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate([zeros, np.cumsum(np.where(valid, values, 0), axis=0)])
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    return sums, counts
+
+
+class NoiseAreaIndex:
+    def __init__(self, moves: MinuteGrid, day_close: np.ndarray):
+        """Prefix sum index to query the noise area stats at any lookback in O(1).
+
+        Holds cumulative sums over sessions of the (forward filled) per-minute moves and of the
+        daily returns (and their squares). The avg_move, mu and sigma of `load_noise_area` for
+        any (session, minute, lookback) are then a difference of two prefix sums, so a
+        lookback sweep does not need a rolling pass over the moves per lookback.
+
+        Sessions and minutes are positions in `moves`, a query for session `s` only uses the
+        sessions before `s`, like `load_noise_area`. If `moves` stacks several groups (for ex.
+        symbols), windows never reach into the previous group.
+
+        Args:
+            moves (MinuteGrid): Forward filled abs. moves from the day open, sessions x minutes.
+            day_close (np.ndarray): Close of every session in `moves`.
+        """
+        self.moves = moves
+        self.day_close = np.asarray(day_close, dtype=float)
+        self.move_sums, self.move_counts = _prefix_sums(moves.values)
+        # first session of the group of every session
+        self.first_session = moves.group_starts()
+
+        returns = np.full(len(self.day_close), np.nan)
+        returns[1:] = self.day_close[1:] / self.day_close[:-1] - 1
+        returns[self.first_session == np.arange(len(returns))] = np.nan
+        self.returns = returns
+        self.return_sums, self.return_counts = _prefix_sums(returns)
+        self.squared_return_sums, _ = _prefix_sums(returns**2)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> NoiseAreaIndex:
+        """Builds the index from intraday data with datetime index and at least 'open', 'close'."""
+        grid = MinuteGrid.from_index(df.index)
+        close_px = df["close"].to_numpy(dtype=float)
+        day_open = grid.broadcast(
+            grid.scatter(df["open"].to_numpy(dtype=float)).first()
+        )
+        moves = grid.scatter(np.abs((close_px / day_open) - 1)).ffill()
+        return cls(moves, grid.scatter(close_px).last())
+
+    @classmethod
+    def from_day_close(
+        cls, day_close: np.ndarray, sessions: pd.DatetimeIndex
+    ) -> NoiseAreaIndex:
+        """Builds an index of daily stats only (`mu`, `sigma`), for ex. from daily bars.
+
+        The index has no minute columns, `avg_move` is not available.
+        """
+        n_sessions = len(sessions)
+        moves = MinuteGrid(
+            np.empty((n_sessions, 0)),
+            np.zeros((n_sessions, 0), dtype=bool),
+            sessions,
+            np.empty(0, dtype=np.int64),
+        )
+        return cls(moves, day_close)
+
+    @property
+    def n_sessions(self) -> int:
+        return len(self.day_close)
+
+    def session_loc(self, date) -> int:
+        """Position of the session of `date`."""
+        return self.moves.sessions.get_loc(pd.Timestamp(date).normalize())
+
+    def minute_loc(self, minute) -> int:
+        """Position of the minute column of `minute` (a `datetime.time`)."""
+        return int(
+            np.searchsorted(self.moves.minutes, minute.hour * 60 + minute.minute)
+        )
+
+    def avg_move(self, session, lookback, minute=None) -> np.ndarray:
+        """Mean move of the `lookback` sessions before `session`.
+
+        Args:
+            session (int | np.ndarray): Session position(s).
+            lookback (int | np.ndarray): Lookback(s) in sessions, broadcast against `session`.
+            minute (int | np.ndarray, optional): Minute column position(s), broadcast against
+                `session`. Defaults to all minutes, as a trailing axis.
+
+        Returns:
+            np.ndarray: avg_move, NaN where the window is not complete.
+        """
+        sums, counts = self.move_sums, self.move_counts
+        session, lookback = np.broadcast_arrays(
+            np.asarray(session), np.asarray(lookback)
+        )
+        start = session - lookback
+        valid = start >= self.first_session[session]
+        start = np.where(valid, start, 0)
+        if minute is None:
+            total = sums[session] - sums[start]
+            count = counts[session] - counts[start]
+            valid, lookback = valid[..., None], lookback[..., None]
+        else:
+            total = sums[session, minute] - sums[start, minute]
+            count = counts[session, minute] - counts[start, minute]
+        return np.where(valid & (count == lookback), total / lookback, np.nan)
+
+    def mu(self, session, lookback) -> np.ndarray:
+        """Mean daily return of the `lookback` sessions before `session`."""
+        session, lookback = np.asarray(session), np.asarray(lookback)
+        start = session - lookback
+        valid = start >= self.first_session[session]
+        start = np.where(valid, start, 0)
+        total = self.return_sums[session] - self.return_sums[start]
+        count = self.return_counts[session] - self.return_counts[start]
+        return np.where(valid & (count == lookback), total / lookback, np.nan)
+
+    def sigma(self, session, lookback) -> np.ndarray:
+        """Volatility used to size positions on `session`, same definition as in `load_noise_area`.
+
+        That is the root of the sum of squared deviations from `mu` of the daily returns of
+        sessions [session - lookback + 1, session - 2], divided by `lookback - 1`.
+        """
+        session, lookback = np.asarray(session), np.asarray(lookback)
+        mu = self.mu(session, lookback)
+        start = np.clip(
+            session - lookback + 1, self.first_session[session], self.n_sessions
+        )
+        end = np.clip(session - 1, start, self.n_sessions)
+        n = end - start
+        s1 = self.return_sums[end] - self.return_sums[start]
+        s2 = self.squared_return_sums[end] - self.squared_return_sums[start]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variance = np.maximum(s2 - 2 * mu * s1 + n * mu**2, 0) / (lookback - 1)
+        return np.sqrt(variance)
+
+    def avg_move_grid(self, lookback: int) -> MinuteGrid:
+        """avg_move of every session and minute for one lookback, as a grid like `moves`."""
+        return self.moves.like(self.avg_move(np.arange(self.n_sessions), lookback))
+
+    def avg_move_all(self, lookbacks) -> np.ndarray:
+        """avg_move of every session and minute for all `lookbacks`, shape (lookbacks, sessions, minutes)."""
+        lookbacks = np.asarray(lookbacks)[:, None]
+        return self.avg_move(np.arange(self.n_sessions)[None, :], lookbacks)
+
+    def mu_all(self, lookbacks) -> np.ndarray:
+        """mu of every session for all `lookbacks`, shape (lookbacks, sessions)."""
+        lookbacks = np.asarray(lookbacks)[:, None]
+        return self.mu(np.arange(self.n_sessions)[None, :], lookbacks)
+
+    def sigma_all(self, lookbacks) -> np.ndarray:
+        """sigma of every session for all `lookbacks`, shape (lookbacks, sessions)."""
+        lookbacks = np.asarray(lookbacks)[:, None]
+        return self.sigma(np.arange(self.n_sessions)[None, :], lookbacks)
@@ -0,0 +1,430 @@
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core.minute_grid import MINUTES_PER_DAY, NS_PER_MINUTE, factorize
+
+TRADING_DAYS = 252
+DEFAULT_PATHS = 10_000
+# paths simulated per process pool task, bounds the (paths x days) arrays held per task
+PATHS_PER_TASK = 1_000
+METRICS = ["sharpe", "max_drawdown", "hit_rate", "total_return"]
+
+
+class StrategyReturns:
+    def __init__(
+        self,
+        noise_area: pd.DataFrame,
+        trade_freq: int = 30,
+        volatility_target: float = 0.02,
+        max_leverage: float = 3.0,
+        cost: float = 0.0,
+    ):
+        """Daily and trade level returns of the noise area strategy, from `load_noise_area`.
+
+        Every `trade_freq` minutes (on the clock, :00 and :30 by default) the position is set
+        like the live strategy (see `order_gateway.target_direction`): long above the upper
+        bound unless below the vwap, short below the lower bound unless above the vwap, flat
+        otherwise, and flat at the close of every session. The position of a session is
+        sized `min(max_leverage, volatility_target / sigma)`, sessions without sigma do not
+        trade. Returns are summed (not compounded) within a session.
+
+        Args:
+            noise_area (pd.DataFrame): Output of `load_noise_area`, rows in time order.
+            trade_freq (int, optional): Minutes between decisions. Defaults to 30.
+            volatility_target (float, optional): Daily volatility target. Defaults to 0.02.
+            max_leverage (float, optional): Max. leverage. Defaults to 3.
+            cost (float, optional): Cost per unit of traded notional, charged at the entry
+                and at the exit of every trade. Defaults to 0.
+        """
+        df = noise_area
+        n = len(df)
+        close = df["close"].to_numpy(dtype=float)
+        session_dates, codes = factorize(
+            pd.DatetimeIndex(pd.to_datetime(df["date"])).as_unit("ns").asi8
+        )
+        is_first = np.diff(codes, prepend=-1) != 0
+        is_last = np.append(codes[1:] != codes[:-1], True)
+        session_starts = np.flatnonzero(is_first)
+        session_ends = np.flatnonzero(is_last)
+
+        # position set at every decision and held until the next one, flat at the close
+        minute_of_day = (df.index.as_unit("ns").asi8 // NS_PER_MINUTE) % MINUTES_PER_DAY
+        decision = (minute_of_day % trade_freq == 0) & ~is_last
+        vwap = df["vwap"].to_numpy(dtype=float)
+        upper = df["upper_bound"].to_numpy(dtype=float)
+        lower = df["lower_bound"].to_numpy(dtype=float)
+        signal = np.where(
+            (close > upper) & ~(close < vwap),
+            1,
+            np.where((close < lower) & ~(close > vwap), -1, 0),
+        )
+        last_decision = np.maximum.accumulate(np.where(decision, np.arange(n), -1))
+        held = last_decision >= session_starts[codes]
+        position = np.where(held, signal[np.maximum(last_decision, 0)], 0)
+        position[is_last] = 0
+
+        leverage = np.minimum(
+            max_leverage, volatility_target / df["sigma"].to_numpy(dtype=float)
+        )
+        leverage = np.nan_to_num(leverage, nan=0.0, posinf=0.0)[session_starts]
+        position[leverage[codes] == 0] = 0
+
+        # trades are the runs of one direction, every session ends flat
+        prev = np.where(is_first, 0, np.roll(position, 1))
+        change = position != prev
+        entries = np.flatnonzero(change & (position != 0))
+        exits = np.flatnonzero(change & (prev != 0))
+
+        minute_returns = np.zeros(n)
+        minute_returns[1:] = close[1:] / close[:-1] - 1
+        minute_returns[is_first] = 0
+        self.cumulative = np.cumsum(minute_returns)
+
+        trade_sessions = codes[entries]
+        direction = position[entries]
+        trade_leverage = leverage[trade_sessions]
+        gross = direction * (self.cumulative[exits] - self.cumulative[entries])
+        trade_returns = trade_leverage * (gross - 2 * cost)
+
+        sessions = pd.DatetimeIndex(session_dates, dtype="datetime64[ns]")
+        self.cost = cost
+        self.session_starts = session_starts
+        self.session_ends = session_ends
+        self.trades = pd.DataFrame(
+            {
+                "session": sessions[trade_sessions],
+                "entry": df.index[entries],
+                "exit": df.index[exits],
+                "direction": direction,
+                "minutes": exits - entries,
+                "leverage": trade_leverage,
+                "return": trade_returns,
+            }
+        )
+        self.trade_sessions = trade_sessions
+        self.daily = pd.Series(
+            np.bincount(trade_sessions, trade_returns, minlength=len(sessions)),
+            index=pd.Index(sessions, name="date"),
+            name="return",
+        )
+
+
+def path_metrics(
+    paths: np.ndarray, periods_per_year: int | None = TRADING_DAYS
+) -> dict:
+    """Sharpe, max. drawdown, hit rate and total return of every path, in one batched pass.
+
+    Args:
+        paths (np.ndarray): Returns, shape (paths, periods).
+        periods_per_year (int, optional): Periods per year to annualize the Sharpe ratio,
+            None for a Sharpe per period (for ex. of trade returns). Defaults to 252.
+
+    Returns:
+        dict: Metric name to one value per path. The hit rate is the share of positive
+            returns among the non zero returns, the drawdown is on compounded returns.
+    """
+    paths = np.atleast_2d(paths)
+    std = paths.std(axis=1, ddof=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sharpe = paths.mean(axis=1) / std
+        hit_rate = (paths > 0).sum(axis=1) / (paths != 0).sum(axis=1)
+    if periods_per_year is not None:
+        sharpe = sharpe * np.sqrt(periods_per_year)
+    equity = np.cumprod(1 + paths, axis=1)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), 1)
+    return {
+        "sharpe": sharpe,
+        "max_drawdown": (1 - equity / peak).max(axis=1),
+        "hit_rate": hit_rate,
+        "total_return": equity[:, -1] - 1,
+    }
+
+
+# Simulations, each returns a batch of paths of returns (paths, periods)
+def block_bootstrap_paths(
+    rng: np.random.Generator, n_paths: int, returns: np.ndarray, block: int
+) -> np.ndarray:
+    """Moving block bootstrap: paths of `len(returns)` periods, made of random blocks."""
+    n = len(returns)
+    block = min(block, n)
+    n_blocks = -(-n // block)
+    starts = rng.integers(0, n - block + 1, size=(n_paths, n_blocks))
+    rows = (starts[:, :, None] + np.arange(block)).reshape(n_paths, -1)[:, :n]
+    return returns[rows]
+
+
+def randomized_entry_paths(
+    rng: np.random.Generator,
+    n_paths: int,
+    cumulative: np.ndarray,
+    session_starts: np.ndarray,
+    session_ends: np.ndarray,
+    trade_sessions: np.ndarray,
+    minutes: np.ndarray,
+    direction: np.ndarray,
+    leverage: np.ndarray,
+    n_sessions: int,
+    cost: float,
+    keep_direction: bool,
+) -> np.ndarray:
+    """Daily returns of the trades of the strategy entered at random minutes of their session.
+
+    Every trade keeps its session, duration and leverage (and its direction with
+    `keep_direction`), its entry is drawn uniformly among the minutes where it fits in the
+    session and its direction at random.
+    """
+    start = session_starts[trade_sessions]
+    room = session_ends[trade_sessions] - start - minutes + 1
+    entries = start + (rng.random((n_paths, len(minutes))) * room).astype(np.int64)
+    if not keep_direction:
+        direction = 2 * rng.integers(0, 2, size=(n_paths, len(minutes))) - 1
+    gross = direction * (cumulative[entries + minutes] - cumulative[entries])
+    returns = leverage * (gross - 2 * cost)
+
+    daily = np.zeros((n_paths, n_sessions))
+    # trades come in session order
+    sessions, first_trade = np.unique(trade_sessions, return_index=True)
+    if len(sessions):
+        daily[:, sessions] = np.add.reduceat(returns, first_trade, axis=1)
+    return daily
+
+
+SIMULATIONS = {
+    "block_bootstrap": block_bootstrap_paths,
+    "randomized_entry": randomized_entry_paths,
+}
+# data of the simulation of a worker process, sent once per process
+_worker_data = {}
+
+
+def _init_worker(data: dict):
+    _worker_data.clear()
+    _worker_data.update(data)
+
+
+def _simulate_task(task: tuple) -> dict:
+    kind, n_paths, seed, periods_per_year = task
+    rng = np.random.default_rng(seed)
+    paths = SIMULATIONS[kind](rng, n_paths, **_worker_data)
+    return path_metrics(paths, periods_per_year)
+
+
+class SimulationResult:
+    def __init__(
+        self,
+        name: str,
+        observed: dict,
+        metrics: pd.DataFrame,
+        seconds: float,
+        n_jobs: int,
+    ):
+        """Metrics of the simulated paths of a robustness run, against the observed ones.
+
+        Args:
+            name (str): Simulation, see `SIMULATIONS`.
+            observed (dict): Metrics of the strategy returns, see `path_metrics`.
+            metrics (pd.DataFrame): Metrics of every simulated path, one row per path.
+            seconds (float): Wall time of the run.
+            n_jobs (int): Processes of the run.
+        """
+        self.name = name
+        self.observed = observed
+        self.metrics = metrics
+        self.seconds = seconds
+        self.n_jobs = n_jobs
+
+    @property
+    def n_paths(self) -> int:
+        return len(self.metrics)
+
+    def bands(self, confidence: float = 0.9) -> pd.DataFrame:
+        """Confidence bands of every metric over the simulated paths.
+
+        Returns:
+            pd.DataFrame: Index metric, columns observed, lower, median, upper (quantiles of
+                the paths, NaN paths skipped) and p_value, the share of paths with a metric
+                at least as good as observed (lower for the drawdown).
+        """
+        alpha = (1 - confidence) / 2
+        quantiles = self.metrics.quantile([alpha, 0.5, 1 - alpha]).T
+        quantiles.columns = ["lower", "median", "upper"]
+        observed = pd.Series({m: float(self.observed[m][0]) for m in METRICS})
+        at_least = {
+            m: (
+                self.metrics[m] <= observed[m]
+                if m == "max_drawdown"
+                else self.metrics[m] >= observed[m]
+            ).mean()
+            for m in METRICS
+        }
+        bands = pd.concat(
+            [
+                observed.rename("observed"),
+                quantiles,
+                pd.Series(at_least, name="p_value"),
+            ],
+            axis=1,
+        )
+        bands.index.name = "metric"
+        return bands
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.n_paths:,} paths in {self.seconds:.2f}s "
+            f"({self.n_paths / self.seconds:,.0f} paths / s, {self.n_jobs} processes)\n"
+            f"{self.bands().round(4).to_string()}"
+        )
+
+
+def simulate(
+    name: str,
+    data: dict,
+    observed: np.ndarray,
+    n_paths: int = DEFAULT_PATHS,
+    periods_per_year: int | None = TRADING_DAYS,
+    n_jobs: int | None = None,
+    seed: int | None = 0,
+) -> SimulationResult:
+    """Runs `n_paths` paths of the simulation `name` in batches of `PATHS_PER_TASK`.
+
+    Batches are spread over a process pool of `n_jobs` processes, each process receives
+    `data` once. Every batch draws from its own child seed of `seed`, so results do not
+    depend on `n_jobs`.
+
+    Args:
+        name (str): Simulation, see `SIMULATIONS`.
+        data (dict): Keyword arguments of the simulation.
+        observed (np.ndarray): Returns of the strategy, the observed path.
+        n_paths (int, optional): Number of simulated paths. Defaults to `DEFAULT_PATHS`.
+        periods_per_year (int, optional): See `path_metrics`. Defaults to 252.
+        n_jobs (int, optional): Processes, 1 runs in this process. Defaults to the
+            `ProcessPoolExecutor` default.
+        seed (int, optional): Seed of the simulation. Defaults to 0.
+    """
+    started = time.perf_counter()
+    sizes = [PATHS_PER_TASK] * (n_paths // PATHS_PER_TASK)
+    if n_paths % PATHS_PER_TASK:
+        sizes.append(n_paths % PATHS_PER_TASK)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(name, size, s, periods_per_year) for size, s in zip(sizes, seeds)]
+
+    if n_jobs == 1:
+        _init_worker(data)
+        results = [_simulate_task(task) for task in tasks]
+        _worker_data.clear()
+    else:
+        with ProcessPoolExecutor(
+            n_jobs, initializer=_init_worker, initargs=(data,)
+        ) as pool:
+            results = list(pool.map(_simulate_task, tasks))
+
+    metrics = pd.DataFrame(
+        {m: np.concatenate([r[m] for r in results]) for m in METRICS}
+    )
+    return SimulationResult(
+        name,
+        path_metrics(observed, periods_per_year),
+        metrics,
+        time.perf_counter() - started,
+        n_jobs or os.cpu_count(),
+    )
+
+
+def block_bootstrap(
+    returns: pd.Series | np.ndarray,
+    n_paths: int = DEFAULT_PATHS,
+    block: int = 5,
+    periods_per_year: int | None = TRADING_DAYS,
+    n_jobs: int | None = None,
+    seed: int | None = 0,
+) -> SimulationResult:
+    """Block bootstrap of daily or trade level returns, for ex. `StrategyReturns.daily`.
+
+    Resamples the returns in blocks of `block` consecutive periods, which keeps their short
+    term autocorrelation and volatility clustering, to get the distribution of the metrics
+    over histories the strategy could as well have seen.
+
+    For ex. for trade level returns, without annualization:
+
+        block_bootstrap(StrategyReturns(noise_area).trades["return"], periods_per_year=None)
+
+    Args:
+        returns (pd.Series | np.ndarray): Returns of the strategy, in time order.
+        n_paths (int, optional): Number of paths. Defaults to `DEFAULT_PATHS`.
+        block (int, optional): Block length, in periods. Defaults to 5.
+        periods_per_year (int, optional): See `path_metrics`. Defaults to 252.
+        n_jobs (int, optional): Processes, see `simulate`.
+        seed (int, optional): Seed. Defaults to 0.
+
+    Returns:
+        SimulationResult: Metrics of the paths, see `SimulationResult.bands`.
+    """
+    returns = np.asarray(returns, dtype=float)
+    return simulate(
+        "block_bootstrap",
+        {"returns": returns, "block": block},
+        returns,
+        n_paths,
+        periods_per_year,
+        n_jobs,
+        seed,
+    )
+
+
+def randomized_entry(
+    strategy: StrategyReturns,
+    n_paths: int = DEFAULT_PATHS,
+    keep_direction: bool = False,
+    periods_per_year: int | None = TRADING_DAYS,
+    n_jobs: int | None = None,
+    seed: int | None = 0,
+) -> SimulationResult:
+    """Monte Carlo of the strategy trades entered at random times, on the same price history.
+
+    Every path keeps the number, sessions, durations and leverage of the trades and draws
+    their entries and directions at random, so the p_value of `SimulationResult.bands` is
+    the chance for random trades of the same exposure to do as well as the strategy.
+
+    With `keep_direction` the trades keep their direction. As the direction was chosen from
+    the move of the session so far, random entries before the signal then profit from it:
+    that null only tells how much the exact entry time adds.
+
+    Args:
+        strategy (StrategyReturns): Strategy returns from the noise area.
+        n_paths (int, optional): Number of paths. Defaults to `DEFAULT_PATHS`.
+        keep_direction (bool, optional): Keep the trade directions. Defaults to False.
+        periods_per_year (int, optional): See `path_metrics`. Defaults to 252.
+        n_jobs (int, optional): Processes, see `simulate`.
+        seed (int, optional): Seed. Defaults to 0.
+
+    Returns:
+        SimulationResult: Metrics of the daily returns of the paths.
+    """
+    trades = strategy.trades
+    data = {
+        "cumulative": strategy.cumulative,
+        "session_starts": strategy.session_starts,
+        "session_ends": strategy.session_ends,
+        "trade_sessions": strategy.trade_sessions,
+        "minutes": trades["minutes"].to_numpy(),
+        "direction": trades["direction"].to_numpy(),
+        "leverage": trades["leverage"].to_numpy(),
+        "n_sessions": len(strategy.daily),
+        "cost": strategy.cost,
+        "keep_direction": keep_direction,
+    }
+    return simulate(
+        "randomized_entry",
+        data,
+        strategy.daily.to_numpy(),
+        n_paths,
+        periods_per_year,
+        n_jobs,
+        seed,
+    )
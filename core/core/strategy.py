@@ -1,14 +1,41 @@
 from __future__ import annotations
 
-from typing import Tuple
+from collections import deque
+from typing import Iterable, Iterator, Tuple
 
 import numpy as np
 import pandas as pd
 
+from core.minute_grid import MinuteGrid, SessionSpec
+from core.noise_area_index import NoiseAreaIndex
+
+NOISE_AREA_COLUMNS = [
+    "date",
+    "minute",
+    "open",
+    "close",
+    "high",
+    "low",
+    "volume",
+    "vwap",
+    "day_open",
+    "day_close",
+    "prev_close",
+    "move",
+    "avg_move",
+    "mu",
+    "sigma",
+    "upper_bound",
+    "lower_bound",
+]
+
 
 # Intraday momentum based on dynamic noise area
 def load_noise_area(
-    df: pd.DataFrame, lookback_days: int, volatility_multiplier: float
+    df: pd.DataFrame,
+    lookback_days: int,
+    volatility_multiplier: float,
+    session: SessionSpec | dict | None = None,
 ) -> Tuple[pd.DataFrame, pd.Series]:
     """Following the paper on intraday momentum from concretum research, this function returns noise area.
 
@@ -22,6 +49,10 @@ def load_noise_area(
             datetime index, and with at least the following fields: 'open', 'close'
         lookback_days (int): Number of days to calculate the avg_move over
         volatility_multiplier (float): Volatility multiplier to scale the noise area.
+        session (SessionSpec | dict, optional): Session definition (anchor, length and
+            timezone), for ex. {"anchor": "00:00", "timezone": "UTC"} for 24/7 crypto data.
+            Rows outside of the sessions are dropped. Defaults to calendar dates in the
+            timezone of the index.
 
     Returns:
         pd.DataFrame: DataFrame with columns:
@@ -31,97 +62,287 @@ def load_noise_area(
     assert (
         len(df) >= lookback_days
     ), f"Not enough input data in the dataframe, lookback days: {lookback_days}, length of df: {len(df)}"
-    df["date"] = df.index.date
-    df["minute"] = df.index.time
+    session = SessionSpec.from_config(session)
+    if session is not None:
+        df = df[session.contains(df.index)]
+    # sessions x minutes layout of the input rows, used instead of groupby / pivot / melt / merge
+    grid = MinuteGrid.from_index(df.index, session=session)
+    noise_area, moves = _noise_area(df, grid, lookback_days, volatility_multiplier)
+    latest_avg = moves.tail_mean(lookback_days)
 
-    # calculate VWAP
-    df["typical_px"] = (df["high"] + df["low"] + df["close"]) / 3
-    df["typical_px"] = df["typical_px"] * df["volume"]
-    df["vwap"] = (
-        df.groupby(df.index.date)["typical_px"].cumsum()
-        / df.groupby(df.index.date)["volume"].cumsum()
+    index = df.index.tz_localize(None) if df.index.tz is not None else df.index
+    noise_area.index = pd.DatetimeIndex(index, name="datetime")
+    return noise_area, latest_avg
+
+
+def load_universe_noise_area(
+    panel: pd.DataFrame,
+    lookback_days: int,
+    volatility_multiplier: float,
+    symbol: str = "symbol",
+    session: SessionSpec | dict | None = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """`load_noise_area` of many symbols at once, in one vectorized pass over the whole panel.
+
+    All symbols share a single (symbol, session) x minute grid, so the cost is a handful of
+    numpy passes over the total number of rows instead of one `load_noise_area` per symbol.
+    Lookback windows, forward fills and prev_close never cross from one symbol to the next.
+
+    Args:
+        panel (pd.DataFrame): Intraday data of all symbols, with the fields of
+            `load_noise_area`, either indexed by (symbol, datetime) or in long format with a
+            datetime index and a `symbol` column. All symbols share the index timezone.
+        lookback_days (int): Number of days to calculate the avg_move over
+        volatility_multiplier (float): Volatility multiplier to scale the noise area.
+        symbol (str, optional): Name of the symbol index level / column. Defaults to "symbol".
+        session (SessionSpec | dict, optional): Session definition, see `load_noise_area`.
+
+    Returns:
+        pd.DataFrame: Rows of `panel` (within the sessions) in the same order, indexed by (symbol, datetime), with
+            the columns of `load_noise_area`.
+        pd.DataFrame: avg_move over the latest n lookback_days sessions of each symbol, with
+            symbols as index and minutes as columns.
+    """
+    session = SessionSpec.from_config(session)
+    if session is not None:
+        times = (
+            panel.index.droplevel(symbol)
+            if isinstance(panel.index, pd.MultiIndex)
+            else panel.index
+        )
+        panel = panel[session.contains(times)]
+    if isinstance(panel.index, pd.MultiIndex):
+        # reuse the codes of the symbol level, no need to factorize the symbols again
+        panel_index = panel.index.remove_unused_levels()
+        level = panel_index.names.index(symbol)
+        codes, names = panel_index.codes[level], panel_index.levels[level]
+        times = panel_index.droplevel(level)
+        assert isinstance(
+            times, pd.DatetimeIndex
+        ), f"Expected a (symbol, datetime) index, got {panel.index.names}"
+    else:
+        codes, names = pd.factorize(panel[symbol], sort=True)
+        times = panel.index
+
+    grid = MinuteGrid.from_index(times, groups=codes, session=session)
+    noise_area, moves = _noise_area(panel, grid, lookback_days, volatility_multiplier)
+    # groups come in row order of the grid, that is in code order
+    latest_avg = pd.DataFrame(
+        moves.group_tail_mean(lookback_days),
+        index=pd.Index(names[np.unique(codes)], name=symbol),
+        columns=pd.Index(moves.minute_times(), name="minute"),
     )
 
-    # store daily close and open values
-    daily_data = df.groupby("date").agg(
-        day_open=("open", "first"), day_close=("close", "last")
+    times = times.tz_localize(None) if times.tz is not None else times
+    noise_area.index = pd.MultiIndex.from_arrays(
+        [pd.Categorical.from_codes(codes, names), times], names=[symbol, "datetime"]
     )
-    daily_data["prev_close"] = daily_data["day_close"].shift(1)
+    return noise_area, latest_avg
 
-    # stats for vol scaling
-    daily_data["mu"] = (
-        daily_data["day_close"].pct_change().rolling(lookback_days).mean().shift(1)
-    )  # see pg.14 on the paper
-    daily_data["sigma"] = np.nan
 
-    # last row is 't', the window's first row pct_change == NaN, so we add +2.
-    for window in daily_data.rolling(lookback_days + 2):
-        if len(window) < (lookback_days + 2):
-            continue
-        sigma = (
-            window[1:lookback_days]["day_close"].pct_change()
-            - window.loc[window.index[-1], "mu"]
-        )
-        sigma = sigma**2
-        sigma = sigma.sum() / (lookback_days - 1)
-        daily_data.loc[window.index[-1], "sigma"] = np.sqrt(sigma)
+def _noise_area(
+    df: pd.DataFrame, grid: MinuteGrid, lookback_days: int, volatility_multiplier: float
+) -> Tuple[pd.DataFrame, MinuteGrid]:
+    """Noise area columns of the rows of `df`, laid out on `grid`, without index.
+
+    Returns:
+        pd.DataFrame: The `NOISE_AREA_COLUMNS`, in the row order of `df`.
+        MinuteGrid: Forward filled abs. moves from the day open, sessions x minutes.
+    """
+    open_px = df["open"].to_numpy(dtype=float)
+    close_px = df["close"].to_numpy(dtype=float)
+    volume = df["volume"].to_numpy(dtype=float)
+
+    # calculate VWAP
+    typical_px = (
+        df["high"].to_numpy(dtype=float) + df["low"].to_numpy(dtype=float) + close_px
+    ) / 3
+    vwap = (
+        grid.scatter(typical_px * volume).session_cumsum().to_long()
+        / grid.scatter(volume).session_cumsum().to_long()
+    )
 
-    df = df.merge(daily_data, left_on="date", right_index=True)
+    # store daily close and open values, prev_close is NaN on the first session of a group
+    day_open = grid.scatter(open_px).first()
+    day_close = grid.scatter(close_px).last()
+    prev_close = np.full(len(day_close), np.nan)
+    prev_close[1:] = day_close[:-1]
+    prev_close[grid.group_starts() == np.arange(len(day_close))] = np.nan
 
     # calculat avg move
-    df["move"] = ((df["close"] / df["day_open"]) - 1).abs()
+    move = np.abs((close_px / grid.broadcast(day_open)) - 1)
 
     # ffill to fill up data for those days where market closes at 13:00
-    pivoted_table = pd.pivot_table(df, "move", index="date", columns="minute").ffill()
-    avg_move = (
-        pivoted_table.rolling(lookback_days, min_periods=lookback_days).mean().shift()
-    )
-    latest_avg = pivoted_table[-lookback_days:].mean()
-    latest_avg.index = pivoted_table.columns
-
-    avg_move = pd.melt(
-        avg_move.reset_index(),
-        id_vars="date",
-        value_vars=list(avg_move.columns),
-        var_name="minute",
-        value_name="avg_move",
-    )
-    df = df.merge(avg_move, left_on=["date", "minute"], right_on=["date", "minute"])
+    moves = grid.scatter(move).ffill()
+    index = NoiseAreaIndex(moves, day_close)
+    sessions = np.arange(index.n_sessions)
+
+    # stats for vol scaling, see pg.14 on the paper and `NoiseAreaIndex.sigma`
+    mu = index.mu(sessions, lookback_days)
+    sigma = index.sigma(sessions, lookback_days)
+    avg_move = index.avg_move_grid(lookback_days).to_long()
 
-    df["datetime"] = pd.to_datetime(
-        df["date"].astype(str) + df["minute"].astype(str), format="%Y-%m-%d%H:%M:%S"
+    df = pd.DataFrame(
+        {
+            "date": grid.broadcast(grid.session_dates()),
+            "minute": grid.minute_times()[grid.cols],
+            "open": df["open"].to_numpy(),
+            "close": df["close"].to_numpy(),
+            "high": df["high"].to_numpy(),
+            "low": df["low"].to_numpy(),
+            "volume": df["volume"].to_numpy(),
+            "vwap": vwap,
+            "day_open": grid.broadcast(day_open),
+            "day_close": grid.broadcast(day_close),
+            "prev_close": grid.broadcast(prev_close),
+            "move": move,
+            "avg_move": avg_move,
+            "mu": grid.broadcast(mu),
+            "sigma": grid.broadcast(sigma),
+        }
     )
 
-    df.index = df["datetime"]
-    df = df[
-        [
-            "date",
-            "minute",
-            "open",
-            "close",
-            "high",
-            "low",
-            "volume",
-            "vwap",
-            "day_open",
-            "day_close",
-            "prev_close",
-            "move",
-            "avg_move",
-            "mu",
-            "sigma",
-        ]
-    ]
-
-    df["upper_bound"] = df.apply(
-        lambda x: max(x["prev_close"], x["day_open"])
-        * (1 + (volatility_multiplier * x["avg_move"])),
-        axis=1,
+    # max / min of prev_close and day_open is NaN on the first day, when prev_close is NaN
+    df["upper_bound"] = np.maximum(df["prev_close"], df["day_open"]) * (
+        1 + (volatility_multiplier * df["avg_move"])
     )
-    df["lower_bound"] = df.apply(
-        lambda x: min(x["prev_close"], x["day_open"])
-        * (1 - (volatility_multiplier * x["avg_move"])),
-        axis=1,
+    df["lower_bound"] = np.minimum(df["prev_close"], df["day_open"]) * (
+        1 - (volatility_multiplier * df["avg_move"])
     )
 
-    return df, latest_avg
+    return df, moves
+
+
+class NoiseAreaState:
+    def __init__(self, lookback_days: int, volatility_multiplier: float):
+        """Rolling state to compute the noise area one session at a time.
+
+        Gives the same values as `load_noise_area` but only keeps the last `lookback_days`
+        sessions of per-minute moves and the last `lookback_days + 2` daily closes, so memory
+        stays O(lookback_days x minutes per session) however long the history is.
+
+        Args:
+            lookback_days (int): Number of days to calculate the avg_move over
+            volatility_multiplier (float): Volatility multiplier to scale the noise area.
+        """
+        self.lookback_days = lookback_days
+        self.volatility_multiplier = volatility_multiplier
+        self.last_date = None
+        self.day_closes = deque(maxlen=lookback_days + 2)
+        # forward filled moves by minute of the last n sessions, oldest first
+        self.moves = deque(maxlen=lookback_days)
+        self.last_moves = pd.Series(dtype=float)
+
+    @property
+    def prev_close(self) -> float:
+        return self.day_closes[-1] if self.day_closes else np.nan
+
+    @property
+    def latest_avg(self) -> pd.Series:
+        """avg_move over the latest n lookback_days sessions, same as returned by `load_noise_area`."""
+        latest_avg = pd.concat(list(self.moves), axis=1).mean(axis=1)
+        latest_avg.index.name = "minute"
+        return latest_avg
+
+    def update(self, session: pd.DataFrame) -> pd.DataFrame:
+        """Computes the noise area for the next session and rolls the state forward.
+
+        Args:
+            session (pd.DataFrame): Intraday data of a single session, with datetime index and
+                at least the following fields: 'open', 'close', 'high', 'low', 'volume'.
+                Sessions have to be passed in order.
+
+        Returns:
+            pd.DataFrame: The session with the columns returned by `load_noise_area`.
+        """
+        lookback_days = self.lookback_days
+        date = session.index[0].date()
+        assert (
+            self.last_date is None or date > self.last_date
+        ), f"Sessions have to be passed in order, got {date} after {self.last_date}"
+        self.last_date = date
+
+        df = session[["open", "close", "high", "low", "volume"]].copy()
+        df["date"] = date
+        df["minute"] = df.index.time
+
+        # calculate VWAP
+        typical_px = (df["high"] + df["low"] + df["close"]) / 3
+        df["vwap"] = (typical_px * df["volume"]).cumsum() / df["volume"].cumsum()
+
+        day_open = df["open"].iloc[0]
+        day_close = df["close"].iloc[-1]
+        prev_close = self.prev_close
+        df["day_open"] = day_open
+        df["day_close"] = day_close
+        df["prev_close"] = prev_close
+
+        # stats for vol scaling, see `load_noise_area`
+        self.day_closes.append(day_close)
+        mu = sigma = np.nan
+        if len(self.day_closes) == lookback_days + 2:
+            closes = np.array(self.day_closes)
+            returns = closes[1:] / closes[:-1] - 1
+            mu = returns[-lookback_days - 1 : -1].mean()
+            sigma = (returns[1 : lookback_days - 1] - mu) ** 2
+            sigma = np.sqrt(sigma.sum() / (lookback_days - 1))
+        df["mu"] = mu
+        df["sigma"] = sigma
+
+        # calculate avg move
+        df["move"] = ((df["close"] / day_open) - 1).abs()
+        if len(self.moves) == lookback_days:
+            avg_move = pd.concat(list(self.moves), axis=1).mean(axis=1, skipna=False)
+            df["avg_move"] = avg_move.reindex(df["minute"]).to_numpy()
+        else:
+            df["avg_move"] = np.nan
+
+        # ffill to fill up data for those days where market closes at 13:00
+        moves = df.groupby("minute")["move"].mean()
+        self.last_moves = moves.combine_first(self.last_moves)
+        self.moves.append(self.last_moves)
+
+        df.index = (
+            df.index.tz_localize(None) if df.index.tz is not None else df.index.copy()
+        )
+        df.index.name = "datetime"
+        df["upper_bound"] = max(prev_close, day_open) * (
+            1 + (self.volatility_multiplier * df["avg_move"])
+        )
+        df["lower_bound"] = min(prev_close, day_open) * (
+            1 - (self.volatility_multiplier * df["avg_move"])
+        )
+
+        return df[NOISE_AREA_COLUMNS]
+
+
+def iter_noise_area(
+    sessions: Iterable[pd.DataFrame],
+    lookback_days: int,
+    volatility_multiplier: float,
+    state: NoiseAreaState | None = None,
+) -> Iterator[pd.DataFrame]:
+    """Streaming variant of `load_noise_area` that yields the noise area one session at a time.
+
+    Peak memory is O(lookback_days x minutes per session), independent of the length of the
+    history. For ex. to compute the noise area of a history that does not fit in memory:
+
+        sessions = iter_data({**loader_config, "batch_by": "session"})
+        write_batches(iter_noise_area(sessions, 20, 1.0), writer_config)
+
+    Args:
+        sessions (Iterable[pd.DataFrame]): Intraday data, one DataFrame per session, in order.
+        lookback_days (int): Number of days to calculate the avg_move over
+        volatility_multiplier (float): Volatility multiplier to scale the noise area.
+        state (NoiseAreaState, optional): State to resume from, for ex. to read `latest_avg`
+            once the stream is consumed. Defaults to a fresh state.
+
+    Yields:
+        pd.DataFrame: Noise area of each session, same columns as `load_noise_area`.
+    """
+    if state is None:
+        state = NoiseAreaState(lookback_days, volatility_multiplier)
+    for session in sessions:
+        if session.empty:
+            continue
+        yield state.update(session)
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from core.analytics import calc_n_period_forward_returns
+
+DEFAULT_PERIODS = [1, 2, 3, 4, 5, 10, 15, 20]
+# max. number of (window, row) values ranked at once by `rolling_spearman`
+ROLLING_CHUNK_CELLS = 2**20
+
+
+def _pearson(x: np.ndarray, y: np.ndarray, axis: int = 0) -> np.ndarray:
+    """Pearson correlation along `axis` of `x` and `y`, on the rows where neither is NaN."""
+    valid = ~(np.isnan(x) | np.isnan(y))
+    n = valid.sum(axis=axis, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dx = np.where(valid, x - np.where(valid, x, 0).sum(axis, keepdims=True) / n, 0)
+        dy = np.where(valid, y - np.where(valid, y, 0).sum(axis, keepdims=True) / n, 0)
+        corr = (dx * dy).sum(axis) / np.sqrt((dx * dx).sum(axis) * (dy * dy).sum(axis))
+    return np.where(n.squeeze(axis) > 1, corr, np.nan)
+
+
+def _ols(x: np.ndarray, y: np.ndarray) -> tuple:
+    """Intercept, beta and number of observations of `y` (rows x columns) on `x` (rows x 1)."""
+    valid = ~(np.isnan(x) | np.isnan(y))
+    n = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mx = np.where(valid, x, 0).sum(axis=0) / n
+        my = np.where(valid, y, 0).sum(axis=0) / n
+        dx, dy = np.where(valid, x - mx, 0), np.where(valid, y - my, 0)
+        beta = (dx * dy).sum(axis=0) / (dx * dx).sum(axis=0)
+    return my - beta * mx, beta, n
+
+
+def _window_ranks(values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """Average ranks (1-based, like `Series.rank`) within every row of `values`, among `valid`.
+
+    Every row is sorted once (invalid values last), O(w log w) per row of w values, ties get
+    the average of the positions of their run of equal values.
+    """
+    # invalid values (for ex. where the other series is NaN) never tie with valid ones
+    values = np.where(valid, values, np.nan)
+    order = np.lexsort((values, ~valid), axis=1)
+    ordered = np.take_along_axis(values, order, axis=1)
+    positions = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    # runs of equal values in sorted order, NaN (invalid) values are runs of their own
+    new_run = np.ones(values.shape, dtype=bool)
+    new_run[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    run_end = np.ones(values.shape, dtype=bool)
+    run_end[:, :-1] = new_run[:, 1:]
+    first = np.maximum.accumulate(np.where(new_run, positions, 0), axis=1)
+    last = np.minimum.accumulate(
+        np.where(run_end, positions, values.shape[1])[:, ::-1], axis=1
+    )[:, ::-1]
+
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=1)
+    return np.where(valid, ranks, np.nan)
+
+
+def rolling_spearman(x: np.ndarray, y: np.ndarray, window: int) -> np.ndarray:
+    """Spearman correlation of `x` and `y` over every window of `window` rows.
+
+    Same values as `Series.corr(method="spearman")` of every window: rows where either is NaN
+    are dropped and ties get average ranks. All windows are ranked at once, in chunks.
+
+    Returns:
+        np.ndarray: Correlation of the window ending at every row, NaN for the first
+            `window - 1` rows.
+    """
+    out = np.full(len(x), np.nan)
+    if len(x) < window:
+        return out
+
+    xw, yw = sliding_window_view(x, window), sliding_window_view(y, window)
+    chunk = max(ROLLING_CHUNK_CELLS // window, 1)
+    for start in range(0, len(xw), chunk):
+        xs, ys = xw[start : start + chunk], yw[start : start + chunk]
+        valid = ~(np.isnan(xs) | np.isnan(ys))
+        out[window - 1 + start : window - 1 + start + len(xs)] = _pearson(
+            _window_ranks(xs, valid), _window_ranks(ys, valid), axis=1
+        )
+    return out
+
+
+class TearSheet:
+    def __init__(
+        self,
+        signals: pd.DataFrame | pd.Series,
+        fwd_returns: pd.DataFrame | pd.Series,
+        n_jobs: int | None = None,
+    ):
+        """Signal evaluation tables of many signals against forward returns, computed in batch.
+
+        Signals and forward returns are aligned once, on the index of `signals`. Every table
+        is computed for all signals (and horizons) in vectorized passes and returned in long
+        format, ready to be filtered and rendered by `core.visualizations`:
+
+        - `ic`: Spearman IC of every signal at every horizon (IC decay),
+        - `rolling_ic`: Spearman IC over rolling windows,
+        - `deciles`: mean signal / forward return by signal decile,
+        - `regression`: OLS intercept and beta of forward returns on the signal.
+
+        Args:
+            signals (pd.DataFrame | pd.Series): DateTime index, one column per signal.
+            fwd_returns (pd.DataFrame | pd.Series): DateTime index, one column of forward
+                returns per horizon (number of periods). A Series is horizon 1.
+            n_jobs (int, optional): Threads of the parallel passes. Defaults to the
+                `ThreadPoolExecutor` default.
+        """
+        if isinstance(signals, pd.Series):
+            signals = signals.to_frame(
+                "signal" if signals.name is None else signals.name
+            )
+        if isinstance(fwd_returns, pd.Series):
+            fwd_returns = fwd_returns.to_frame(1)
+
+        self.index = signals.index
+        self.names = list(signals.columns)
+        self.periods = list(fwd_returns.columns)
+        self.signals = signals.to_numpy(dtype=float)
+        self.returns = fwd_returns.reindex(self.index).to_numpy(dtype=float)
+        self.n_jobs = n_jobs
+        self._ranks = None
+
+    @classmethod
+    def from_prices(
+        cls,
+        signals: pd.DataFrame | pd.Series,
+        prices: pd.Series,
+        n_periods: list = DEFAULT_PERIODS,
+        n_jobs: int | None = None,
+    ) -> TearSheet:
+        """Tear sheet of `signals` against the forward returns of `prices` over `n_periods`."""
+        fwd_returns = pd.DataFrame(
+            {n: calc_n_period_forward_returns(prices, n) for n in n_periods}
+        )
+        return cls(signals, fwd_returns, n_jobs)
+
+    def _map(self, fn, items: list) -> list:
+        with ThreadPoolExecutor(self.n_jobs) as pool:
+            return list(pool.map(fn, items))
+
+    def ranks(self) -> tuple[np.ndarray, list, np.ndarray]:
+        """Ranks of every signal and of the forward returns, computed once.
+
+        Every signal is ranked over its sample: the rows where it and the forward returns of
+        all horizons are defined, so all horizons of a signal are compared on the same rows.
+        Forward returns are ranked once per distinct sample, usually one for all signals.
+
+        Returns:
+            np.ndarray, list, np.ndarray: Signal ranks (rows x signals), forward return ranks
+                of every distinct sample (rows x horizons) and the sample of every signal.
+                Ranks are NaN outside of the sample.
+        """
+        if self._ranks is None:
+            sample = ~np.isnan(self.signals) & ~np.isnan(self.returns).any(
+                axis=1, keepdims=True
+            )
+            signal_ranks = (
+                pd.DataFrame(np.where(sample, self.signals, np.nan)).rank().to_numpy()
+            )
+
+            masks, inverse = np.unique(sample.T, axis=0, return_inverse=True)
+
+            def rank_returns(mask):
+                returns = np.where(mask[:, None], self.returns, np.nan)
+                return pd.DataFrame(returns).rank().to_numpy()
+
+            return_ranks = self._map(rank_returns, list(masks))
+            self._ranks = signal_ranks, return_ranks, inverse.ravel()
+        return self._ranks
+
+    def ic(self) -> pd.DataFrame:
+        """Spearman IC of every signal at every horizon.
+
+        Returns:
+            pd.DataFrame: Columns signal, period, ic, n (number of observations).
+        """
+        signal_ranks, return_ranks, samples = self.ranks()
+
+        def signal_ic(i):
+            y = return_ranks[samples[i]]
+            x = np.broadcast_to(signal_ranks[:, i : i + 1], y.shape)
+            return _pearson(x, y)
+
+        ic = np.stack(self._map(signal_ic, list(range(len(self.names)))))
+        n = (~np.isnan(signal_ranks)).sum(axis=0)
+        return pd.DataFrame(
+            {
+                "signal": np.repeat(self.names, len(self.periods)),
+                "period": np.tile(self.periods, len(self.names)),
+                "ic": ic.ravel(),
+                "n": np.repeat(n, len(self.periods)),
+            }
+        )
+
+    def rolling_ic(self, windows: list, period=None) -> pd.DataFrame:
+        """Spearman IC of every signal over rolling windows of each of `windows` rows.
+
+        Args:
+            windows (list): Window lengths, in rows.
+            period (optional): Horizon of the forward returns. Defaults to the first one.
+
+        Returns:
+            pd.DataFrame: Columns datetime (end of the window), signal, window, ic. Starts
+                at the first full window of each window length.
+        """
+        col = self.periods.index(self.periods[0] if period is None else period)
+        tasks = [(i, w) for i in range(len(self.names)) for w in windows]
+        ics = self._map(
+            lambda task: rolling_spearman(
+                self.signals[:, task[0]], self.returns[:, col], task[1]
+            ),
+            tasks,
+        )
+        return pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "datetime": self.index[w - 1 :],
+                        "signal": self.names[i],
+                        "window": w,
+                        "ic": ic[w - 1 :],
+                    }
+                )
+                for (i, w), ic in zip(tasks, ics)
+            ],
+            ignore_index=True,
+        )
+
+    def deciles(self, period=None, n_buckets: int = 10) -> pd.DataFrame:
+        """Mean signal, forward return and signal weighted forward return by signal bucket.
+
+        Buckets are the `pd.qcut(signal, n_buckets)` quantile buckets of every signal, over
+        all its values, means skip missing forward returns.
+
+        Args:
+            period (optional): Horizon of the forward returns. Defaults to the first one.
+            n_buckets (int, optional): Number of quantile buckets. Defaults to 10.
+
+        Returns:
+            pd.DataFrame: Columns signal, decile, mean_signal, mean_fwd_returns,
+                mean_signal_returns, count.
+
+        Raises:
+            ValueError: If the bucket edges of a signal are not unique, like `pd.qcut`.
+        """
+        col = self.periods.index(self.periods[0] if period is None else period)
+        returns = self.returns[:, col]
+        edges = np.nanquantile(self.signals, np.linspace(0, 1, n_buckets + 1), axis=0)
+
+        def bucket_means(i):
+            if (np.diff(edges[:, i]) == 0).any():
+                raise ValueError(
+                    f"Bin edges must be unique for {self.names[i]}: {edges[:, i]}"
+                )
+            signal = self.signals[:, i]
+            valid = ~np.isnan(signal)
+            bucket = np.searchsorted(edges[1:-1, i], signal[valid], side="left")
+            signal, ret = signal[valid], returns[valid]
+            has_ret = ~np.isnan(ret)
+
+            def mean(values, mask):
+                total = np.bincount(bucket[mask], values[mask], minlength=n_buckets)
+                count = np.bincount(bucket[mask], minlength=n_buckets)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    return total / count
+
+            return {
+                "signal": self.names[i],
+                "decile": np.arange(n_buckets),
+                "mean_signal": mean(signal, np.ones(len(signal), dtype=bool)),
+                "mean_fwd_returns": mean(ret, has_ret),
+                "mean_signal_returns": mean(signal * ret, has_ret),
+                "count": np.bincount(bucket, minlength=n_buckets),
+            }
+
+        tables = self._map(bucket_means, list(range(len(self.names))))
+        return pd.concat([pd.DataFrame(t) for t in tables], ignore_index=True)
+
+    def regression(self) -> pd.DataFrame:
+        """OLS regression of the forward returns of every horizon on every signal.
+
+        Same estimates as `ols_regression`, on the rows where both are defined.
+
+        Returns:
+            pd.DataFrame: Columns signal, period, intercept, beta, n.
+        """
+        tables = self._map(
+            lambda i: _ols(self.signals[:, i : i + 1], self.returns),
+            list(range(len(self.names))),
+        )
+        intercept, beta, n = (np.stack(t) for t in zip(*tables))
+        return pd.DataFrame(
+            {
+                "signal": np.repeat(self.names, len(self.periods)),
+                "period": np.tile(self.periods, len(self.names)),
+                "intercept": intercept.ravel(),
+                "beta": beta.ravel(),
+                "n": n.ravel(),
+            }
+        )
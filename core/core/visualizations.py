@@ -5,31 +5,88 @@ from typing import Tuple
 import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
+from matplotlib.ticker import FuncFormatter, MaxNLocator
 
-from core.analytics import calc_n_period_forward_returns
-from core.linear_regression import ols_regression
+from core.tearsheet import TearSheet
 
+# points drawn by the signal / response scatter plot
+MAX_SCATTER_POINTS = 20_000
 
-def plot_ts(ts, ax=None, step=5, figsize=(13, 7), title="", see_xaxis=False):
+
+def minmax_downsample(values: np.ndarray, n_bins: int) -> np.ndarray:
+    """Positions of the points to draw so a line of `values` looks the same on `n_bins` pixels.
+
+    `values` is split in `n_bins` consecutive bins and the first, min, max and last point of
+    every bin are kept (min/max per pixel), so spikes and drawdowns survive the downsampling.
+    At most 4 x `n_bins` points are returned, all of them if there are fewer.
+
+    Args:
+        values (np.ndarray): 1-D array without NaN.
+        n_bins (int): Number of bins, for ex. the width of the axes in pixels.
+
+    Returns:
+        np.ndarray: Sorted positions in `values`.
+    """
+    n = len(values)
+    if n <= 4 * n_bins:
+        return np.arange(n)
+
+    bin_size = -(-n // n_bins)
+    padded = np.pad(values, (0, n_bins * bin_size - n), mode="edge")
+    bins = padded.reshape(n_bins, bin_size)
+    starts = np.arange(n_bins) * bin_size
+    positions = np.concatenate(
+        [
+            starts,
+            starts + bins.argmin(axis=1),
+            starts + bins.argmax(axis=1),
+            starts + bin_size - 1,
+        ]
+    )
+    return np.unique(np.minimum(positions, n - 1))
+
+
+def plot_ts(
+    ts, ax=None, step=5, figsize=(13, 7), title="", see_xaxis=False, n_ticks=10
+):
     """
     plot timeseries ignoring date gaps
     https://stackoverflow.com/questions/58476654/how-to-remove-or-hide-x-axis-labels-from-a-plot
 
+    Long series are downsampled to the points visible at the width of the axes (see
+    `minmax_downsample`) and the x axis only gets `n_ticks` labels, formatted on demand, so
+    plotting millions of points stays interactive.
+
     Params
     ------
     ts : pd.DataFrame or pd.Series
-    step : int, display interval for ticks
+    step : int, unused, ticks are placed as per n_ticks
     figsize : tuple, figure size
     title: str
     see_xaxis (bool): Set xaxis label visiblity
+    n_ticks (int): Max. number of x ticks
     """
     if ax is None:
         fig, ax = plt.subplots(figsize=figsize)
 
-    ax.plot(range(ts.dropna().shape[0]), ts.dropna())
+    ts = ts.dropna()
+    labels = ts.index
+    # explicit column count, an empty series (for ex. all NaN) plots empty axes
+    values = ts.to_numpy(dtype=float).reshape(
+        len(ts), 1 if ts.ndim == 1 else ts.shape[1]
+    )
+    n_bins = max(int(ax.get_window_extent().width), 1)
+    for i in range(values.shape[1]):
+        positions = minmax_downsample(values[:, i], n_bins)
+        ax.plot(positions, values[positions, i])
+
+    def format_tick(x, pos=None):
+        i = int(round(x))
+        return str(labels[i]) if 0 <= i < len(labels) else ""
+
+    ax.xaxis.set_major_locator(MaxNLocator(nbins=n_ticks, integer=True))
+    ax.xaxis.set_major_formatter(FuncFormatter(format_tick))
     ax.set_title(title)
-    ax.set_xticks(np.arange(len(ts.dropna())))
-    ax.set_xticklabels(ts.dropna().index.tolist())
     ax.get_xaxis().set_visible(see_xaxis)
 
     return ax
@@ -49,20 +106,21 @@ def plot_ic_decay(
         prices (pd.DataFrame | pd.Series): DateTime index and price of an asset whose returns we want to use.
         n_periods (list, optional): Defaults to [1, 2, 3, 4, 5, 10, 15, 20].
     """
-    if ax is None:
-        fig, ax = plt.subplots(figsize=figsize)
+    ic = TearSheet.from_prices(signal, prices, n_periods).ic()
+    return render_ic_decay(ic, figsize=figsize, ax=ax)
 
-    ic_data = {}
 
-    for period in n_periods:
-        fwd_returns = calc_n_period_forward_returns(prices, period)
-        ic_data[period] = signal.corr(fwd_returns, method="spearman")
+def render_ic_decay(ic: pd.DataFrame, figsize: Tuple = (13, 7), ax=None):
+    """Plots the IC decay of every signal of a `TearSheet.ic` table."""
+    if ax is None:
+        fig, ax = plt.subplots(figsize=figsize)
 
-    ic_data = pd.DataFrame().from_dict(ic_data, orient="index", columns=["IC"])
+    ic_data = ic.pivot(index="period", columns="signal", values="ic")
     ic_data.plot(ax=ax)
-    plt.ylabel("Information Coefficient")
-    plt.xlabel("N periods")
-    plt.grid()
+    ax.set_ylabel("Information Coefficient")
+    ax.set_xlabel("N periods")
+    ax.grid()
+    return ax
 
 
 def plot_rolling_ic(
@@ -79,35 +137,33 @@ def plot_rolling_ic(
         n_periods (list, optional): Number of periods to do rolling IC stats on. Defaults to [12, 75].
         period_labels (list, optional): Labels for each period in n_periods. Defaults to ["Hourly", "Daily"].
     """
+    sheet = TearSheet(signal, fwd_returns)
+    return render_rolling_ic(
+        sheet.rolling_ic(n_periods), sheet.ic(), dict(zip(n_periods, period_labels))
+    )
 
-    def calc_rolling_ic(df, period):
-        roll_ic = {}
-        for window in df.rolling(period):
-            if len(window) < period:
-                continue
-            roll_ic[window.index[-1]] = window["signal"].corr(
-                window["fwd_returns"], method="spearman"
-            )
-        return pd.DataFrame().from_dict(roll_ic, orient="index")
-
-    sig_res_df = signal.to_frame()
-    sig_res_df.columns = ["signal"]
-    sig_res_df["fwd_returns"] = fwd_returns
-
-    ic = signal.corr(fwd_returns, method="spearman")
 
-    roll_ic_df = pd.DataFrame()
-    for period in n_periods:
-        tmp = calc_rolling_ic(sig_res_df, period)
-        roll_ic_df = pd.concat([roll_ic_df, tmp], axis=1)
+def render_rolling_ic(
+    rolling_ic: pd.DataFrame, ic: pd.DataFrame, labels: dict | None = None, ax=None
+):
+    """Plots a `TearSheet.rolling_ic` table of one signal, with its IC from `TearSheet.ic`.
 
-    roll_ic_df.columns = period_labels
+    Args:
+        rolling_ic (pd.DataFrame): Rolling IC of a single signal.
+        ic (pd.DataFrame): IC of that signal, the first horizon is drawn.
+        labels (dict, optional): Window to label. Defaults to the window lengths.
+    """
+    roll_ic_df = rolling_ic.pivot(index="datetime", columns="window", values="ic")
+    if labels is not None:
+        roll_ic_df = roll_ic_df.rename(columns=labels)
+    ic = ic["ic"].iloc[0]
 
-    ax = plot_ts(roll_ic_df)
+    ax = plot_ts(roll_ic_df, ax=ax)
     ax.axhline(0, color="black")
     ax.axhline(ic, color="green", linestyle="-")
     ax.text(0, ic, f"{round(ic, 2)}", bbox=dict(boxstyle="square"))
     ax.grid()
+    return ax
 
 
 def plot_signal_response(signal: pd.Series, fwd_returns: pd.Series):
@@ -117,6 +173,21 @@ def plot_signal_response(signal: pd.Series, fwd_returns: pd.Series):
         signal (pd.Series): Series with DateTime Index and Signal as values.
         fwd_returns (pd.Series): Series with DateTime Index and Forward Returns as values.
     """
+    regression = TearSheet(signal, fwd_returns).regression()
+    return render_signal_response(signal, fwd_returns, regression)
+
+
+def render_signal_response(
+    signal: pd.Series, fwd_returns: pd.Series, regression: pd.DataFrame
+):
+    """Plots the distributions of a signal and its forward returns, and their regression.
+
+    Args:
+        signal (pd.Series): Series with DateTime Index and Signal as values.
+        fwd_returns (pd.Series): Series with DateTime Index and Forward Returns as values.
+        regression (pd.DataFrame): `TearSheet.regression` of the signal, the first row is
+            drawn.
+    """
     # Prepare subplots
     _, axes = plt.subplots(1, 3, figsize=(20, 7))
 
@@ -130,17 +201,21 @@ def plot_signal_response(signal: pd.Series, fwd_returns: pd.Series):
     axes[1].set_xlabel("Forward Returns")
     axes[1].set_ylabel("Frequency")
 
-    # Scatter Plot Signal / Response
-    axes[2].scatter(signal, fwd_returns, alpha=0.3)
+    # Scatter Plot Signal / Response, a sample of the points is enough to see the cloud
+    points = pd.concat([signal, fwd_returns], axis=1).dropna()
+    if len(points) > MAX_SCATTER_POINTS:
+        points = points.sample(MAX_SCATTER_POINTS, random_state=0)
+    axes[2].scatter(points.iloc[:, 0], points.iloc[:, 1], alpha=0.3)
     axes[2].set_xlabel("Signal")
     axes[2].set_ylabel("Forward Returns")
     axes[2].grid()
     # Regression line
-    c, beta = ols_regression(signal.dropna(), fwd_returns.dropna())
+    c, beta = regression[["intercept", "beta"]].iloc[0]
     xseq = np.linspace(signal.min(), signal.max(), num=100)
     yseq = c + (beta * xseq)
     axes[2].plot(xseq, yseq, color="k")
     axes[2].text(xseq[-1], yseq[-1], "{:.2f}".format(beta))
+    return axes
 
 
 def plot_signal_bucket_characterstics(signal: pd.Series, fwd_returns: pd.Series):
@@ -150,26 +225,21 @@ def plot_signal_bucket_characterstics(signal: pd.Series, fwd_returns: pd.Series)
         signal (pd.Series): Series with DateTime Index and Signal as values.
         fwd_returns (pd.Series): Series with DateTime Index and Forward Returns as values.
     """
-    _, axes = plt.subplots(1, 3, figsize=(20, 7))
-
-    # Make dataframe
-    df = signal.to_frame()
-    df.columns = ["signal"]
-    df["fwd_returns"] = fwd_returns
+    return render_signal_buckets(TearSheet(signal, fwd_returns).deciles())
 
-    df["signal_returns"] = df["signal"] * df["fwd_returns"]
 
-    df["signal_decile"] = pd.qcut(df["signal"], 10, labels=False)
-
-    bucket_mean = df.groupby("signal_decile").mean()
+def render_signal_buckets(deciles: pd.DataFrame):
+    """Plots a `TearSheet.deciles` table of one signal."""
+    _, axes = plt.subplots(1, 3, figsize=(20, 7))
 
-    axes[0].bar(bucket_mean.index, bucket_mean["signal"])
+    axes[0].bar(deciles["decile"], deciles["mean_signal"])
     axes[0].set_xlabel("Signal")
 
-    axes[1].bar(bucket_mean.index, bucket_mean["fwd_returns"])
+    axes[1].bar(deciles["decile"], deciles["mean_fwd_returns"])
     axes[1].set_xlabel("Forward Returns // Classifed by Signal Deciles")
 
-    axes[2].bar(bucket_mean.index, bucket_mean["signal_returns"])
+    axes[2].bar(deciles["decile"], deciles["mean_signal_returns"])
     axes[2].set_xlabel(
         "Signal Weighted Forward Returns // Classified by Signal Deciles"
     )
+    return axes
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from cio.data_loader import ParquetDataFrameLoader
+from cio.data_writer import write_data
+from cio.dataset import view_filename
+from core.bar_views import TIMEFRAMES, daily_bars, daily_stats, resample_bars
+
+DEFAULT_TIMEFRAMES = ["5min", "30min", "daily"]
+# writer_params of the minute data that do not apply to the views
+MINUTE_ONLY_PARAMS = ("dataset", "partition_by")
+
+
+def view_writer_config(writer_config: dict, timeframe: str, append: bool) -> dict:
+    """Writer config of the `timeframe` view, from the writer config of the minute data."""
+    writer_params = {
+        k: v
+        for k, v in writer_config.get("writer_params", {}).items()
+        if k not in MINUTE_ONLY_PARAMS
+    }
+    writer_params.update(
+        append_if_exists=append, sort_index=True, deduplicate_index=True
+    )
+    return {
+        **writer_config,
+        "filename": view_filename(writer_config["filename"], timeframe),
+        "writer_params": writer_params,
+    }
+
+
+def load_sessions(filename: str, sessions: pd.DatetimeIndex) -> pd.DataFrame:
+    """Loads the minute bars of `sessions` (local midnights) from the minute data.
+
+    Only the row groups of the range of the sessions are read, the sessions in between that
+    are not in `sessions` are dropped.
+    """
+    start = sessions.min()
+    end = sessions.max() + pd.Timedelta(days=1) - pd.Timedelta(1, unit="ns")
+    df = ParquetDataFrameLoader(
+        {"filename": filename, "start": start, "end": end}
+    ).load_data()
+    return df[df.index.normalize().isin(sessions)]
+
+
+def update_views(data: pd.DataFrame, writer_config: dict, views_config: dict):
+    """Updates the materialized views of the minute data after `data` was written.
+
+    Only the sessions of `data` are recomputed, from the minute data as written (so appends of
+    part of a session give the bars of the whole session):
+
+    - 5min / 30min bars of those sessions replace their previous bars,
+    - the daily bars of those sessions replace their previous bars, then prev_close, mu and
+      sigma are recomputed from the daily closes, which is cheap.
+
+    Example views config:
+    {
+        "timeframes": ["5min", "30min", "daily"],
+        "lookback_days": 20  # lookback of mu and sigma in the daily view
+    }
+
+    Args:
+        data (pd.DataFrame): Minute bars just written, with a datetime index.
+        writer_config (dict): Writer config the minute bars were written with.
+        views_config (dict): See above.
+    """
+    if data.empty:
+        return
+    timeframes = views_config.get("timeframes", DEFAULT_TIMEFRAMES)
+    sessions = pd.DatetimeIndex(np.unique(data.index.normalize()))
+    minutes = load_sessions(writer_config["filename"], sessions)
+    logging.info(
+        "Updating {} views of {} sessions from {} to {}".format(
+            timeframes, len(sessions), sessions[0].date(), sessions[-1].date()
+        )
+    )
+
+    for timeframe in timeframes:
+        if timeframe in TIMEFRAMES:
+            bars = resample_bars(minutes, TIMEFRAMES[timeframe])
+            write_data(bars, view_writer_config(writer_config, timeframe, True))
+        elif timeframe == "daily":
+            update_daily_view(minutes, writer_config, views_config)
+        else:
+            raise ValueError(f"Not a valid timeframe: {timeframe}")
+
+
+def update_daily_view(minutes: pd.DataFrame, writer_config: dict, views_config: dict):
+    """Merges the daily bars of the sessions of `minutes` into the daily view."""
+    lookback_days = views_config.get("lookback_days", 20)
+    config = view_writer_config(writer_config, "daily", False)
+
+    daily = daily_bars(minutes, lookback_days)
+    try:
+        existing = ParquetDataFrameLoader({"filename": config["filename"]}).load_data()
+    except FileNotFoundError:
+        existing = None
+    if existing is not None and not existing.empty:
+        existing = existing[~existing.index.isin(daily.index)]
+        daily = pd.concat([existing, daily]).sort_index()
+    # stats of the sessions after the updated ones depend on their closes as well
+    write_data(daily_stats(daily, lookback_days), config)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+
+import pandas as pd
+
+from cio.data_loader import ParquetDataFrameLoader
+from core.data_quality import QualityReport, scan_batches
+from core.minute_grid import SessionSpec
+
+parser = argparse.ArgumentParser(
+    description="Scans a minute bar parquet for gaps and anomalies"
+)
+parser.add_argument(
+    "--filename", type=str, help="Parquet file or dataset of minute bars"
+)
+parser.add_argument("--config_path", type=str, help="ETL config with a 'quality' key")
+parser.add_argument("--gaps_path", type=str, default=None, help="CSV of the gaps found")
+
+
+def scan_file(
+    filename: str, quality_config: dict, start=None, end=None
+) -> QualityReport:
+    """Scans the minute bars of `filename`, streamed row group by row group (or partition).
+
+    Args:
+        filename (str): Parquet file or dataset of minute bars.
+        quality_config (dict): Keyword arguments of `DataQualityScanner`, see `check_quality`.
+        start (optional): Start of the scanned range, only the row groups of the range are read.
+        end (optional): End of the scanned range.
+    """
+    loader = ParquetDataFrameLoader({"filename": filename, "start": start, "end": end})
+    return scan_batches(loader.iter_data(), **quality_config)
+
+
+def check_quality(
+    data: pd.DataFrame, writer_config: dict, quality_config: dict
+) -> QualityReport:
+    """Scans the sessions of `data` as written, after an ETL write, and logs the report.
+
+    The whole sessions of `data` are read back from the minute data (so appends of part of a
+    session are checked with the rest of the session), minutes after the last bar of `data` are
+    not expected. Example quality config, see `DataQualityScanner`:
+    {
+        "session": {"anchor": "09:30", "length": 390, "timezone": "US/Eastern"},
+        "holidays": ["2024-12-25"],  # optional
+        "early_closes": {"2024-12-24": "13:00"}  # optional
+    }
+
+    Args:
+        data (pd.DataFrame): Minute bars just written, with a datetime index.
+        writer_config (dict): Writer config the minute bars were written with.
+        quality_config (dict): See above.
+
+    Returns:
+        QualityReport: Report of the sessions of `data`, None if `data` is empty.
+    """
+    if data.empty:
+        return None
+    first, last = data.index.min(), data.index.max()
+    session = SessionSpec.from_config(quality_config.get("session")) or SessionSpec()
+    offset = session.bucket(pd.DatetimeIndex([first]))[1][0]
+    session_start = first.floor("min") - pd.Timedelta(minutes=int(offset))
+    report = scan_file(
+        writer_config["filename"],
+        {**quality_config, "end": last},
+        start=session_start,
+        end=last,
+    )
+
+    level = logging.INFO if report.ok else logging.WARNING
+    logging.log(
+        level, "Data quality of {}:\n{}".format(writer_config["filename"], report)
+    )
+    return report
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    quality_config = {}
+    if args.config_path is not None:
+        with open(args.config_path) as f:
+            quality_config = json.load(f).get("quality", {})
+
+    report = scan_file(args.filename, quality_config)
+    print(report)
+    if args.gaps_path is not None:
+        report.gaps.to_csv(args.gaps_path, index=False)
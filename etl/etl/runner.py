@@ -0,0 +1,375 @@
+from __future__ import annotations
+
+import datetime
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+import pandas as pd
+
+from cio.data_writer import write_data
+from etl import update_historical_data, update_historical_data_bnb
+from etl.materialized_views import update_views
+from etl.quality_checks import check_quality
+
+# source of the fetch tasks of every loader class, concurrency is limited per source
+SOURCES = {
+    "IBKRHistoricalDataLoader": "ibkr",
+    "BinanceHistoricalDataLoader": "binance",
+}
+# the IBKR loader connects with a fixed client id, one query at a time
+DEFAULT_LIMITS = {"ibkr": 1, "binance": 4, "write": 2}
+# run states and checkpoints, out of the (tracked) config directories
+DEFAULT_STATE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "etl_runner",
+)
+DONE, FAILED, SKIPPED = "done", "failed", "skipped"
+
+
+class Task:
+    def __init__(self, name: str, source: str, fn, deps: list | None = None):
+        """A step of an ETL run, run once all its dependencies are done.
+
+        Args:
+            name (str): Unique name, key of the task in the run state.
+            source (str): Concurrency limit the task counts against, see `DEFAULT_LIMITS`.
+            fn (callable): Called with the results of `deps`, in order.
+            deps (list, optional): Tasks whose results `fn` needs.
+        """
+        self.name = name
+        self.source = source
+        self.fn = fn
+        self.deps = deps or []
+
+
+def write_task(data: list, writer_config: dict) -> pd.DataFrame:
+    """Writes the fetched frames of a target at once, returns what was written.
+
+    Nothing is written when every fetch came back empty (no new data), the empty result
+    leaves the views and the quality checks of the target as they are.
+    """
+    frames = [df for df in data if not df.empty]
+    if not frames:
+        logging.info("No new data for {}".format(writer_config["filename"]))
+        return data[0] if data else pd.DataFrame()
+    data = pd.concat(frames)
+    write_data(data, writer_config)
+    return data
+
+
+def add_target_tasks(
+    tasks: list,
+    name: str,
+    fetches: list,
+    writer_config: dict,
+    views: dict | None,
+    quality: dict | None = None,
+):
+    """Adds the fetches of a target, one batched write of their results, its views and checks."""
+    tasks.extend(fetches)
+    write = Task(
+        f"{name}/write",
+        "write",
+        lambda *data: write_task(data, writer_config),
+        fetches,
+    )
+    tasks.append(write)
+    if views is not None:
+        tasks.append(
+            Task(
+                f"{name}/views",
+                "write",
+                lambda data: update_views(data, writer_config, views),
+                [write],
+            )
+        )
+    if quality is not None:
+        tasks.append(
+            Task(
+                f"{name}/quality",
+                "write",
+                lambda data: check_quality(data, writer_config, quality),
+                [write],
+            )
+        )
+
+
+def default_state_path(config_dir: str) -> str:
+    """State file of the runs of `config_dir` in `DEFAULT_STATE_DIR`, one per config dir."""
+    config_dir = os.path.abspath(config_dir)
+    digest = hashlib.sha1(config_dir.encode()).hexdigest()[:8]
+    name = os.path.basename(config_dir.rstrip(os.sep))
+    return os.path.join(DEFAULT_STATE_DIR, f"{name}-{digest}.json")
+
+
+def build_tasks(config_dir: str, params: dict) -> list:
+    """Returns the tasks of the update of every `config_dir/*.json` config.
+
+    IBKR configs (see `update_historical_data.main`) are fetched in one query ending on
+    "end_date". Binance configs (see `update_historical_data_bnb.main`) are fetched in 12h
+    windows from "start_date" to "end_date" for every symbol of their "runner" key:
+    {
+        ...
+        "runner": {"symbols": ["BTCUSDT", "ETHUSDT"]}
+    }
+    The fetched data of every target is written at once, then its views are updated and its
+    data quality checked, see `quality_checks.check_quality`.
+    """
+    tasks = []
+    start_date = pd.Timestamp(params["start_date"])
+    end_date = pd.Timestamp(params["end_date"])
+    for config_path in sorted(glob.glob(os.path.join(config_dir, "*.json"))):
+        name = os.path.splitext(os.path.basename(config_path))[0]
+        with open(config_path) as f:
+            config = json.load(f)
+        loader_class = config["loader_config"]["loader_class"]
+        source = SOURCES.get(loader_class, loader_class)
+
+        if loader_class == "BinanceHistoricalDataLoader":
+            bnb = update_historical_data_bnb
+            for symbol in config.get("runner", {}).get("symbols", []):
+                fetches = [
+                    Task(
+                        f"{name}/{symbol}/fetch/{start:%Y%m%dT%H%M}",
+                        source,
+                        partial(
+                            bnb.fetch, bnb.resolve_config(config, symbol, start, end)
+                        ),
+                    )
+                    for start, end in bnb.windows(start_date, end_date)
+                ]
+                dc = bnb.resolve_config(config, symbol)
+                add_target_tasks(
+                    tasks,
+                    f"{name}/{symbol}",
+                    fetches,
+                    dc["writer_config"],
+                    dc.get("views"),
+                    dc.get("quality"),
+                )
+        else:
+            dc = update_historical_data.resolve_config(config, end_date)
+            fetch = Task(
+                f"{name}/fetch", source, partial(update_historical_data.fetch, dc)
+            )
+            add_target_tasks(
+                tasks,
+                name,
+                [fetch],
+                dc["writer_config"],
+                dc.get("views"),
+                dc.get("quality"),
+            )
+    return tasks
+
+
+class Runner:
+    def __init__(
+        self,
+        tasks: list,
+        state_path: str,
+        limits: dict | None = None,
+    ):
+        """Runs a task graph concurrently, with a limit of running tasks per source.
+
+        The state of the run (parameters, status, timings, rows and error of every task) is
+        saved to `state_path` after every task, and the DataFrame results are checkpointed
+        next to it, so a rerun with `rerun_failed` only runs the tasks that failed or were
+        skipped, from the checkpointed results of their dependencies. Checkpoints are
+        removed once every task is done.
+
+        Args:
+            tasks (list): `Task`s, dependencies before their dependents.
+            state_path (str): JSON state of the run.
+            limits (dict, optional): Max. running tasks per source. Defaults to
+                `DEFAULT_LIMITS`, 1 for other sources.
+        """
+        self.tasks = {task.name: task for task in tasks}
+        self.state_path = state_path
+        self.checkpoint_dir = f"{os.path.splitext(state_path)[0]}.checkpoints"
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.state = {"params": {}, "tasks": {}}
+
+    def checkpoint_path(self, name: str) -> str:
+        return os.path.join(self.checkpoint_dir, name.replace("/", "__") + ".parquet")
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def result(self, name: str, results: dict):
+        """Result of a task of this run or, if done in a previous run, its checkpoint."""
+        if name not in results:
+            path = self.checkpoint_path(name)
+            results[name] = pd.read_parquet(path) if os.path.exists(path) else None
+        return results[name]
+
+    def run_task(self, task: Task, args: list) -> tuple:
+        """Runs `task`, returns its state record and result."""
+        started = time.time()
+        record = {"source": task.source, "started": started}
+        try:
+            result = task.fn(*args)
+            if isinstance(result, pd.DataFrame):
+                record["rows"] = len(result)
+                os.makedirs(self.checkpoint_dir, exist_ok=True)
+                result.to_parquet(self.checkpoint_path(task.name))
+        except Exception as e:
+            logging.error("{} failed: {!r}".format(task.name, e))
+            record.update(status=FAILED, error=traceback.format_exc())
+            result = None
+        else:
+            record["status"] = DONE
+        record["seconds"] = round(time.time() - started, 3)
+        return record, result
+
+    def run(self, params: dict, rerun_failed: bool = False) -> dict:
+        """Runs the tasks, or only those not done in the saved state with `rerun_failed`.
+
+        Args:
+            params (dict): Parameters of the run, saved in the state.
+            rerun_failed (bool, optional): Rerun the tasks of the saved run that are not done.
+
+        Returns:
+            dict: State of the run, see `save_state`.
+        """
+        pending = set(self.tasks)
+        if rerun_failed:
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+            pending = {
+                name
+                for name in self.tasks
+                if self.state["tasks"].get(name, {}).get("status") != DONE
+            }
+            for name in pending:
+                self.state["tasks"].pop(name, None)
+        else:
+            self.state = {"params": params, "tasks": {}}
+        logging.info("Running {} of {} tasks".format(len(pending), len(self.tasks)))
+
+        results = {}
+        running = {}
+        n_running = {source: 0 for source in self.limits}
+        with ThreadPoolExecutor(sum(self.limits.values())) as pool:
+            while pending or running:
+                # in graph order, so skips reach the dependents in one pass
+                for name in [name for name in self.tasks if name in pending]:
+                    task = self.tasks[name]
+                    deps = [self.state["tasks"].get(d.name, {}) for d in task.deps]
+                    if any(d.get("status") in (FAILED, SKIPPED) for d in deps):
+                        self.state["tasks"][name] = {
+                            "source": task.source,
+                            "status": SKIPPED,
+                        }
+                        pending.remove(name)
+                    elif all(d.get("status") == DONE for d in deps):
+                        if n_running.get(task.source, 0) >= self.limits.get(
+                            task.source, 1
+                        ):
+                            continue
+                        args = [self.result(d.name, results) for d in task.deps]
+                        running[pool.submit(self.run_task, task, args)] = name
+                        n_running[task.source] = n_running.get(task.source, 0) + 1
+                        pending.remove(name)
+                if not running:
+                    if pending:
+                        raise ValueError(
+                            f"Tasks can not run with limits {self.limits}: {pending}"
+                        )
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    record, result = future.result()
+                    n_running[record["source"]] -= 1
+                    results[name] = result
+                    self.state["tasks"][name] = record
+                    logging.info(
+                        "{} {} in {:.2f}s".format(
+                            name, record["status"], record["seconds"]
+                        )
+                    )
+                self.save_state()
+        self.save_state()
+
+        if all(self.state["tasks"][name]["status"] == DONE for name in self.tasks):
+            for name in self.tasks:
+                if os.path.exists(self.checkpoint_path(name)):
+                    os.remove(self.checkpoint_path(name))
+            if os.path.isdir(self.checkpoint_dir) and not os.listdir(
+                self.checkpoint_dir
+            ):
+                os.rmdir(self.checkpoint_dir)
+        return self.state
+
+
+def summary(state: dict) -> str:
+    """Status, rows and seconds of every task of a run state, with the total per status."""
+    lines = [f"{'task':<60} {'status':>8} {'rows':>9} {'seconds':>8}"]
+    for name, record in state["tasks"].items():
+        lines.append(
+            f"{name:<60} {record['status']:>8} {record.get('rows', ''):>9} "
+            f"{record.get('seconds', ''):>8}"
+        )
+    statuses = [record["status"] for record in state["tasks"].values()]
+    lines.append(", ".join(f"{statuses.count(s)} {s}" for s in (DONE, FAILED, SKIPPED)))
+    return "\n".join(lines)
+
+
+def main(
+    config_dir: str,
+    start_date: datetime.datetime | None = None,
+    end_date: datetime.datetime | None = None,
+    rerun_failed: bool = False,
+    state_path: str | None = None,
+    limits: dict | None = None,
+) -> dict:
+    """Updates the historical data of every config of `config_dir` in one concurrent run.
+
+    Args:
+        config_dir (str): Directory of `update_historical_data` / `update_historical_data_bnb`
+            configs, see `build_tasks`.
+        start_date (datetime, optional): Start of the Binance queries. Defaults to the day
+            before `end_date`.
+        end_date (datetime, optional): End of the queries. Defaults to today, 00:00 UTC.
+        rerun_failed (bool, optional): Only rerun the tasks of the last run that are not done,
+            with the dates of that run.
+        state_path (str, optional): State of the run. Defaults to a file of
+            `DEFAULT_STATE_DIR` for `config_dir`, see `default_state_path`.
+        limits (dict, optional): Max. running tasks per source, see `Runner`.
+
+    Returns:
+        dict: State of the run.
+    """
+    if state_path is None:
+        state_path = default_state_path(config_dir)
+
+    if rerun_failed:
+        with open(state_path) as f:
+            params = json.load(f)["params"]
+    else:
+        if end_date is None:
+            end_date = pd.Timestamp.now(tz="UTC").normalize()
+        if start_date is None:
+            start_date = pd.Timestamp(end_date) - pd.Timedelta(days=1)
+        params = {
+            "start_date": pd.Timestamp(start_date).isoformat(),
+            "end_date": pd.Timestamp(end_date).isoformat(),
+        }
+
+    runner = Runner(build_tasks(config_dir, params), state_path, limits)
+    state = runner.run(params, rerun_failed)
+    logging.info("\n" + summary(state))
+    return state
@@ -6,6 +6,7 @@ import json
 import click
 from dateutil.parser import parse as parse_datetime
 
+from etl.runner import main as etl_run
 from etl.update_historical_data_bnb import main as bnb_update
 
 
@@ -31,3 +32,33 @@ def update_historical_data_bnb(
     kwargs = {"symbol": symbol, "start_date": start_date, "end_date": end_date}
 
     bnb_update(config, **kwargs)
+
+
+@click.command
+@click.option("--config-dir", type=str, required=True)
+@click.option("--start-date", type=parse_datetime, default=None)
+@click.option("--end-date", type=parse_datetime, default=None)
+@click.option("--rerun-failed", is_flag=True, default=False)
+@click.option("--state-path", type=str, default=None)
+@click.option("--limit", type=str, multiple=True, help="Per source limit, e.g. ibkr=1")
+def run_etl(
+    config_dir: str,
+    start_date: dt.datetime | None,
+    end_date: dt.datetime | None,
+    rerun_failed: bool,
+    state_path: str | None,
+    limit: tuple,
+):
+    """Updates the historical data of every config in a directory, concurrently.
+
+    Args:
+        config_dir (str): Directory of JSON configs.
+        start_date (str): Start date of the Binance queries.
+        end_date (str): End date of the queries.
+        rerun_failed (bool): Only rerun the failed tasks of the last run.
+        state_path (str): State of the run, for reruns.
+        limit (tuple): Max. running tasks per source, as source=limit.
+    """
+    limits = {k: int(v) for k, v in (item.split("=", 1) for item in limit)}
+
+    etl_run(config_dir, start_date, end_date, rerun_failed, state_path, limits)
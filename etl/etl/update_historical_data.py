@@ -9,6 +9,8 @@ from dynaconf import Dynaconf
 
 from cio.data_loader import load_data
 from cio.data_writer import write_data
+from etl.materialized_views import update_views
+from etl.quality_checks import check_quality
 
 parser = argparse.ArgumentParser(description="Path of config file to pass to script")
 parser.add_argument("--config_path", type=str, help="Path to config file")
@@ -50,29 +52,51 @@ def main(config_path: str):
                 "sort_index": True,
                 "deduplicate_index": True
             }
+        },
+        "views": {  # optional, 5min / 30min / daily bars next to the minute data
+            "timeframes": ["5min", "30min", "daily"],
+            "lookback_days": 20
+        },
+        "quality": {  # optional, gap / anomaly scan of the written sessions, see `check_quality`
+            "session": {"anchor": "09:30", "length": 390, "timezone": "US/Eastern"}
         }
     }
     """
     # load all config params
     config = open(config_path)
     config = json.load(config)
-    dc = Dynaconf()
+    dc = resolve_config(config)
+
+    data = fetch(dc)
+
+    write_data(data, dc["writer_config"])
+    if dc.get("views") is not None:
+        update_views(data, dc["writer_config"], dc["views"])
+    if dc.get("quality") is not None:
+        check_quality(data, dc["writer_config"], dc["quality"])
+
+    return
 
-    # Load data
-    endDateTime = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d")
-    dc["endDateTime"] = endDateTime
+
+def resolve_config(config: dict, end_date: datetime.date | None = None) -> Dynaconf:
+    """Returns the config with the query ending on `end_date` (UTC), today by default."""
+    if end_date is None:
+        end_date = datetime.datetime.now(datetime.timezone.utc)
+    dc = Dynaconf()
+    dc["endDateTime"] = end_date.strftime("%Y%m%d")
     dc.update(config)
+    return dc
 
+
+def fetch(dc: Dynaconf) -> pd.DataFrame:
+    """Loads the historical data of a resolved config, with a timezone aware index."""
     data = load_data(dc["loader_config"])
 
     # Change to timezone aware timestamp
     data.index = pd.to_datetime(data.index, unit="s")
     data.index = pd.Series(data.index).dt.tz_localize("UTC")
     data.index = pd.Series(data.index).dt.tz_convert(dc["script_config"]["timezone"])
-
-    write_data(data, dc["writer_config"])
-
-    return
+    return data
 
 
 if __name__ == "__main__":
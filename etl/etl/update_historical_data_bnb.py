@@ -8,6 +8,8 @@ from dynaconf import Dynaconf
 
 from cio.data_loader import load_data
 from cio.data_writer import write_data
+from etl.materialized_views import update_views
+from etl.quality_checks import check_quality
 
 logging.getLogger("update_historical_data_bnb")
 logging.basicConfig(
@@ -40,40 +42,65 @@ def main(config: Dict, **kwargs):
                 "sort_index": True,
                 "deduplicate_index": True
             }
+        },
+        "views": {  # optional, 5min / 30min / daily bars next to the minute data
+            "timeframes": ["5min", "30min", "daily"],
+            "lookback_days": 20
+        },
+        "quality": {  # optional, gap / anomaly scan of the written sessions, see `check_quality`
+            "session": {"anchor": "00:00", "timezone": "UTC"}
         }
     }
     """
     logging.info("Updating historical data for {}".format(kwargs["symbol"]))
-    dates = pd.date_range(kwargs["start_date"], kwargs["end_date"], freq="12h")
-
-    for si in range(len(dates) - 1):
-        ei = si + 1
-        st = int(dates[si].timestamp()) * 1000
-        et = int(dates[ei].timestamp()) * 1000
-
-        logging.info("Querying from {} to {}".format(dates[si], dates[ei]))
-
-        dc = Dynaconf()
-        dc["symbol"] = kwargs["symbol"]
-        dc["startTime"] = str(st)
-        dc["endTime"] = str(et)
-
-        dc.update(config)
-
-        data = load_data(dc["loader_config"])
-        data.index = pd.to_datetime(data["kline_open_time"], unit="ms")
-        data.index = pd.Series(data.index).dt.tz_localize("UTC")
-
-        data = data.rename(
-            columns={
-                "open_price": "open",
-                "high_price": "high",
-                "low_price": "low",
-                "close_price": "close",
-                "volume": "volume",
-                "number_of_trades": "count",
-            }
-        )
-        data = data[["close", "open", "low", "high", "volume", "count"]]
-        data.index.name = None
+
+    for start, end in windows(kwargs["start_date"], kwargs["end_date"]):
+        logging.info("Querying from {} to {}".format(start, end))
+
+        dc = resolve_config(config, kwargs["symbol"], start, end)
+        data = fetch(dc)
         write_data(data, dc["writer_config"])
+        if dc.get("views") is not None:
+            update_views(data, dc["writer_config"], dc["views"])
+        if dc.get("quality") is not None:
+            check_quality(data, dc["writer_config"], dc["quality"])
+
+
+def windows(start_date, end_date) -> list:
+    """Returns the (start, end) of the 12h query windows from `start_date` to `end_date`."""
+    dates = pd.date_range(start_date, end_date, freq="12h")
+    return list(zip(dates[:-1], dates[1:]))
+
+
+def resolve_config(config: Dict, symbol: str, start=None, end=None) -> Dynaconf:
+    """Returns the config of the query of `symbol` from `start` to `end` (timestamps)."""
+    dc = Dynaconf()
+    dc["symbol"] = symbol
+    if start is not None:
+        dc["startTime"] = str(int(pd.Timestamp(start).timestamp()) * 1000)
+    if end is not None:
+        dc["endTime"] = str(int(pd.Timestamp(end).timestamp()) * 1000)
+
+    dc.update(config)
+    return dc
+
+
+def fetch(dc: Dynaconf) -> pd.DataFrame:
+    """Loads the klines of a resolved config as minute bars, indexed by open time (UTC)."""
+    data = load_data(dc["loader_config"])
+    data.index = pd.to_datetime(data["kline_open_time"], unit="ms")
+    data.index = pd.Series(data.index).dt.tz_localize("UTC")
+
+    data = data.rename(
+        columns={
+            "open_price": "open",
+            "high_price": "high",
+            "low_price": "low",
+            "close_price": "close",
+            "volume": "volume",
+            "number_of_trades": "count",
+        }
+    )
+    data = data[["close", "open", "low", "high", "volume", "count"]]
+    data.index.name = None
+    return data
@@ -1,19 +1,32 @@
+import functools
 import hashlib
 import hmac
 import json
 
-with open(
-    "vault_secrets/bnb_keys.json", "r"
-) as f:
-    secrets = json.load(f)
-
-API_KEY = secrets["API_KEY"]
-API_SECRET = secrets["API_SECRET"]
+SECRETS_PATH = "vault_secrets/bnb_keys.json"
 
 # BASE_URL = "https://api.binance.com"
 BASE_URL = "https://api-gcp.binance.com"
 
-DEFAULT_HEADERS = {"X-MBX-APIKEY": API_KEY}
+
+@functools.lru_cache(maxsize=None)
+def get_secrets() -> dict:
+    """Reads Binance API credentials from the vault on first use.
+
+    Returns:
+        dict: Secrets with keys "API_KEY" and "API_SECRET".
+    """
+    with open(SECRETS_PATH, "r") as f:
+        return json.load(f)
+
+
+def get_default_headers() -> dict:
+    """Return default headers for Binance REST calls.
+
+    Returns:
+        dict: Headers with API key.
+    """
+    return {"X-MBX-APIKEY": get_secrets()["API_KEY"]}
 
 
 def get_query_signature(query_string: str) -> str:
@@ -26,5 +39,16 @@ def get_query_signature(query_string: str) -> str:
         str: auth signature
     """
     return hmac.new(
-        API_SECRET.encode("utf-8"), query_string.encode("utf-8"), hashlib.sha256
+        get_secrets()["API_SECRET"].encode("utf-8"),
+        query_string.encode("utf-8"),
+        hashlib.sha256,
     ).hexdigest()
+
+
+def __getattr__(name: str):
+    # API_KEY, API_SECRET and DEFAULT_HEADERS used to be read at import time
+    if name in ("API_KEY", "API_SECRET"):
+        return get_secrets()[name]
+    if name == "DEFAULT_HEADERS":
+        return get_default_headers()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -4,6 +4,17 @@
 # poetry run python etl/update_historical_data.py --config_path configs/update_historical_qqq.json
 
 
+# All configs at once, concurrently (IBKR one query at a time), see etl/runner.py
+# poetry run etl_run --config-dir configs
+# poetry run etl_run --config-dir configs --rerun-failed
+
+
+# Gap / anomaly scan of a whole minute dataset, with the "quality" key of its config
+# poetry run python etl/quality_checks.py \
+#     --filename <data_dir>/spy_mins.parquet \
+#     --config_path configs/update_historical_spy.json
+
+
 # Binance data
 """
 poetry run bnb_update \
@@ -0,0 +1,285 @@
+"""End to end run of `BinanceStream` against a local websocket stand-in of Binance.
+
+The stand-in runs in its own process and streams aggTrade and final kline_1m events of
+BTCUSDT at `--rate` messages per second (minutes are simulated, `--trades-per-minute` trades
+each, frames serialized before streaming, only their event time is set when sent). It drops
+the connection after half of the minutes and skips `--gap` minutes before accepting the
+reconnect. The missing bars are backfilled through a stand-in REST loader. Checks that the
+bars on the bus are the stand-in's bars without gaps, then reports the throughput, batch
+sizes, the event to publish latency and the CPU time of the ingester per message, which
+bounds the rate it sustains on one core whatever the stand-in costs.
+
+    poetry run python benchmarks/binance_stream.py --rate 50000 --minutes 40
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+import pandas as pd
+import websockets
+
+import trading.binance_stream as binance_stream
+from cio.data_loader import BaseLoader
+from cio.registry import loaders
+from trading.binance_stream import MS_PER_MINUTE, BinanceStream
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--rate", type=float, default=50_000, help="Messages per second")
+parser.add_argument("--minutes", type=int, default=40)
+parser.add_argument("--trades-per-minute", type=int, default=2000)
+parser.add_argument("--gap", type=int, default=5, help="Minutes missed on reconnect")
+
+SYMBOL = "BTCUSDT"
+
+
+def make_minutes(
+    start: int, n_minutes: int, trades_per_minute: int, seed: int = 0
+) -> list:
+    """Trades (time ms, price, qty) and the kline of every simulated minute."""
+    rng = np.random.default_rng(seed)
+    minutes = []
+    price = 95_000.0
+    for i in range(n_minutes):
+        minute = start + i
+        times = minute * MS_PER_MINUTE + np.sort(
+            rng.integers(0, MS_PER_MINUTE, trades_per_minute)
+        )
+        prices = np.round(price + np.cumsum(rng.normal(0, 2, trades_per_minute)), 2)
+        qtys = np.round(rng.random(trades_per_minute), 5)
+        price = prices[-1]
+        kline = (minute, prices[0], prices.max(), prices.min(), prices[-1], qtys.sum())
+        minutes.append((times, prices, qtys, kline))
+    return minutes
+
+
+def trade_frame(t: int, price: float, qty: float) -> tuple:
+    data = {
+        "e": "aggTrade",
+        "E": 0,
+        "s": SYMBOL,
+        "a": t,
+        "p": f"{price:.2f}",
+        "q": f"{qty:.5f}",
+        "f": t,
+        "l": t,
+        "T": t,
+        "m": False,
+        "M": True,
+    }
+    return frame_template({"stream": "btcusdt@aggTrade", "data": data})
+
+
+def kline_frame(kline: tuple) -> tuple:
+    minute, o, h, low, c, v = kline
+    k = {
+        "t": minute * MS_PER_MINUTE,
+        "T": (minute + 1) * MS_PER_MINUTE - 1,
+        "s": SYMBOL,
+        "i": "1m",
+        "o": f"{o:.2f}",
+        "h": f"{h:.2f}",
+        "l": f"{low:.2f}",
+        "c": f"{c:.2f}",
+        "v": f"{v:.5f}",
+        "n": 0,
+        "x": True,
+    }
+    data = {"e": "kline", "E": 0, "s": SYMBOL, "k": k}
+    return frame_template({"stream": "btcusdt@kline_1m", "data": data})
+
+
+def frame_template(message: dict) -> tuple:
+    """The JSON of `message` split around the value of its event time "E"."""
+    prefix, suffix = json.dumps(message).split('"E": 0', 1)
+    return prefix + '"E": ', suffix
+
+
+class StandInServer:
+    def __init__(
+        self, minutes: list, rate: float, gap: int, sent: multiprocessing.Queue
+    ):
+        """Streams `minutes` to the first connection, resumes `gap` minutes later on the next.
+
+        Puts the number of frames sent in `sent` once all the minutes are streamed.
+        """
+        self.frames = [
+            [
+                trade_frame(*trade)
+                for trade in zip(times.tolist(), prices.tolist(), qtys.tolist())
+            ]
+            + [kline_frame(kline)]
+            for times, prices, qtys, kline in minutes
+        ]
+        self.rate = rate
+        self.gap = gap
+        self.next_minute = 0
+        self.sent = 0
+        self.sent_queue = sent
+
+    async def handler(self, ws):
+        drop_at = len(self.frames) // 2 if self.next_minute == 0 else None
+        if self.next_minute:
+            self.next_minute += self.gap
+        burst = max(int(self.rate / 100), 1)
+        started = time.perf_counter()
+        sent = 0
+        while self.next_minute < len(self.frames):
+            if self.next_minute == drop_at:
+                await ws.close()
+                return
+            frames = self.frames[self.next_minute]
+            for i in range(0, len(frames), burst):
+                event_time = str(time.time_ns() // 10**6)
+                for prefix, suffix in frames[i : i + burst]:
+                    await ws.send(prefix + event_time + suffix)
+                sent += len(frames[i : i + burst])
+                # pace to the target rate
+                delay = sent / self.rate - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.sent += len(frames)
+            self.next_minute += 1
+        self.sent_queue.put(self.sent)
+        await ws.wait_closed()
+
+
+def stand_in(
+    args, start: int, port: multiprocessing.Queue, sent: multiprocessing.Queue
+):
+    """Stand-in process, serves until terminated, puts its port in `port` once listening."""
+
+    async def serve():
+        minutes = make_minutes(start, args.minutes, args.trades_per_minute)
+        server = StandInServer(minutes, args.rate, args.gap, sent)
+        async with websockets.serve(server.handler, "127.0.0.1", 0) as ws_server:
+            port.put(ws_server.sockets[0].getsockname()[1])
+            await asyncio.Future()
+
+    asyncio.run(serve())
+
+
+def stand_in_loader(minutes: list):
+    klines = pd.DataFrame(
+        [m[3] for m in minutes],
+        columns=[
+            "minute",
+            "open_price",
+            "high_price",
+            "low_price",
+            "close_price",
+            "volume",
+        ],
+    )
+    klines["kline_open_time"] = klines.pop("minute") * MS_PER_MINUTE
+
+    class StandInKlinesLoader(BaseLoader):
+        def iter_data(self):
+            params = self.config["params"]
+            start, end = int(params["startTime"]), int(params["endTime"])
+            t = klines["kline_open_time"]
+            yield klines[(t >= start) & (t <= end)]
+
+    return StandInKlinesLoader
+
+
+async def run(args):
+    # simulated minutes from now on, so the backfill on reconnect up to the current
+    # minute finds no missing bar and the gap is backfilled from the next streamed bar
+    start = time.time_ns() // 10**6 // MS_PER_MINUTE
+    minutes = make_minutes(start, args.minutes, args.trades_per_minute)
+    loaders.register("StandInKlinesLoader", stand_in_loader(minutes))
+    binance_stream.MIN_BACKOFF = 0.05
+    # fail instead of waiting forever if the stream falls far behind or stalls
+    timeout = 60 + 3 * args.minutes * (args.trades_per_minute + 1) / args.rate
+
+    ctx = multiprocessing.get_context("spawn")
+    port_queue, sent_queue = ctx.Queue(), ctx.Queue()
+    server = ctx.Process(target=stand_in, args=(args, start, port_queue, sent_queue))
+    server.start()
+    stream = None
+    try:
+        port = await asyncio.to_thread(port_queue.get, timeout=60)
+        stream = BinanceStream(
+            {
+                "bus": {"prefix": "mdbench", "capacity": 2**21},
+                "url": f"ws://127.0.0.1:{port}",
+                "symbols": [SYMBOL],
+                "streams": ["aggTrade", "kline_1m"],
+                "backfill": {"loader_class": "StandInKlinesLoader"},
+            }
+        )
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        task = asyncio.create_task(stream.run())
+        try:
+            sent = await asyncio.to_thread(sent_queue.get, timeout=timeout)
+            deadline = time.perf_counter() + timeout
+            while stream.messages < sent and not task.done():
+                if time.perf_counter() > deadline:
+                    raise TimeoutError(
+                        f"{stream.messages} of {sent} messages processed"
+                    )
+                await asyncio.sleep(0.01)
+        except queue.Empty:
+            raise TimeoutError(f"stand-in did not finish streaming in {timeout:.0f}s")
+        finally:
+            elapsed = time.perf_counter() - started
+            cpu = time.process_time() - cpu_started
+            stream.stop()
+            await task
+
+        # read from the stream's own rings, a `BusReader` attached in the process owning
+        # the rings would unregister them from its resource tracker
+        bars, _, _ = stream.bars[SYMBOL].read(0)
+        ticks, _, _ = stream.ticks[SYMBOL].read(0)
+    finally:
+        server.terminate()
+        server.join()
+        if stream is not None:
+            stream.close()
+
+    expected = np.array([m[3] for m in minutes])
+    streamed = args.minutes - args.gap
+    assert len(bars) == args.minutes, (len(bars), args.minutes)
+    assert (bars["ts"] // 10**6 // MS_PER_MINUTE == expected[:, 0]).all()
+    for i, field in enumerate(("open", "high", "low", "close"), 1):
+        assert np.allclose(bars[field], expected[:, i])
+    assert len(ticks) == 2 * streamed * args.trades_per_minute
+
+    stats = stream.stats()
+    print(
+        f"{stats['messages']:,} messages in {elapsed:.2f}s "
+        f"({stats['messages'] / elapsed:,.0f} / s, target {args.rate:,.0f} / s)"
+    )
+    print(
+        f"{stats['batches']:,} batches, {stats['messages'] / stats['batches']:.1f} "
+        f"frames per batch on average, {stats['max_batch']} max"
+    )
+    print(
+        f"latency event -> bus: p50 {stats['latency_ms_p50']:.1f} ms, "
+        f"p99 {stats['latency_ms_p99']:.1f} ms"
+    )
+    print(
+        f"ingester cpu {cpu:.2f}s, {cpu / stats['messages'] * 1e6:.1f} us per message "
+        f"({stats['messages'] / cpu:,.0f} / s on one core)"
+    )
+    print(
+        f"{stats['reconnects']} reconnect, {stats['backfilled']} bars backfilled, "
+        f"{len(bars)} bars on the bus without gaps"
+    )
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.minutes - args.minutes // 2 - args.gap < 1:
+        # the gap is only backfilled once a bar is streamed after the reconnect
+        parser.error(
+            "--gap must leave at least one minute to stream after the reconnect"
+        )
+    asyncio.run(run(args))
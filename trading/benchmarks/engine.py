@@ -0,0 +1,232 @@
+"""Compares the threaded and the asyncio engine of `IntradayMomentum` against a fake gateway.
+
+Reports the process CPU time while idle (connected, no market data) and the latency from a
+tick being written to the socket to `tickPrice` running in the strategy.
+
+    poetry run python benchmarks/engine.py --idle-seconds 10 --ticks 2000
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from queue import Queue
+
+import numpy as np
+import pandas as pd
+from ibapi import comm
+
+from trading.volatility_range_momentum import IntradayMomentum
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--idle-seconds", type=float, default=10)
+parser.add_argument("--ticks", type=int, default=2000)
+parser.add_argument("--tick-interval", type=float, default=0.002)
+# internal, every engine runs in its own interpreter
+parser.add_argument("--mode", choices=["threads", "asyncio"])
+parser.add_argument("--history")
+
+
+def make_history(filename: str, n_days: int = 30):
+    rng = np.random.default_rng(0)
+    days = pd.bdate_range("2024-01-02", periods=n_days)
+    index = pd.DatetimeIndex(
+        np.concatenate(
+            [
+                pd.date_range(d + pd.Timedelta("9h30min"), periods=390, freq="min")
+                for d in days
+            ]
+        )
+    ).tz_localize("US/Eastern")
+    close = 400 * np.exp(np.cumsum(rng.normal(0, 5e-4, len(index))))
+    pd.DataFrame(
+        {
+            "close": close,
+            "open": close,
+            "low": close * 0.9999,
+            "high": close * 1.0001,
+            "volume": 1000.0,
+            "count": 10,
+        },
+        index=index,
+    ).to_parquet(filename)
+
+
+def make_config(filename: str) -> dict:
+    return {
+        "historical_data": {
+            "loader_class": "ParquetDataFrameLoader",
+            "filename": filename,
+        },
+        "strategy": {
+            "capital": 10000,
+            "max_leverage": 3,
+            "volatility_target": 0.02,
+            "lookback_days": 20,
+            "volatility_multiplier": 1,
+            "iana_timezone": "US/Eastern",
+        },
+        "ibkr_params": {
+            "genericTickList": "",
+            "snapshot": False,
+            "regulatorySnapshot": False,
+            "mktDataOptions": [],
+        },
+        "contract": {
+            "symbol": "SPY",
+            "secType": "STK",
+            "exchange": "SMART",
+            "currency": "USD",
+        },
+    }
+
+
+def recv_msg(conn: socket.socket, buf: bytes) -> tuple[bytes, bytes]:
+    while True:
+        size, msg, buf = comm.read_msg(buf)
+        if msg:
+            return msg, buf
+        data = conn.recv(65536)
+        if not data:
+            raise ConnectionError("client closed")
+        buf += data
+
+
+class FakeGateway(threading.Thread):
+    def __init__(self):
+        """Accepts one client, answers the handshake and `startApi` and sends ticks on demand."""
+        super().__init__(daemon=True)
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.conn = None
+        self.connected = threading.Event()
+        self.sent_at = []
+
+    def run(self):
+        conn, _ = self.server.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buf = conn.recv(4)  # "API\0"
+        _, buf = recv_msg(conn, b"")
+        conn.sendall(
+            comm.make_msg(
+                comm.make_field(176) + comm.make_field("20240102 09:29:00 EST")
+            )
+        )
+        _, buf = recv_msg(conn, buf)  # startApi
+        conn.sendall(comm.make_msg("".join(comm.make_field(v) for v in (9, 1, 1000))))
+        self.conn = conn
+        self.connected.set()
+        with contextlib.suppress(OSError, ConnectionError):
+            while True:
+                _, buf = recv_msg(conn, buf)
+
+    def send_tick(self, price: float):
+        fields = (1, 6, 1001, 68, price, 0, 0)
+        msg = comm.make_msg("".join(comm.make_field(v) for v in fields))
+        self.sent_at.append(time.perf_counter())
+        self.conn.sendall(msg)
+
+
+class TimedIntradayMomentum(IntradayMomentum):
+    def __init__(self, config: dict):
+        super().__init__(config)
+        self.received_at = []
+
+    def tickPrice(self, reqId, tickType, price, attrib):
+        self.received_at.append(time.perf_counter())
+        super().tickPrice(reqId, tickType, price, attrib)
+
+
+def drive(gateway: FakeGateway, args, app, results: dict):
+    gateway.connected.wait()
+    # let start-up settle
+    time.sleep(1)
+    cpu = time.process_time()
+    time.sleep(args.idle_seconds)
+    results["idle_cpu_pct"] = 100 * (time.process_time() - cpu) / args.idle_seconds
+
+    for i in range(args.ticks):
+        gateway.send_tick(400 + (i % 10) * 0.01)
+        time.sleep(args.tick_interval)
+    time.sleep(0.5)
+    latency = np.array(app.received_at[: len(gateway.sent_at)]) - np.array(
+        gateway.sent_at[: len(app.received_at)]
+    )
+    results["tick_latency_us_p50"] = 1e6 * float(np.median(latency))
+    results["tick_latency_us_p99"] = 1e6 * float(np.quantile(latency, 0.99))
+
+
+def run_mode(mode: str, args, history: str) -> dict:
+    gateway = FakeGateway()
+    gateway.start()
+    app = TimedIntradayMomentum(make_config(history))
+    results = {"mode": mode}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "threads":
+            # same threads as `volatility_range_momentum.main`, minus the fixed sleeps
+            app.connect("127.0.0.1", gateway.port, clientId=1)
+            orders_queue = Queue()
+            threading.Thread(target=app.run, daemon=True).start()
+            threading.Thread(
+                target=app.run_strategy,
+                kwargs=dict(orders_queue=orders_queue),
+                daemon=True,
+            ).start()
+            threading.Thread(
+                target=app.manage_positions,
+                kwargs=dict(orders_queue=orders_queue),
+                daemon=True,
+            ).start()
+            drive(gateway, args, app, results)
+            # stops the (non daemon) EReader thread
+            app.disconnect()
+        else:
+            from trading.engine import AsyncEngine
+
+            engine = AsyncEngine(app, "127.0.0.1", gateway.port, client_id=1)
+
+            def driver():
+                drive(gateway, args, app, results)
+                engine.loop.call_soon_threadsafe(engine.stop)
+
+            threading.Thread(target=driver, daemon=True).start()
+            engine.run_forever()
+
+    return results
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.mode is not None:
+        print(json.dumps(run_mode(args.mode, args, args.history)))
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        history = os.path.join(tmp, "spy_mins.parquet")
+        make_history(history)
+        for mode in ("threads", "asyncio"):
+            cmd = [sys.executable, __file__, "--mode", mode, "--history", history]
+            cmd += [
+                "--idle-seconds",
+                str(args.idle_seconds),
+                "--ticks",
+                str(args.ticks),
+            ]
+            cmd += ["--tick-interval", str(args.tick_interval)]
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            results = json.loads(out.splitlines()[-1])
+            print(
+                "{mode:>8}: idle cpu {idle_cpu_pct:.3f}% | tick latency p50 "
+                "{tick_latency_us_p50:.0f} us, p99 {tick_latency_us_p99:.0f} us".format(
+                    **results
+                )
+            )
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trading import binance_stream
+from trading.binance_stream import MS_PER_MINUTE, BinanceStream
+
+FIRST_MINUTE = 28_000_000
+
+
+def kline_frame(minute: int, final=True) -> str:
+    """Kline frame of BTCUSDT for `minute` (epoch minutes), close = minute."""
+    price = str(float(minute))
+    kline = {"t": minute * MS_PER_MINUTE, "o": price, "h": price, "l": price}
+    kline.update({"c": price, "v": "1.0", "x": final})
+    data = {"e": "kline", "E": (minute + 1) * MS_PER_MINUTE, "s": "BTCUSDT", "k": kline}
+    return json.dumps({"stream": "btcusdt@kline_1m", "data": data})
+
+
+class KlinesLoader:
+    """`load_klines` stand-in, fails while `down`."""
+
+    def __init__(self):
+        self.down = False
+        self.calls = []
+
+    def __call__(self, symbol: str, start: int, end: int) -> pd.DataFrame:
+        self.calls.append((start, end))
+        if self.down:
+            raise OSError("REST down")
+        minutes = np.arange(start, end + 1)
+        prices = minutes.astype(float)
+        return pd.DataFrame(
+            {
+                "kline_open_time": minutes * MS_PER_MINUTE,
+                "open_price": prices,
+                "high_price": prices,
+                "low_price": prices,
+                "close_price": prices,
+                "volume": np.ones(len(minutes)),
+            }
+        )
+
+
+@pytest.fixture
+def stream():
+    config = {
+        "bus": {"prefix": f"bstest_{os.getpid()}", "capacity": 64},
+        "symbols": ["BTCUSDT"],
+        "streams": ["kline_1m"],
+    }
+    stream = BinanceStream(config)
+    stream.load_klines = KlinesLoader()
+    yield stream
+    stream.close()
+
+
+def published_minutes(stream: BinanceStream) -> list:
+    bars, _, _ = stream.bars["BTCUSDT"].read(0)
+    return list(bars["ts"] // (MS_PER_MINUTE * 10**6))
+
+
+async def feed(stream: BinanceStream, batches: list):
+    """Queues `batches` of frames one at a time to a running `process_frames`."""
+    processor = asyncio.create_task(stream.process_frames())
+    for frames in batches:
+        done = stream.batches + stream.failed_batches + 1
+        stream.frames.extend(frames)
+        stream.wake.set()
+        while stream.batches + stream.failed_batches < done:
+            await asyncio.sleep(0.01)
+    assert not processor.done()
+    processor.cancel()
+
+
+def test_failed_backfill_is_retried_with_the_next_bar(stream):
+    m = FIRST_MINUTE
+    loader = stream.load_klines
+
+    async def run():
+        await feed(stream, [[kline_frame(m)]])
+        loader.down = True
+        await feed(stream, [[kline_frame(m + 3)], [kline_frame(m + 4)]])
+        assert published_minutes(stream) == [m]
+        assert stream.last_minute["BTCUSDT"] == m
+        loader.down = False
+        await feed(stream, [[kline_frame(m + 5)]])
+
+    asyncio.run(run())
+
+    assert published_minutes(stream) == list(range(m, m + 6))
+    assert loader.calls == [(m + 1, m + 2), (m + 1, m + 3), (m + 1, m + 4)]
+    assert stream.backfilled == 4
+
+
+def test_failed_batch_does_not_stop_processing(stream):
+    m = FIRST_MINUTE
+    malformed = json.dumps({"stream": "btcusdt@kline_1m", "data": {"e": "kline"}})
+    reply = json.dumps({"result": None, "id": 1})
+
+    async def run():
+        await feed(
+            stream,
+            [
+                [kline_frame(m)],
+                [malformed, kline_frame(m + 1)],
+                [reply, kline_frame(m + 1)],
+            ],
+        )
+
+    asyncio.run(run())
+
+    assert published_minutes(stream) == [m, m + 1]
+    assert stream.failed_batches == 1
+    assert stream.backfilled == 0
+
+
+def test_queue_drops_the_oldest_frames(stream, monkeypatch):
+    monkeypatch.setattr(binance_stream, "MAX_QUEUED_FRAMES", 10)
+    monkeypatch.setattr(binance_stream, "MAX_BATCH", 4)
+    stream.frames = list(range(11))
+    stream.drop_frames()
+
+    assert stream.frames == list(range(5, 11))
+    assert stream.dropped == 5
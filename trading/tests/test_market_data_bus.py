@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from trading.market_data_bus import TICK_DTYPE, SharedRing
+
+CAPACITY = 8
+N_RECORDS = 300_000
+
+
+def record_fields(seqs: np.ndarray) -> dict:
+    """Fields derived from the seq of a record, a torn record does not match its seq."""
+    return {"ts": seqs * 3, "tick_type": seqs % 7, "value": seqs.astype(float)}
+
+
+def publish(ring: SharedRing, first: int, last: int, batch: int):
+    """Publishes the records of seq `first + 1` to `last`, `batch` records at a time."""
+    for seq in range(first, last, batch):
+        seqs = np.arange(seq + 1, min(seq + batch, last) + 1)
+        if batch == 1:
+            fields = record_fields(seqs)
+            ring.publish(fields["ts"][0], fields["tick_type"][0], fields["value"][0])
+        else:
+            ring.publish_many(**record_fields(seqs))
+
+
+def produce(name: str, batch: int, started):
+    ring = SharedRing(name, TICK_DTYPE)
+    started.set()
+    publish(ring, 0, N_RECORDS, batch)
+    ring.close()
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing(f"mdbus_test_{os.getpid()}", TICK_DTYPE, CAPACITY, create=True)
+    yield ring
+    ring.close()
+
+
+class LappingRecords:
+    """Records of a ring where the producer laps the reader in the middle of its copy.
+
+    The first copy of records returns the old `seq` of every record with the fields written
+    by the producer after it, as a copy interleaved with the producer's writes would.
+    """
+
+    def __init__(self, ring: SharedRing, batch: int):
+        self.ring = ring
+        self.records = ring.records
+        self.batch = batch
+        self.lapped = False
+
+    def __getitem__(self, key):
+        if isinstance(key, str) or self.lapped:
+            return self.records[key]
+        copy = self.records[key]
+        self.lapped = True
+        head = self.ring.head
+        self.ring.records = self.records
+        publish(self.ring, head, head + self.ring.capacity, self.batch)
+        self.ring.records = self
+        torn = self.records[key]
+        torn["seq"] = copy["seq"]
+        return torn
+
+
+@pytest.mark.parametrize("batch", [1, 5])
+def test_read_drops_records_overwritten_during_the_copy(ring, batch):
+    publish(ring, 0, 6, batch)
+    ring.records = LappingRecords(ring, batch)
+    records, cursor, lost = ring.read(0)
+    ring.records = ring.records.records
+
+    assert len(records) == 0
+    assert cursor == 6
+    assert lost == 6
+    records, cursor, lost = ring.read(cursor)
+    np.testing.assert_array_equal(records["seq"], np.arange(7, 6 + CAPACITY + 1))
+    assert lost == 0
+
+
+@pytest.mark.parametrize("batch", [1, 5])
+def test_read_never_returns_torn_records_on_overrun(ring, batch):
+    ctx = multiprocessing.get_context("spawn")
+    started = ctx.Event()
+    producer = ctx.Process(target=produce, args=(ring.name, batch, started))
+    producer.start()
+    started.wait()
+
+    cursor, n_read, n_lost = 0, 0, 0
+    while True:
+        done = not producer.is_alive()
+        records, new_cursor, lost = ring.read(cursor)
+        seqs = records["seq"]
+        expected = record_fields(seqs)
+        for field, values in expected.items():
+            np.testing.assert_array_equal(records[field], values)
+        # records are contiguous and every record after the cursor is read or counted lost
+        np.testing.assert_array_equal(
+            seqs, np.arange(new_cursor - len(seqs) + 1, new_cursor + 1)
+        )
+        assert new_cursor - cursor == len(records) + lost
+        cursor = new_cursor
+        n_read += len(records)
+        n_lost += lost
+        if done and cursor == ring.head:
+            break
+
+    producer.join()
+    assert producer.exitcode == 0
+    assert cursor == ring.head == N_RECORDS
+    assert n_read + n_lost == N_RECORDS
+    assert n_lost > 0
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import datetime
+import time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+MINUTES_PER_DAY = 24 * 60
+BAR_FIELDS = ("open", "high", "low", "close", "volume")
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(len(BAR_FIELDS))
+
+
+class MinuteBars:
+    def __init__(self, timezone: ZoneInfo):
+        """Minute bars of the current session, handed from the market data thread to the strategy.
+
+        Bars live in a preallocated (minute of day x field) array, in local time of `timezone`.
+        There is a single writer (`update`, called from `tickPrice` / `tickSize` on the EReader
+        thread or the event loop) and any number of readers (`snapshot`), synchronized with a
+        sequence lock instead of a mutex:
+
+        - the writer bumps `seq` to an odd value, writes the bar, then bumps it back to even,
+          it never waits on a reader,
+        - a reader copies the minutes it needs and keeps the copy only if `seq` was even and
+          unchanged over the copy, otherwise it retries.
+
+        Readers thus always see whole ticks, without locking the writer out and without
+        copying the whole day.
+
+        Args:
+            timezone (ZoneInfo): Timezone the session and minutes are bucketed in.
+        """
+        self.timezone = timezone
+        self.values = np.full((MINUTES_PER_DAY, len(BAR_FIELDS)), np.nan)
+        self.session = None
+        self.first_minute = -1
+        self.last_minute = -1
+        self.seq = 0
+
+    @property
+    def empty(self) -> bool:
+        return self.last_minute < 0
+
+    def update(
+        self,
+        price: float | None = None,
+        size: float | None = None,
+        now: datetime.datetime | None = None,
+    ) -> bool:
+        """Adds a trade price and / or size to the bar of the current minute.
+
+        Args:
+            price (float, optional): Last price.
+            size (float, optional): Last size, added to the minute volume.
+            now (datetime.datetime, optional): Time of the tick. Defaults to now.
+
+        Returns:
+            bool: True if the tick opened a new bar, that is the previous bar closed.
+        """
+        now = datetime.datetime.now(self.timezone) if now is None else now
+        now = now.astimezone(self.timezone)
+        minute = now.hour * 60 + now.minute
+
+        self.seq += 1
+        try:
+            if now.date() != self.session:
+                # new session, start from an empty day
+                self.values.fill(np.nan)
+                self.session = now.date()
+                self.first_minute = self.last_minute = -1
+
+            bar = self.values[minute]
+            if price is not None:
+                if np.isnan(bar[OPEN]):
+                    bar[OPEN] = bar[HIGH] = bar[LOW] = price
+                else:
+                    bar[HIGH] = max(bar[HIGH], price)
+                    bar[LOW] = min(bar[LOW], price)
+                bar[CLOSE] = price
+            if size is not None:
+                bar[VOLUME] = size if np.isnan(bar[VOLUME]) else bar[VOLUME] + size
+
+            new_bar = minute > self.last_minute
+            if self.first_minute < 0:
+                self.first_minute = minute
+            self.last_minute = max(self.last_minute, minute)
+        finally:
+            self.seq += 1
+        return new_bar
+
+    def restore(self, values: np.ndarray, session: datetime.date):
+        """Restores the bars of `session` from a copy of `values`, for ex. from a checkpoint."""
+        self.seq += 1
+        try:
+            self.values[:] = values
+            self.session = session
+            minutes = np.flatnonzero(~np.isnan(values).all(axis=1))
+            self.first_minute = int(minutes[0]) if len(minutes) else -1
+            self.last_minute = int(minutes[-1]) if len(minutes) else -1
+        finally:
+            self.seq += 1
+
+    def snapshot(self, bucket: int | None = None) -> pd.DataFrame:
+        """Returns a consistent copy of the bars of the day so far.
+
+        Args:
+            bucket (int, optional): Only return the bars of the `bucket` minutes interval that
+                holds the last bar, for ex. 30 for the current half hour. Defaults to the whole
+                day.
+
+        Returns:
+            pd.DataFrame: One row per minute with data, indexed by local timestamp, with the
+                columns of `BAR_FIELDS`.
+        """
+        while True:
+            seq = self.seq
+            if seq & 1:
+                # a write is in progress, let the writer finish it
+                time.sleep(0)
+                continue
+
+            session, last = self.session, self.last_minute
+            if bucket is None:
+                start = self.first_minute
+            else:
+                start = max(last - last % bucket, self.first_minute)
+            values = self.values[start : last + 1].copy()
+            if self.seq == seq:
+                break
+
+        if session is None:
+            return pd.DataFrame(columns=BAR_FIELDS, dtype=float)
+
+        minutes = np.arange(start, last + 1)
+        keep = ~np.isnan(values).all(axis=1)
+        index = pd.DatetimeIndex(
+            np.datetime64(session, "ns") + minutes[keep] * np.timedelta64(1, "m")
+        ).tz_localize(self.timezone.key)
+        return pd.DataFrame(values[keep], index=index, columns=BAR_FIELDS)
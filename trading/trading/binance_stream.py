@@ -0,0 +1,483 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import time
+
+import numpy as np
+import websockets
+
+from cio.data_loader import load_data
+from cio.klines import loads
+from trading.market_data_bus import (
+    BAR_DTYPE,
+    DEFAULT_CAPACITY,
+    DEFAULT_PREFIX,
+    TICK_DTYPE,
+    SharedRing,
+    ring_name,
+)
+
+DEFAULT_URL = "wss://stream.binance.com:9443"
+DEFAULT_STREAMS = ["aggTrade", "kline_1m"]
+# IBKR tick types trades are published as, last price / last size
+LAST_PRICE, LAST_SIZE = 4, 5
+MS_PER_MINUTE = 60_000
+# max. frames decoded at once, batches only grow while the decoder falls behind
+MAX_BATCH = 4096
+# max. frames queued for decoding, the oldest are dropped beyond (about 5s at 50k / s)
+MAX_QUEUED_FRAMES = 2**18
+MIN_BACKOFF, MAX_BACKOFF = 0.5, 30.0
+# max. minutes backfilled after a disconnect, Binance keeps the stream for 24h
+MAX_BACKFILL_MINUTES = 24 * 60
+# event to processing latencies kept for `BinanceStream.stats`
+N_LATENCIES = 10_000
+
+parser = argparse.ArgumentParser(description="Path of config file to pass to script")
+parser.add_argument("-c", "--config-path", type=str, help="Path to config file")
+
+
+def stream_url(url: str, symbols: list, streams: list) -> str:
+    """Combined stream URL of `streams` (for ex. "aggTrade", "kline_1m") of `symbols`."""
+    names = [f"{symbol.lower()}@{stream}" for symbol in symbols for stream in streams]
+    return f"{url}/stream?streams={'/'.join(names)}"
+
+
+def decode_events(frames: list) -> dict:
+    """Decodes a batch of combined stream frames into typed columns per symbol and event.
+
+    Prices and quantities come as JSON strings, they are converted once per batch and
+    column, like `cio.klines.decode_klines`.
+
+    Args:
+        frames (list): Raw frames, `{"stream": ..., "data": {...}}`.
+
+    Returns:
+        dict: (symbol, "aggTrade" | "kline") to a dict of numpy columns, in frame order:
+            aggTrade: time (trade time, ms), price, qty, event_time (ms),
+            kline: start (ms), open, high, low, close, volume, final, event_time (ms).
+    """
+    events = collections.defaultdict(list)
+    for frame in frames:
+        data = loads(frame).get("data")
+        if data is None:
+            # not a stream event, for ex. the reply to a (un)subscribe request
+            continue
+        events[data["s"], data["e"]].append(data)
+
+    columns = {}
+    for (symbol, event), items in events.items():
+        if event == "aggTrade":
+            columns[symbol, event] = {
+                "time": np.array([d["T"] for d in items], dtype=np.int64),
+                "price": np.array([d["p"] for d in items], dtype=np.float64),
+                "qty": np.array([d["q"] for d in items], dtype=np.float64),
+                "event_time": np.array([d["E"] for d in items], dtype=np.int64),
+            }
+        elif event == "kline":
+            klines = [d["k"] for d in items]
+            columns[symbol, event] = {
+                "start": np.array([k["t"] for k in klines], dtype=np.int64),
+                "open": np.array([k["o"] for k in klines], dtype=np.float64),
+                "high": np.array([k["h"] for k in klines], dtype=np.float64),
+                "low": np.array([k["l"] for k in klines], dtype=np.float64),
+                "close": np.array([k["c"] for k in klines], dtype=np.float64),
+                "volume": np.array([k["v"] for k in klines], dtype=np.float64),
+                "final": np.array([k["x"] for k in klines], dtype=bool),
+                "event_time": np.array([d["E"] for d in items], dtype=np.int64),
+            }
+    return columns
+
+
+def empty_bars() -> dict:
+    return {
+        "minute": np.empty(0, dtype=np.int64),
+        **{field: np.empty(0) for field in ("open", "high", "low", "close", "volume")},
+    }
+
+
+class MinuteBarAggregator:
+    def __init__(self):
+        """Minute bars from trades, a bar closes with the first trade of a later minute.
+
+        Batches of trades are aggregated at once (`np.*.reduceat` over the runs of equal
+        minutes). Only the open bar is kept, trades older than it are dropped.
+        """
+        self.minute = -1
+        self.bar = np.full(5, np.nan)
+
+    def add_trades(
+        self, times: np.ndarray, prices: np.ndarray, qtys: np.ndarray
+    ) -> dict:
+        """Adds trades in time order, returns the bars they closed.
+
+        Args:
+            times (np.ndarray): Trade times, epoch ms.
+            prices (np.ndarray): Trade prices.
+            qtys (np.ndarray): Trade quantities.
+
+        Returns:
+            dict: Closed bars, columns minute (epoch minutes), open, high, low, close,
+                volume.
+        """
+        minutes = times // MS_PER_MINUTE
+        keep = minutes >= self.minute
+        minutes, prices, qtys = minutes[keep], prices[keep], qtys[keep]
+        if not len(minutes):
+            return empty_bars()
+
+        starts = np.flatnonzero(np.r_[True, minutes[1:] != minutes[:-1]])
+        ends = np.r_[starts[1:], len(minutes)] - 1
+        bars = {
+            "minute": minutes[starts],
+            "open": prices[starts],
+            "high": np.maximum.reduceat(prices, starts),
+            "low": np.minimum.reduceat(prices, starts),
+            "close": prices[ends],
+            "volume": np.add.reduceat(qtys, starts),
+        }
+        if bars["minute"][0] == self.minute:
+            # the first run continues the open bar
+            bars["open"][0] = self.bar[0]
+            bars["high"][0] = max(bars["high"][0], self.bar[1])
+            bars["low"][0] = min(bars["low"][0], self.bar[2])
+            bars["volume"][0] += self.bar[4]
+        elif self.minute >= 0:
+            bars = {
+                "minute": np.r_[self.minute, bars["minute"]],
+                **{
+                    field: np.r_[self.bar[i], bars[field]]
+                    for i, field in enumerate(
+                        ("open", "high", "low", "close", "volume")
+                    )
+                },
+            }
+
+        self.minute = int(bars["minute"][-1])
+        self.bar = np.array(
+            [bars[field][-1] for field in ("open", "high", "low", "close", "volume")]
+        )
+        return {field: values[:-1] for field, values in bars.items()}
+
+
+class BinanceStream:
+    def __init__(self, config: dict):
+        """Streams Binance trades and minute bars onto the market data bus.
+
+        The Binance counterpart of `trading.market_data_bus.FeedHandler`: for every symbol,
+        trades go to the `<prefix>_<symbol>_ticks` ring as a last price (4) and a last size
+        (5) tick, and closed minute bars to the `<prefix>_<symbol>_bars` ring, so strategies
+        follow BTCUSDT with `BusReader` like any IBKR contract.
+
+        One task reads the combined websocket stream and queues the raw frames, another
+        decodes and publishes all queued frames at once, so batches grow with the message
+        rate and the latency stays bounded by the time to process one batch. A batch that
+        fails to process is logged and dropped, and beyond `MAX_QUEUED_FRAMES` queued frames
+        the oldest are dropped, so the stream never stops publishing.
+
+        Closed bars are the final klines when "kline_1m" is streamed, else the trades
+        aggregated by `MinuteBarAggregator`. After a reconnect, or whenever closed bars skip
+        minutes, the missing bars are loaded through the REST loader of "backfill" and
+        published first, so the bars ring stays in order and without gaps. If the backfill
+        fails, the closed bars are held back and the next closed bar retries it.
+
+        Args:
+            config (dict): See `main`.
+        """
+        self.config = config
+        bus = config.get("bus", {})
+        prefix = bus.get("prefix", DEFAULT_PREFIX)
+        capacity = bus.get("capacity", DEFAULT_CAPACITY)
+        self.symbols = [symbol.upper() for symbol in config["symbols"]]
+        self.streams = config.get("streams", DEFAULT_STREAMS)
+        self.url = stream_url(
+            config.get("url", DEFAULT_URL), self.symbols, self.streams
+        )
+        self.bars_from_klines = "kline_1m" in self.streams
+
+        self.ticks, self.bars = {}, {}
+        for symbol in self.symbols:
+            self.ticks[symbol] = SharedRing(
+                ring_name(prefix, symbol, "ticks"), TICK_DTYPE, capacity, True
+            )
+            self.bars[symbol] = SharedRing(
+                ring_name(prefix, symbol, "bars"), BAR_DTYPE, capacity, True
+            )
+        self.aggregators = {symbol: MinuteBarAggregator() for symbol in self.symbols}
+        # last closed bar published per symbol, epoch minutes
+        self.last_minute = {symbol: None for symbol in self.symbols}
+
+        self.ws = None
+        self.frames = []
+        self.wake = asyncio.Event()
+        self.stopped = False
+        self.messages = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.failed_batches = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.backoff = MIN_BACKOFF
+        self.backfilled = 0
+        self.latencies = collections.deque(maxlen=N_LATENCIES)
+
+    # Streaming
+    async def run(self):
+        """Streams until `stop`, reconnecting with exponential backoff.
+
+        The backoff doubles with every failed attempt, up to `MAX_BACKOFF`, and is reset
+        once a connection is established.
+        """
+        processor = asyncio.create_task(self.process_frames())
+        try:
+            while not self.stopped:
+                try:
+                    await self.stream()
+                except (
+                    OSError,
+                    asyncio.TimeoutError,
+                    websockets.exceptions.WebSocketException,
+                ) as e:
+                    if self.stopped:
+                        break
+                    logging.warning("Binance stream disconnected: {!r}".format(e))
+                    await asyncio.sleep(self.backoff)
+                    self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+        finally:
+            processor.cancel()
+
+    async def stream(self):
+        """Reads one connection, queueing the frames for `process_frames`."""
+        async with websockets.connect(self.url, max_size=2**22) as ws:
+            self.ws = ws
+            if self.stopped:
+                # stopped while connecting, `stop` could not close this connection
+                return
+            self.backoff = MIN_BACKOFF
+            if self.messages:
+                self.reconnects += 1
+            # bars closed while disconnected, before the first bar of this connection
+            await self.backfill(time.time_ns() // 10**6 // MS_PER_MINUTE)
+            async for frame in ws:
+                self.frames.append(frame)
+                if len(self.frames) > MAX_QUEUED_FRAMES:
+                    self.drop_frames()
+                self.wake.set()
+        if not self.stopped:
+            raise ConnectionError("Binance stream closed by the server")
+
+    async def process_frames(self):
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            while self.frames:
+                frames = self.frames[:MAX_BATCH]
+                del self.frames[:MAX_BATCH]
+                try:
+                    await self.process(frames)
+                except Exception:
+                    # for ex. an unexpected frame, keep processing the next batches
+                    self.failed_batches += 1
+                    logging.exception(
+                        "Dropped a batch of {} Binance frames".format(len(frames))
+                    )
+
+    def drop_frames(self):
+        """Drops the oldest queued frames, the decoder fell `MAX_QUEUED_FRAMES` behind."""
+        n = len(self.frames) - MAX_QUEUED_FRAMES + MAX_BATCH
+        del self.frames[:n]
+        self.dropped += n
+        logging.warning(
+            "Binance frames queued faster than processed, dropped {}".format(n)
+        )
+
+    def stop(self):
+        self.stopped = True
+        if self.ws is not None:
+            asyncio.ensure_future(self.ws.close())
+
+    async def process(self, frames: list):
+        """Decodes a batch of frames and publishes its trades and closed bars."""
+        events = decode_events(frames)
+        for symbol in self.symbols:
+            trades = events.get((symbol, "aggTrade"))
+            closed = None
+            if trades is not None:
+                self.publish_trades(symbol, trades)
+                if not self.bars_from_klines:
+                    closed = self.aggregators[symbol].add_trades(
+                        trades["time"], trades["price"], trades["qty"]
+                    )
+            klines = events.get((symbol, "kline"))
+            if klines is not None and self.bars_from_klines:
+                final = klines["final"]
+                closed = {
+                    "minute": klines["start"][final] // MS_PER_MINUTE,
+                    **{
+                        field: klines[field][final]
+                        for field in ("open", "high", "low", "close", "volume")
+                    },
+                }
+            if closed is not None and len(closed["minute"]):
+                # without the missing bars, hold the closed bars back (they are loaded
+                # with the missing ones by the backfill of the next closed bar)
+                if await self.backfill(int(closed["minute"][0]), symbol):
+                    self.publish_bars(symbol, closed)
+
+        now = time.time_ns() // 10**6
+        for columns in events.values():
+            self.latencies.append(now - int(columns["event_time"][-1]))
+        self.messages += len(frames)
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(frames))
+
+    # Publishing
+    def publish_trades(self, symbol: str, trades: dict):
+        n = len(trades["time"])
+        ts = np.repeat(trades["time"] * 10**6, 2)
+        tick_type = np.tile(np.array([LAST_PRICE, LAST_SIZE]), n)
+        value = np.empty(2 * n)
+        value[0::2], value[1::2] = trades["price"], trades["qty"]
+        self.ticks[symbol].publish_many(ts=ts, tick_type=tick_type, value=value)
+
+    def publish_bars(self, symbol: str, bars: dict):
+        """Publishes closed bars after the last published one, in minute order."""
+        last = self.last_minute[symbol]
+        new = bars["minute"] > (-1 if last is None else last)
+        if not new.any():
+            return
+        self.bars[symbol].publish_many(
+            ts=bars["minute"][new] * MS_PER_MINUTE * 10**6,
+            **{
+                field: bars[field][new]
+                for field in ("open", "high", "low", "close", "volume")
+            },
+        )
+        self.last_minute[symbol] = int(bars["minute"][new][-1])
+
+    # Backfill
+    async def backfill(self, minute: int, symbol: str | None = None) -> bool:
+        """Publishes the closed bars missing before `minute` (epoch minutes), from REST.
+
+        Only symbols with a published bar are backfilled, from the bar after it and over
+        at most `MAX_BACKFILL_MINUTES`.
+
+        Returns:
+            bool: False if loading the missing bars failed (logged), `last_minute` is then
+                left as is so the next backfill retries from the same bar.
+        """
+        ok = True
+        for symbol in [symbol] if symbol is not None else self.symbols:
+            last = self.last_minute[symbol]
+            if last is None or minute <= last + 1:
+                continue
+            start = max(last + 1, minute - MAX_BACKFILL_MINUTES)
+            try:
+                klines = await asyncio.to_thread(
+                    self.load_klines, symbol, start, minute - 1
+                )
+            except Exception as e:
+                logging.warning(
+                    "Backfill of {} from {} failed, retried with the next bar: {!r}".format(
+                        symbol, start, e
+                    )
+                )
+                ok = False
+                continue
+            bars = {
+                "minute": klines["kline_open_time"].to_numpy() // MS_PER_MINUTE,
+                "open": klines["open_price"].to_numpy(),
+                "high": klines["high_price"].to_numpy(),
+                "low": klines["low_price"].to_numpy(),
+                "close": klines["close_price"].to_numpy(),
+                "volume": klines["volume"].to_numpy(),
+            }
+            keep = bars["minute"] < minute
+            bars = {field: values[keep] for field, values in bars.items()}
+            logging.info(
+                "Backfilled {} bars of {} from {} minutes missing".format(
+                    len(bars["minute"]), symbol, minute - start
+                )
+            )
+            self.backfilled += len(bars["minute"])
+            self.publish_bars(symbol, bars)
+        return ok
+
+    def load_klines(self, symbol: str, start: int, end: int):
+        """Loads the 1m klines of `symbol` from `start` to `end` (epoch minutes)."""
+        loader_config = {
+            "loader_class": "BinanceHistoricalDataLoader",
+            "endpoint_type": None,
+            **self.config.get("backfill", {}),
+        }
+        loader_config["params"] = {
+            "symbol": symbol,
+            "interval": "1m",
+            "startTime": str(start * MS_PER_MINUTE),
+            "endTime": str(end * MS_PER_MINUTE),
+            "limit": 1000,
+        }
+        return load_data(loader_config)
+
+    def stats(self) -> dict:
+        """Messages, batches, drops, reconnects, backfilled bars and event to publish latencies."""
+        latencies = np.array(self.latencies, dtype=float)
+        return {
+            "messages": self.messages,
+            "batches": self.batches,
+            "max_batch": self.max_batch,
+            "failed_batches": self.failed_batches,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "backfilled": self.backfilled,
+            "latency_ms_p50": float(np.percentile(latencies, 50))
+            if len(latencies)
+            else None,
+            "latency_ms_p99": float(np.percentile(latencies, 99))
+            if len(latencies)
+            else None,
+        }
+
+    def close(self):
+        for ring in (*self.ticks.values(), *self.bars.values()):
+            ring.close()
+
+
+def main(config_path: str):
+    """
+    Example Config:
+    {
+        "bus": {
+            "prefix": "mdbus",
+            "capacity": 65536
+        },
+        "url": "wss://stream.binance.com:9443",
+        "symbols": ["BTCUSDT"],
+        "streams": ["aggTrade", "kline_1m"],  # bars from final klines, else from trades
+        "backfill": {  # optional, loader config of the REST backfill, without "params"
+            "loader_class": "BinanceHistoricalDataLoader",
+            "endpoint_type": null
+        }
+    }
+    """
+    config = open(config_path)
+    config = json.load(config)
+
+    async def run():
+        stream = BinanceStream(config)
+        try:
+            await stream.run()
+        finally:
+            stream.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(f"Input args: {args.__dict__}")
+
+    main(args.config_path)
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import os
+import tempfile
+
+import numpy as np
+
+# Bump when the content of a checkpoint changes, older checkpoints are then ignored
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path: str, state: dict):
+    """Writes `state` to `path` as an uncompressed npz, atomically.
+
+    The checkpoint is written to a temporary file next to `path` (unique per call, so
+    concurrent writers never share it), flushed to disk and renamed over `path`, so a crash
+    mid-write leaves the previous checkpoint intact.
+
+    Args:
+        path (str): Checkpoint file.
+        state (dict): Name to numpy array or scalar (numbers, strings), no Python objects.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f"{name}.", suffix=".tmp", dir=directory or "."
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, version=CHECKPOINT_VERSION, **state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_checkpoint(path: str) -> dict | None:
+    """Reads a checkpoint written by `save_checkpoint`.
+
+    Returns:
+        dict | None: Name to array (0-d arrays for scalars), None if there is no checkpoint or
+            it was written by another version.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as npz:
+        state = {k: npz[k] for k in npz.files}
+    if state.pop("version") != CHECKPOINT_VERSION:
+        return None
+    return state
@@ -2,3 +2,8 @@ ENTER_LONG = "enter_long"
 EXIT_LONG = "exit_long"
 ENTER_SHORT = "enter_short"
 EXIT_SHORT = "exit_short"
+
+# Target positions, see `OrderGateway`
+LONG = 1
+FLAT = 0
+SHORT = -1
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import signal
+import socket
+
+from ibapi import comm, decoder
+from ibapi.client import EClient
+from ibapi.server_versions import MAX_CLIENT_VER, MIN_CLIENT_VER
+
+from trading.volatility_range_momentum import IntradayMomentum
+
+# Decisions are taken at the 30th minute of every hour, like `IntradayMomentum.run_strategy`
+DECISION_MINUTE = 30
+
+
+class AsyncEngine:
+    def __init__(self, app: IntradayMomentum, host: str, port: int, client_id: int = 1):
+        """Runs an `IntradayMomentum` app on a single asyncio event loop.
+
+        IBKR socket reads, message decoding (and with it the tick to bar aggregation in
+        `tickPrice` / `tickSize`), the decision timer and order handling all run on the loop
+        thread. There is no EReader thread, no message queue and no polling sleeps: the loop
+        wakes up when the socket is readable or when the next decision is due.
+
+        Start-up waits for `nextValidId` instead of fixed sleeps, SIGINT / SIGTERM disconnect
+        cleanly.
+
+        Args:
+            app (IntradayMomentum): Strategy app, not connected yet.
+            host (str): IB Gateway / TWS host.
+            port (int): IB Gateway / TWS port.
+            client_id (int, optional): IBKR client id. Defaults to 1.
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.buffer = b""
+        self.handshake_done = False
+        self.loop = None
+        self.ready = None
+        self.stopped = None
+        self.bus_task = None
+
+    def run_forever(self):
+        asyncio.run(self.run())
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+        self.stopped = asyncio.Event()
+        self.app.ready_callbacks.append(self.ready.set)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, self.stop)
+
+        await self.connect()
+        try:
+            await self.wait_or_stop(self.ready.wait())
+            if self.stopped.is_set():
+                return
+
+            self.request_market_data()
+            timer = asyncio.create_task(self.decision_timer())
+            await self.stopped.wait()
+            timer.cancel()
+            if self.bus_task is not None:
+                self.bus_task.cancel()
+        finally:
+            self.disconnect()
+
+    async def wait_or_stop(self, aw):
+        """Waits for `aw` unless the engine is stopped first."""
+        task = asyncio.ensure_future(aw)
+        stop = asyncio.ensure_future(self.stopped.wait())
+        await asyncio.wait({task, stop}, return_when=asyncio.FIRST_COMPLETED)
+        for pending in (task, stop):
+            pending.cancel()
+
+    def stop(self):
+        self.stopped.set()
+
+    # Connection
+    async def connect(self):
+        """Opens the socket and sends the API handshake, the reply is handled in `on_readable`."""
+        app = self.app
+        sock = socket.socket()
+        sock.setblocking(False)
+        await self.loop.sock_connect(sock, (self.host, self.port))
+
+        app.host, app.port, app.clientId = self.host, self.port, self.client_id
+        app.conn = _Connection(self.host, self.port, sock)
+        app.setConnState(EClient.CONNECTING)
+
+        version = "v%d..%d" % (MIN_CLIENT_VER, MAX_CLIENT_VER)
+        if app.connectionOptions:
+            version = version + " " + app.connectionOptions
+        app.conn.sendMsg(str.encode("API\0", "ascii") + comm.make_msg(version))
+        app.decoder = decoder.Decoder(app.wrapper, app.serverVersion())
+
+        self.loop.add_reader(sock.fileno(), self.on_readable)
+
+    def disconnect(self):
+        conn = self.app.conn
+        if conn is None:
+            return
+        if conn.socket is not None:
+            self.loop.remove_reader(conn.socket.fileno())
+        self.app.disconnect()
+
+    def on_readable(self):
+        try:
+            data = self.app.conn.socket.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            # socket closed by the gateway
+            self.stop()
+            return
+
+        self.buffer += data
+        while self.buffer:
+            size, msg, self.buffer = comm.read_msg(self.buffer)
+            if not msg:
+                break
+            fields = comm.read_fields(msg)
+            if self.handshake_done:
+                self.app.decoder.interpret(fields)
+            elif len(fields) == 2:
+                self.on_handshake(fields)
+            else:
+                # sometimes news arrive before the server version
+                self.app.decoder.interpret(fields)
+
+    def on_handshake(self, fields):
+        app = self.app
+        server_version, conn_time = fields
+        app.connTime = conn_time
+        app.serverVersion_ = int(server_version)
+        app.decoder.serverVersion = app.serverVersion()
+        app.setConnState(EClient.CONNECTED)
+        self.handshake_done = True
+        app.startApi()
+        app.connectAck()
+
+    # Strategy
+    def request_market_data(self):
+        app = self.app
+        if "market_data_bus" in app.config:
+            # ticks come from the feed handler, no market data line of our own
+            self.bus_task = asyncio.create_task(
+                self.follow_bus(app.config["market_data_bus"])
+            )
+            return
+
+        ibkr_params = dict(app.config["ibkr_params"])
+        ibkr_params["reqId"] = app.nextId()
+        ibkr_params["contract"] = app.contract
+
+        # Gotta start paper trading soon
+        app.reqMarketDataType(3)
+        app.reqMktData(**ibkr_params)
+
+    async def follow_bus(self, prefix: str, poll_interval: float = 0.005):
+        from trading.market_data_bus import BusReader
+
+        reader = BusReader(self.app.contract.symbol, prefix)
+        try:
+            while True:
+                if not reader.replay_ticks(self.app):
+                    await asyncio.sleep(poll_interval)
+        finally:
+            reader.close()
+
+    async def decision_timer(self):
+        while True:
+            await asyncio.sleep(seconds_to_next_decision(datetime.datetime.now()))
+            if self.app.upper_limits is None or self.app.bars.empty:
+                # no tick yet today
+                continue
+            self.app.send_target(self.app.decide())
+
+
+def seconds_to_next_decision(now: datetime.datetime) -> float:
+    """Seconds from `now` to the start of the next decision minute."""
+    decision = now.replace(minute=DECISION_MINUTE, second=0, microsecond=0)
+    if decision <= now:
+        decision += datetime.timedelta(hours=1)
+    return (decision - now).total_seconds()
+
+
+class _Connection:
+    def __init__(self, host: str, port: int, sock: socket.socket):
+        """Minimal stand-in for `ibapi.connection.Connection` over a non-blocking socket.
+
+        Requests are small and go straight to the socket, reads are driven by the event loop.
+        """
+        self.host = host
+        self.port = port
+        self.socket = sock
+
+    def isConnected(self):
+        return self.socket is not None
+
+    def sendMsg(self, msg: bytes) -> int:
+        if self.socket is None:
+            return 0
+        self.socket.sendall(msg)
+        return len(msg)
+
+    def disconnect(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
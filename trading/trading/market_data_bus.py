@@ -0,0 +1,372 @@
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from ibapi.contract import Contract
+
+import external.ibkr as ibkr
+from trading.bars import CLOSE, HIGH, LOW, OPEN, VOLUME, MinuteBars
+
+DEFAULT_PREFIX = "mdbus"
+DEFAULT_CAPACITY = 2**16
+# head (records written so far), capacity, record size, padded to a cache line
+HEADER_SIZE = 64
+HEAD, CAPACITY, ITEMSIZE = range(3)
+
+# tick_type is the IBKR tick type, value the price or the size
+TICK_DTYPE = np.dtype(
+    [("seq", "<i8"), ("ts", "<i8"), ("tick_type", "<i8"), ("value", "<f8")]
+)
+BAR_DTYPE = np.dtype(
+    [
+        ("seq", "<i8"),
+        ("ts", "<i8"),
+        ("open", "<f8"),
+        ("high", "<f8"),
+        ("low", "<f8"),
+        ("close", "<f8"),
+        ("volume", "<f8"),
+    ]
+)
+
+parser = argparse.ArgumentParser(description="Path of config file to pass to script")
+parser.add_argument("-c", "--config-path", type=str, help="Path to config file")
+parser.add_argument(
+    "-d",
+    "--docker-run",
+    action=argparse.BooleanOptionalAction,
+    help="Flag to set if this script is run in docker",
+)
+
+
+def ring_name(prefix: str, symbol: str, kind: str) -> str:
+    return f"{prefix}_{symbol}_{kind}"
+
+
+class SharedRing:
+    def __init__(
+        self,
+        name: str,
+        dtype: np.dtype,
+        capacity: int = DEFAULT_CAPACITY,
+        create: bool = False,
+    ):
+        """Single producer, multi consumer ring buffer of fixed size records in shared memory.
+
+        Record `n` (counting from 1) lives in slot `(n - 1) % capacity` and carries `n` in its
+        `seq` field. The producer zeroes `seq` before writing a slot and sets it once the
+        record is complete, then publishes `n` as the head. A reader that falls more than
+        `capacity` records behind has lost the overwritten records: it sees it from the head,
+        and from the `seq` of the slots, checked before and after copying them (seqlock), so
+        a record overwritten while it was being copied is dropped instead of read torn.
+
+        Args:
+            name (str): Shared memory block name.
+            dtype (np.dtype): Record dtype, with an int64 `seq` field.
+            capacity (int, optional): Number of records kept. Only used when creating.
+            create (bool, optional): Create the block (producer) instead of attaching to it.
+        """
+        self.name = name
+        if create:
+            size = HEADER_SIZE + capacity * dtype.itemsize
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.header = np.ndarray((3,), dtype="<i8", buffer=self.shm.buf)
+            self.header[:] = (0, capacity, dtype.itemsize)
+        else:
+            # the producer owns the block, do not let this process unlink it at exit
+            if sys.version_info >= (3, 13):
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            else:
+                self.shm = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            self.header = np.ndarray((3,), dtype="<i8", buffer=self.shm.buf)
+            if self.header[ITEMSIZE] != dtype.itemsize:
+                raise ValueError(f"{name} does not hold {dtype} records")
+        self.owner = create
+        self.capacity = int(self.header[CAPACITY])
+        self.records = np.ndarray(
+            (self.capacity,), dtype=dtype, buffer=self.shm.buf, offset=HEADER_SIZE
+        )
+
+    @property
+    def head(self) -> int:
+        """Seq of the last record written."""
+        return int(self.header[HEAD])
+
+    def publish(self, *fields):
+        """Appends one record, `fields` in dtype order without `seq`. Producer only."""
+        seq = self.head + 1
+        slot = (seq - 1) % self.capacity
+        self.records["seq"][slot] = 0
+        self.records[slot] = (0, *fields)
+        self.records["seq"][slot] = seq
+        self.header[HEAD] = seq
+
+    def publish_many(self, **columns):
+        """Appends a batch of records at once, one array per field without `seq`.
+
+        Same protocol as `publish`, slot by slot, with the head published once for the
+        batch. A batch larger than the ring only keeps its last `capacity` records.
+        """
+        n = len(next(iter(columns.values())))
+        if n == 0:
+            return
+        head = self.head
+        seqs = np.arange(head + 1, head + n + 1)[-self.capacity :]
+        slots = (seqs - 1) % self.capacity
+        self.records["seq"][slots] = 0
+        for name, values in columns.items():
+            self.records[name][slots] = np.asarray(values)[-self.capacity :]
+        self.records["seq"][slots] = seqs
+        self.header[HEAD] = head + n
+
+    def read(self, cursor: int) -> tuple[np.ndarray, int, int]:
+        """Copies the records after `cursor`.
+
+        Args:
+            cursor (int): Seq of the last record already read, 0 to read from the start.
+
+        Returns:
+            np.ndarray, int, int: Records in seq order, new cursor and number of records lost
+                to overruns since `cursor`.
+        """
+        head = self.head
+        start = max(cursor, head - self.capacity)
+        lost = start - cursor
+        if head <= start:
+            return self.records[:0].copy(), cursor, lost
+
+        seqs = np.arange(start + 1, head + 1)
+        slots = (seqs - 1) % self.capacity
+        records = self.records[slots]
+        # seqlock: the producer may have lapped us while copying, a record is only intact if
+        # its seq was the expected one both before and after the copy, and the head after the
+        # copy is less than `capacity` records ahead of it
+        seq_after = self.records["seq"][slots]
+        head_after = self.head
+        valid = (
+            (records["seq"] == seqs)
+            & (seq_after == seqs)
+            & (seqs > head_after - self.capacity)
+        )
+        if not valid.all():
+            first_valid = len(valid) - np.argmin(valid[::-1])
+            lost += first_valid
+            records = records[first_valid:]
+        return records, head, lost
+
+    def close(self):
+        del self.header, self.records
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class BusReader:
+    def __init__(self, symbol: str, prefix: str = DEFAULT_PREFIX, from_start=False):
+        """Reads the ticks and minute bars of `symbol` published by a `FeedHandler`.
+
+        Readers are independent, each keeps its own cursors and does not slow down the feed
+        handler nor the other readers.
+
+        Args:
+            symbol (str): Contract symbol.
+            prefix (str, optional): Bus prefix of the feed handler. Defaults to "mdbus".
+            from_start (bool, optional): Start from the oldest records still in the rings,
+                instead of only new records. Defaults to False.
+        """
+        self.symbol = symbol
+        self.ticks = SharedRing(ring_name(prefix, symbol, "ticks"), TICK_DTYPE)
+        self.bars = SharedRing(ring_name(prefix, symbol, "bars"), BAR_DTYPE)
+        self.tick_cursor = 0 if from_start else self.ticks.head
+        self.bar_cursor = 0 if from_start else self.bars.head
+        self.lost = 0
+
+    def read_ticks(self) -> np.ndarray:
+        """Returns the ticks published since the last call, as TICK_DTYPE records."""
+        ticks, self.tick_cursor, lost = self.ticks.read(self.tick_cursor)
+        self.lost += lost
+        return ticks
+
+    def read_bars(self) -> np.ndarray:
+        """Returns the minute bars closed since the last call, as BAR_DTYPE records."""
+        bars, self.bar_cursor, lost = self.bars.read(self.bar_cursor)
+        self.lost += lost
+        return bars
+
+    def replay_ticks(self, app: ibkr.IBBaseApp, req_id: int = -1) -> int:
+        """Forwards the new ticks to `app.tickPrice` / `app.tickSize`, like a market data line.
+
+        Returns:
+            int: Number of ticks forwarded.
+        """
+        ticks = self.read_ticks()
+        for tick_type, value in zip(ticks["tick_type"], ticks["value"]):
+            if tick_type in FeedHandler.SIZE_TICK_TYPES:
+                app.tickSize(req_id, int(tick_type), value)
+            else:
+                app.tickPrice(req_id, int(tick_type), value, None)
+        return len(ticks)
+
+    def follow(self, app: ibkr.IBBaseApp, poll_interval: float = 0.005):
+        """Replays the ticks into `app` forever, polling every `poll_interval` seconds."""
+        while True:
+            if not self.replay_ticks(app):
+                time.sleep(poll_interval)
+
+    def close(self):
+        self.ticks.close()
+        self.bars.close()
+
+
+class FeedHandler(ibkr.IBBaseApp):
+    # tick types published, delayed last price / size (68 / 71) and last price / size
+    PRICE_TICK_TYPES = {4, 68}
+    SIZE_TICK_TYPES = {5, 71}
+
+    def __init__(self, config: dict):
+        """Owns the IBKR market data line and publishes it on the shared memory bus.
+
+        For every contract of the config, ticks go to a `<prefix>_<symbol>_ticks` ring as they
+        arrive and minute bars to a `<prefix>_<symbol>_bars` ring as they close, so any number
+        of strategy or monitoring processes can share one subscription (see `BusReader`).
+
+        Args:
+            config (dict): See `main`.
+        """
+        super().__init__()
+        self.config = config
+        bus = config.get("bus", {})
+        self.prefix = bus.get("prefix", DEFAULT_PREFIX)
+        capacity = bus.get("capacity", DEFAULT_CAPACITY)
+        self.timezone = ZoneInfo(config["iana_timezone"])
+
+        self.contracts = []
+        self.ticks, self.bars, self.minute_bars = {}, {}, {}
+        for params in config["contracts"]:
+            contract = Contract()
+            for k, v in params.items():
+                setattr(contract, k, v)
+            symbol = contract.symbol
+            self.contracts.append(contract)
+            self.ticks[symbol] = SharedRing(
+                ring_name(self.prefix, symbol, "ticks"), TICK_DTYPE, capacity, True
+            )
+            self.bars[symbol] = SharedRing(
+                ring_name(self.prefix, symbol, "bars"), BAR_DTYPE, capacity, True
+            )
+            self.minute_bars[symbol] = MinuteBars(self.timezone)
+        self.symbols = {}  # reqId -> symbol
+        self.ready = threading.Event()
+
+    def nextValidId(self, orderId: int):
+        super().nextValidId(orderId)
+        self.ready.set()
+
+    def subscribe(self):
+        self.reqMarketDataType(self.config.get("market_data_type", 3))
+        for contract in self.contracts:
+            ibkr_params = dict(self.config["ibkr_params"])
+            ibkr_params["reqId"] = self.nextId()
+            ibkr_params["contract"] = contract
+            self.symbols[ibkr_params["reqId"]] = contract.symbol
+            self.reqMktData(**ibkr_params)
+
+    def tickPrice(self, reqId, tickType, price, attrib):
+        if tickType in self.PRICE_TICK_TYPES and reqId in self.symbols:
+            self.on_tick(self.symbols[reqId], tickType, price=price)
+
+    def tickSize(self, reqId, tickType, size):
+        if tickType in self.SIZE_TICK_TYPES and reqId in self.symbols:
+            self.on_tick(self.symbols[reqId], tickType, size=float(size))
+
+    def on_tick(self, symbol: str, tick_type: int, price=None, size=None):
+        now = datetime.datetime.now(self.timezone)
+        self.ticks[symbol].publish(
+            time.time_ns(), tick_type, price if size is None else size
+        )
+
+        bars = self.minute_bars[symbol]
+        session, prev_minute = bars.session, bars.last_minute
+        if bars.update(price=price, size=size, now=now) and prev_minute >= 0:
+            self.publish_bar(symbol, session, prev_minute)
+
+    def publish_bar(self, symbol: str, session: datetime.date, minute: int):
+        """Publishes the closed bar of `minute`, read back from this handler's own bars."""
+        bars = self.minute_bars[symbol]
+        if bars.session != session:
+            # the bar closed with the session, its values are gone
+            return
+        values = bars.values[minute]
+        start = datetime.datetime.combine(
+            session, datetime.time(minute // 60, minute % 60), self.timezone
+        )
+        self.bars[symbol].publish(
+            int(start.timestamp()) * 10**9,
+            values[OPEN],
+            values[HIGH],
+            values[LOW],
+            values[CLOSE],
+            values[VOLUME],
+        )
+
+    def close(self):
+        for ring in (*self.ticks.values(), *self.bars.values()):
+            ring.close()
+
+
+def main(config_path: str, is_docker_run: bool):
+    """
+    Example Config:
+    {
+        "bus": {
+            "prefix": "mdbus",
+            "capacity": 65536
+        },
+        "iana_timezone": "US/Eastern",
+        "ibkr_params": {
+            "genericTickList": "",
+            "snapshot": false,
+            "regulatorySnapshot": false,
+            "mktDataOptions": []
+        },
+        "contracts": [
+            {
+                "symbol": "SPY",
+                "secType": "STK",
+                "exchange": "SMART",
+                "currency": "USD"
+            }
+        ]
+    }
+    """
+    config = open(config_path)
+    config = json.load(config)
+
+    host = "host.docker.internal" if is_docker_run else "127.0.0.1"
+
+    app = FeedHandler(config)
+    app.connect(host, 4002, clientId=config.get("client_id", 2))
+    thread = threading.Thread(target=app.run)
+    thread.start()
+    app.ready.wait()
+    app.subscribe()
+    try:
+        thread.join()
+    finally:
+        app.close()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(f"Input args: {args.__dict__}")
+
+    main(args.config_path, args.docker_run)
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import copy
+import threading
+from decimal import Decimal
+from typing import Callable
+
+from ibapi.contract import Contract
+from ibapi.order import Order
+
+from trading.consts import FLAT, LONG, SHORT
+
+# Order states after which an order no longer works in the market
+DONE_STATUSES = {"Filled", "Cancelled", "ApiCancelled", "Inactive"}
+
+
+def target_direction(px: float, vwap: float, up_lim: float, low_lim: float) -> int:
+    """Coalesces the strategy instructions of a decision into a single target direction.
+
+    The strategy would enter long above the upper limit, enter short below the lower limit,
+    exit long below the vwap or the upper limit and exit short above the vwap or the lower
+    limit. When entering and exiting the same side at once, the exit wins.
+
+    Returns:
+        int: LONG, SHORT or FLAT
+    """
+    if px > up_lim and not px < vwap:
+        return LONG
+    if px < low_lim and not px > vwap:
+        return SHORT
+    return FLAT
+
+
+class OrderGateway:
+    def __init__(
+        self,
+        contract: Contract,
+        place_order: Callable[[int, Contract, Order], None],
+        next_id: Callable[[], int],
+        order_type: str = "LMT",
+    ):
+        """Turns target positions into at most one order per decision.
+
+        Every decision sets a target direction, the gateway diffs the target quantity against
+        the filled position plus the quantity still working in the market and sends one order
+        for the difference, if any. Orders are copied from pre-built templates and sized with
+        the precomputed `order_size`.
+
+        Fills are tracked per order from the cumulative `filled` of `orderStatus`, so partial
+        fills and repeated status updates are only counted once.
+
+        Args:
+            contract (Contract): Contract to trade.
+            place_order (Callable): Sends an order, for ex. `EClient.placeOrder`.
+            next_id (Callable): Returns the next valid order id.
+            order_type (str, optional): Defaults to "LMT".
+        """
+        self.contract = contract
+        self.place_order = place_order
+        self.next_id = next_id
+        self.templates = {}
+        for action in ("BUY", "SELL"):
+            order = Order()
+            order.action = action
+            order.orderType = order_type
+            self.templates[action] = order
+
+        self.order_size = None
+        self.position = Decimal(0)
+        # orderId -> [signed quantity, cumulative filled, done]
+        self.orders = {}
+        self.lock = threading.Lock()
+
+    @property
+    def working(self) -> Decimal:
+        """Signed quantity of the orders still working in the market."""
+        return sum(
+            (qty - (filled if qty > 0 else -filled))
+            for qty, filled, done in self.orders.values()
+            if not done
+        ) or Decimal(0)
+
+    def on_decision(
+        self, direction: int, lmt_price: float = 0, aux_price: float = 0
+    ) -> int | None:
+        """Sends at most one order to move the position to `direction` x `order_size`.
+
+        Returns:
+            int | None: Id of the order sent, None if already at target.
+        """
+        assert self.order_size is not None, "order_size has to be set before trading"
+        with self.lock:
+            delta = direction * self.order_size - (self.position + self.working)
+            if delta == 0:
+                return None
+
+            order = copy.copy(self.templates["BUY" if delta > 0 else "SELL"])
+            order.totalQuantity = abs(delta)
+            order.lmtPrice = lmt_price
+            order.auxPrice = aux_price
+            order_id = self.next_id()
+            self.orders[order_id] = [delta, Decimal(0), False]
+
+        self.place_order(order_id, self.contract, order)
+        return order_id
+
+    def on_order_status(self, orderId: int, status: str, filled: Decimal):
+        """Updates the position from an `orderStatus` callback, `filled` is cumulative for the order."""
+        with self.lock:
+            if orderId not in self.orders:
+                return
+            order = self.orders[orderId]
+            new_fill = Decimal(filled) - order[1]
+            if new_fill > 0:
+                self.position += new_fill if order[0] > 0 else -new_fill
+                order[1] = Decimal(filled)
+            order[2] = status in DONE_STATUSES
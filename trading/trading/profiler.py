@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import datetime
+import gc
+import math
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_DURATION = 30
+# allocation sites listed in the summary
+TOP_ALLOCATIONS = 25
+
+parser = argparse.ArgumentParser(
+    description="Profile a running process through its profiler control socket"
+)
+parser.add_argument("socket_path", type=str, help="Control socket of the process")
+parser.add_argument(
+    "-s",
+    "--seconds",
+    type=float,
+    default=DEFAULT_DURATION,
+    help="Seconds to profile for",
+)
+
+
+def stack(frame) -> tuple:
+    """Code objects of the calls of `frame`, innermost first, cheap to hash and count."""
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    return tuple(codes)
+
+
+def fold(thread_name: str, codes: tuple) -> str:
+    """Collapsed stack of a `stack`, "thread;outer;...;inner", as read by flamegraph.pl."""
+    names = [
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        for code in reversed(codes)
+    ]
+    return ";".join([thread_name] + names)
+
+
+class SamplingProfiler:
+    def __init__(
+        self,
+        output_dir: str,
+        interval: float = DEFAULT_INTERVAL,
+        trace_allocations: bool = False,
+    ):
+        """Samples the stacks of all threads of the process for a while, on demand.
+
+        While a profile runs, a sampler thread reads the current frame of every thread
+        (`sys._current_frames`) every `interval` seconds, and garbage collections are timed
+        through `gc.callbacks`. Samples are counted by code objects and only formatted when
+        the profile is written. Nothing is installed while no profile runs, so a process that
+        is not being profiled pays nothing.
+
+        Every profile writes two files to `output_dir`:
+
+        - `profile-<time>.folded`: one "thread;outer;...;inner count" line per distinct
+          stack, the input of flamegraph.pl, speedscope or inferno,
+        - `profile-<time>.txt`: samples per thread, garbage collections and pauses per
+          generation, change in allocated memory blocks and, with `trace_allocations`, the
+          top allocation sites.
+
+        Args:
+            output_dir (str): Directory the profiles are written to.
+            interval (float, optional): Seconds between samples. Defaults to 5 ms.
+            trace_allocations (bool, optional): Trace allocations with tracemalloc, which
+                slows allocation heavy code down many times while the profile runs. Defaults
+                to False.
+        """
+        self.output_dir = output_dir
+        self.interval = interval
+        self.trace_allocations = trace_allocations
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_profile = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration: float = DEFAULT_DURATION) -> bool:
+        """Profiles the process for `duration` seconds, in the background.
+
+        Safe to call from a signal handler: the lock is never waited on, a call that finds it
+        held (for ex. a second SIGUSR1 handled on the same thread while the first one starts
+        the profile) returns False instead of deadlocking.
+
+        Returns:
+            bool: False if a profile is already running or being started.
+        """
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self.running:
+                return False
+            self.thread = threading.Thread(
+                target=self.run, args=(duration,), name="profiler", daemon=True
+            )
+            self.thread.start()
+            return True
+        finally:
+            self.lock.release()
+
+    def run(self, duration: float) -> str:
+        """Profiles the process for `duration` seconds and writes the profile.
+
+        Returns:
+            str: Path of the profile, without extension.
+        """
+        started = datetime.datetime.now()
+        stacks = collections.Counter()
+        gc_stats = GCStats()
+        gc.callbacks.append(gc_stats.callback)
+        blocks = sys.getallocatedblocks()
+        trace_allocations = self.trace_allocations and not tracemalloc.is_tracing()
+        if trace_allocations:
+            tracemalloc.start()
+
+        own = threading.get_ident()
+        names = {}
+        n_samples = 0
+        deadline = time.monotonic() + duration
+        try:
+            while time.monotonic() < deadline:
+                frames = sys._current_frames()
+                if frames.keys() - names.keys():
+                    # new threads since the last sample
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in frames.items():
+                    if ident != own:
+                        stacks[names.get(ident, str(ident)), stack(frame)] += 1
+                # do not keep the frames of the sampled threads alive while sleeping
+                frames = frame = None
+                n_samples += 1
+                time.sleep(self.interval)
+        finally:
+            gc.callbacks.remove(gc_stats.callback)
+            blocks = sys.getallocatedblocks() - blocks
+            snapshot, peak = None, None
+            if trace_allocations:
+                snapshot = tracemalloc.take_snapshot().filter_traces(
+                    [
+                        tracemalloc.Filter(False, __file__),
+                        tracemalloc.Filter(False, tracemalloc.__file__),
+                    ]
+                )
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(
+            self.output_dir, f"profile-{started.strftime('%Y%m%d-%H%M%S')}"
+        )
+        with open(f"{path}.folded", "w") as f:
+            for (name, codes), count in stacks.most_common():
+                f.write(f"{fold(name, codes)} {count}\n")
+        with open(f"{path}.txt", "w") as f:
+            f.write(
+                self.summary(
+                    started,
+                    duration,
+                    n_samples,
+                    stacks,
+                    gc_stats,
+                    blocks,
+                    snapshot,
+                    peak,
+                )
+            )
+        self.last_profile = path
+        return path
+
+    def summary(
+        self, started, duration, n_samples, stacks, gc_stats, blocks, snapshot, peak
+    ) -> str:
+        """Text summary of a profile."""
+        lines = [
+            f"Profile started {started.isoformat()} for {duration}s, "
+            f"{n_samples} samples every {self.interval * 1000:g} ms",
+            "",
+            "Samples per thread:",
+        ]
+        threads = collections.Counter()
+        for (name, _), count in stacks.items():
+            threads[name] += count
+        lines += [f"  {name}: {count}" for name, count in threads.most_common()]
+
+        lines += ["", "Garbage collections:"]
+        for generation in sorted(gc_stats.collections):
+            lines.append(
+                f"  gen {generation}: {gc_stats.collections[generation]} collections, "
+                f"{gc_stats.collected[generation]} objects collected, "
+                f"{gc_stats.pauses[generation] * 1000:.2f} ms total pause, "
+                f"{gc_stats.max_pause[generation] * 1000:.2f} ms max pause"
+            )
+        if not gc_stats.collections:
+            lines.append("  none")
+        lines += ["", f"Allocated memory blocks: {blocks:+d} over the profile"]
+
+        if snapshot is not None:
+            lines += ["", f"Allocations (peak traced {peak / 2**20:.2f} MiB):"]
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                lines.append(f"  {stat}")
+        return "\n".join(lines) + "\n"
+
+
+class GCStats:
+    def __init__(self):
+        """Garbage collections, objects collected and pauses per generation."""
+        self.collections = collections.Counter()
+        self.collected = collections.Counter()
+        self.pauses = collections.Counter()
+        self.max_pause = collections.Counter()
+        self.start = None
+
+    def callback(self, phase: str, info: dict):
+        if phase == "start":
+            self.start = time.perf_counter()
+            return
+        generation = info["generation"]
+        self.collections[generation] += 1
+        self.collected[generation] += info["collected"]
+        if self.start is not None:
+            pause = time.perf_counter() - self.start
+            self.pauses[generation] += pause
+            self.max_pause[generation] = max(self.max_pause[generation], pause)
+            self.start = None
+
+
+class ControlSocket:
+    def __init__(
+        self,
+        profiler: SamplingProfiler,
+        path: str,
+        duration: float = DEFAULT_DURATION,
+    ):
+        """Unix socket to start profiles of a running process, see `request_profile`.
+
+        Commands, one per connection:
+
+        - "profile [seconds]": starts a profile, replies "started <seconds>s" or "busy",
+        - "status": replies "running" or "idle <last profile>".
+
+        Malformed commands get an "error: ..." reply. The listener thread is blocked in
+        `accept` between commands.
+        """
+        self.profiler = profiler
+        self.path = path
+        self.duration = duration
+        if os.path.exists(path):
+            os.remove(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        os.chmod(path, 0o600)
+        self.sock.listen()
+        self.thread = threading.Thread(
+            target=self.serve, name="profiler_control", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                # closed
+                return
+            with conn:
+                try:
+                    command = conn.recv(1024).decode(errors="replace")
+                    conn.sendall(self.handle(command).encode())
+                except OSError:
+                    # client gone, keep serving
+                    continue
+
+    def handle(self, command: str) -> str:
+        words = command.split()
+        if words[:1] == ["profile"]:
+            duration = self.duration
+            if len(words) > 1:
+                try:
+                    duration = float(words[1])
+                except ValueError:
+                    return f"error: invalid duration {words[1]!r}\n"
+                if not (math.isfinite(duration) and duration > 0):
+                    return f"error: duration must be a positive number of seconds, got {words[1]}\n"
+            started = self.profiler.start(duration)
+            if not started:
+                return "busy\n"
+            return f"started {duration}s\n"
+        if words[:1] == ["status"]:
+            if self.profiler.running:
+                return "running\n"
+            return f"idle {self.profiler.last_profile}\n"
+        return f"unknown command: {command.strip()}\n"
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def install(config: dict) -> SamplingProfiler:
+    """Sets up on demand profiling of this process, as per the "profiler" config.
+
+    Example config:
+    {
+        "output_dir": "/tmp/profiles",
+        "duration": 30,  # seconds profiled per request
+        "interval": 0.005,  # seconds between samples
+        "trace_allocations": false,  # top allocation sites, slows allocations down
+        "signal": "SIGUSR1",  # optional, `kill -USR1 <pid>` starts a profile
+        "socket_path": "/tmp/intraday_momentum.sock"  # optional, see `request_profile`
+    }
+
+    Must be called from the main thread, signal handlers can only be set there.
+    """
+    profiler = SamplingProfiler(
+        config["output_dir"],
+        config.get("interval", DEFAULT_INTERVAL),
+        config.get("trace_allocations", False),
+    )
+    duration = config.get("duration", DEFAULT_DURATION)
+    signal_name = config.get("signal", "SIGUSR1")
+    if signal_name is not None:
+        signal.signal(
+            getattr(signal, signal_name), lambda signum, frame: profiler.start(duration)
+        )
+    if config.get("socket_path") is not None:
+        ControlSocket(profiler, config["socket_path"], duration).start()
+    return profiler
+
+
+def request_profile(socket_path: str, seconds: float = DEFAULT_DURATION) -> str:
+    """Asks the process listening on `socket_path` to profile itself for `seconds`."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(f"profile {seconds}".encode())
+        return sock.recv(1024).decode().strip()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(request_profile(args.socket_path, args.seconds))
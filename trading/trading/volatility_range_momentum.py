@@ -7,7 +7,9 @@ import threading
 import time
 from decimal import Decimal
 from queue import Queue
+from zoneinfo import ZoneInfo
 
+import numpy as np
 import pandas as pd
 from ibapi.contract import Contract
 from ibapi.order import Order
@@ -15,7 +17,9 @@ from ibapi.order import Order
 import external.ibkr as ibkr
 from cio.data_loader import load_data
 from core.strategy import load_noise_area
-from trading.consts import ENTER_LONG, ENTER_SHORT, EXIT_LONG, EXIT_SHORT
+from trading.bars import MINUTES_PER_DAY, MinuteBars
+from trading.checkpoint import load_checkpoint, save_checkpoint
+from trading.order_gateway import OrderGateway, target_direction
 
 parser = argparse.ArgumentParser(description="Path of config file to pass to script")
 parser.add_argument("-c", "--config-path", type=str, help="Path to config file")
@@ -25,29 +29,69 @@ parser.add_argument(
     action=argparse.BooleanOptionalAction,
     help="Flag to set if this script is run in docker",
 )
+parser.add_argument(
+    "-e",
+    "--engine",
+    choices=["threads", "asyncio"],
+    default="threads",
+    help="Run the strategy on threads or on a single asyncio event loop",
+)
 
 
 class IntradayMomentum(ibkr.IBBaseApp):
     def __init__(self, config: dict):
         super().__init__()
-        self.current_limits = None
-        self.resampled_current_limits = None
+        self.upper_limits = None
+        self.lower_limits = None
         self.current_open = None
         self.live_data = pd.DataFrame()  # used by 5 min bars
-        self.mins = {}  # used for tick by tick data
         self.config = config
         self.number_of_bars = 1  # used by 5 min bars
-        (
-            self.historical_data,
-            self.latest_avg,
-            self.last_close,
-        ) = self.init_historical_data_to_strategy()
+        self.timezone = ZoneInfo(self.config["strategy"]["iana_timezone"])
+        if self.config["strategy"].get("session") is not None:
+            # the live session (bars, current open, checkpoints) still starts at midnight in
+            # `iana_timezone`, limits from other sessions would not match it
+            raise ValueError(
+                "The live strategy only trades calendar day sessions, remove 'session'"
+            )
+        self.bars = MinuteBars(self.timezone)  # used for tick by tick data
 
         # Order management-related
         self.capital = self.config["strategy"]["capital"]
         self.volatility_target = self.config["strategy"]["volatility_target"]
         self.max_leverage = self.config["strategy"]["max_leverage"]
-        self.curr_position = 0
+        self.contract = Contract()
+        for k, v in self.config["contract"].items():
+            setattr(self.contract, k, v)
+        self.gateway = OrderGateway(self.contract, self.placeOrder, self.nextId)
+        self.ready_callbacks = []  # called once nextValidId arrives
+        self.orderId = 0
+
+        self.checkpoint_path = self.config["strategy"].get("checkpoint_path")
+        # checkpoints are saved from the market data and the messages threads
+        self.checkpoint_lock = threading.Lock()
+        checkpoint = self.load_checkpoint()
+        if checkpoint is not None:
+            # warm restart within the session, no need to rebuild the history
+            self.restore_checkpoint(checkpoint)
+        else:
+            (
+                self.historical_data,
+                self.latest_avg,
+                self.last_close,
+            ) = self.init_historical_data_to_strategy()
+            self.sigma = self.historical_data["sigma"].iloc[-1]
+            self.upper_scale, self.lower_scale = self.load_limit_schedule()
+
+    @property
+    def curr_position(self):
+        return self.gateway.position
+
+    def nextValidId(self, orderId: int):
+        # never reuse the ids of orders sent before a restart
+        super().nextValidId(max(orderId, self.orderId))
+        for callback in self.ready_callbacks:
+            callback()
 
     # Market Data - related functions
     def marketDataType(self, reqId: int, marketDataType: int):
@@ -55,127 +99,88 @@ class IntradayMomentum(ibkr.IBBaseApp):
 
     def tickPrice(self, reqId, tickType, price, attrib):
         # TODO: Change this to real time last price once we switch to paid subscription.
-        # type 68 is delayed last price
+        # type 68 is delayed last price, 4 the last price (for ex. Binance trades on the bus)
         print(price)
-        if tickType == 68:
-            dt = datetime.datetime.now(datetime.timezone.utc)
-            dt = dt.replace(second=0, microsecond=0)
-
+        if tickType in (4, 68):
             if self.current_open is None:
                 self.current_open = price
-                (
-                    self.current_limits,
-                    self.resampled_current_limits,
-                ) = self.load_strategy_limits()
-            # TODO: is there a defaultdict that does this?
-            if dt in self.mins:
-                self.mins[dt]["close"] = price
-                if "open" not in self.mins[dt]:
-                    self.mins[dt]["open"] = price
-                if "low" not in self.mins[dt] or self.mins[dt]["low"] > price:
-                    self.mins[dt]["low"] = price
-                if "high" not in self.mins[dt] or self.mins[dt]["high"] < price:
-                    self.mins[dt]["high"] = price
-            elif dt not in self.mins:
-                self.mins[dt] = {}
-                self.mins[dt]["open"] = price
-                self.mins[dt]["close"] = price
-                self.mins[dt]["low"] = price
-                self.mins[dt]["high"] = price
+                self.upper_limits, self.lower_limits = self.load_strategy_limits()
+                self.gateway.order_size = self.calculate_position_size()
+            if self.bars.update(price=price):
+                self.save_checkpoint()
 
     def tickSize(self, reqId, tickType, size):
         # TODO: Change this to real time last price once we switch to paid subscription.
-        # tick type 71, delayed last size
+        # tick type 71, delayed last size, 5 the last size
         # https://www.interactivebrokers.com/campus/ibkr-api-page/twsapi-doc/#available-tick-types
-        if tickType == 71:
-            dt = datetime.datetime.now(datetime.timezone.utc)
-            dt = dt.replace(second=0, microsecond=0)
-
-            if dt in self.mins:
-                if "volume" in self.mins[dt]:
-                    self.mins[dt]["volume"] += size
-                else:
-                    self.mins[dt]["volume"] = size
-            elif dt not in self.mins:
-                self.mins[dt] = {}
-                self.mins[dt]["volume"] = size
+        if tickType in (5, 71):
+            if self.bars.update(size=float(size)):
+                self.save_checkpoint()
+
+    def load_limit_schedule(self):
+        """Precomputes the limit scales of the day, before the open, indexed by minute of day.
+
+        upper_scale = 1 + (volatility_multiplier * latest_avg)
+        lower_scale = 1 - (volatility_multiplier * latest_avg)
+
+        Minutes without a latest_avg are NaN.
+        """
+        volatility_multiplier = self.config["strategy"]["volatility_multiplier"]
+        minutes = np.array([t.hour * 60 + t.minute for t in self.latest_avg.index])
+        avg_move = np.full(MINUTES_PER_DAY, np.nan)
+        avg_move[minutes] = self.latest_avg.to_numpy(dtype=float)
+
+        upper_scale = 1 + (volatility_multiplier * avg_move)
+        lower_scale = 1 - (volatility_multiplier * avg_move)
+        return upper_scale, lower_scale
 
     def load_strategy_limits(self):
-        if self.current_limits is None:
-            limits = self.latest_avg.copy()
-            limits.index = limits.index.to_series().apply(
-                lambda s: pd.Timestamp(
-                    f"{pd.Timestamp.now(self.config['strategy']['iana_timezone']).date()} {s}"
-                )
-            )
-            limits.columns = ["latest_avg"]
-
-            limits["upper_limit"] = max(self.last_close, self.current_open) * (
-                1
-                + (
-                    self.config["strategy"]["volatility_multiplier"]
-                    * limits["latest_avg"]
-                )
-            )
-            limits["lower_limit"] = min(self.last_close, self.current_open) * (
-                1
-                - (
-                    self.config["strategy"]["volatility_multiplier"]
-                    * limits["latest_avg"]
-                )
-            )
-            resampled_limits = limits.copy()
-            resampled_limits = resampled_limits.resample("30min").agg(
-                upper_limit=("upper_limit", "last"), lower_limit=("lower_limit", "last")
-            )
+        """Finalizes the limit schedule of the day once the open price is known.
+
+        Returns:
+            np.ndarray, np.ndarray: Upper and lower limits, indexed by minute of day.
+        """
+        upper_limits = max(self.last_close, self.current_open) * self.upper_scale
+        lower_limits = min(self.last_close, self.current_open) * self.lower_scale
+        return upper_limits, lower_limits
+
+    def decide(self) -> int:
+        """Returns the target direction (LONG, SHORT or FLAT) from the bars of the day so far."""
+        # only the current half hour is needed, the writer keeps running meanwhile
+        df = self.bars.snapshot(bucket=30)
+
+        # we use this to calculate vwap
+        df["typical_px"] = (df["high"] + df["low"] + df["close"]) / 3
+        df["typical_px"] = df["typical_px"] * df["volume"]
+        df["vwap"] = (
+            df.groupby(df.index)["typical_px"].cumsum()
+            / df.groupby(df.index)["volume"].cumsum()
+        )
+
+        # At this point, index type and tz should be aligned
+        df = df.resample("30min").agg(
+            open=("open", "first"),
+            close=("close", "last"),
+            high=("high", "max"),
+            low=("low", "min"),
+            volume=("volume", "sum"),
+            vwap=("vwap", "last"),
+        )
 
-            return limits, resampled_limits
+        vwap = df.loc[df.index[-1], "vwap"]
+        px = df.loc[df.index[-1], "close"]
+        now = datetime.datetime.now(self.timezone)
+        minute = now.hour * 60 + now.minute
+        up_lim = self.upper_limits[minute]
+        low_lim = self.lower_limits[minute]
+
+        # Decide what position you want to take
+        return target_direction(px, vwap, up_lim, low_lim)
 
     def run_strategy(self, orders_queue: Queue):
         while True:
             if datetime.datetime.now().minute == 30:
-                df = pd.DataFrame().from_dict(self.mins, orient="index")
-                # TODO: see how to get TZ from config
-                df.index = pd.Series(df.index).dt.tz_convert(
-                    self.config["strategy"]["iana_timezone"]
-                )
-
-                # we use this to calculate vwap
-                df["typical_px"] = (df["high"] + df["low"] + df["close"]) / 3
-                df["typical_px"] = df["typical_px"] * df["volume"]
-                df["vwap"] = (
-                    df.groupby(df.index)["typical_px"].cumsum()
-                    / df.groupby(df.index)["volume"].cumsum()
-                )
-
-                # At this point, index type and tz should be aligned
-                df = df.resample("30min").agg(
-                    open=("open", "first"),
-                    close=("close", "last"),
-                    high=("high", "max"),
-                    low=("low", "min"),
-                    volume=("volume", "sum"),
-                    vwap=("vwap", "last"),
-                )
-
-                vwap = df.loc[df.index[-1], "vwap"]
-                px = df.loc[df.index[-1], "close"]
-                up_lim = self.resampled_current_limits.loc[
-                    self.resampled_current_limits.index[-1], "upper_limit"
-                ]
-                low_lim = self.resampled_current_limits.loc[
-                    self.resampled_current_limits.index[-1], "lower_limit"
-                ]
-
-                # Decide what position you want to take
-                if px > up_lim:
-                    orders_queue.put(ENTER_LONG)
-                if px < low_lim:
-                    orders_queue.put(ENTER_SHORT)
-                if px < vwap or px < up_lim:
-                    orders_queue.put(EXIT_LONG)
-                if px > vwap or px > low_lim:
-                    orders_queue.put(EXIT_SHORT)
+                orders_queue.put(self.decide())
 
                 # This task happens at the 30th min, make sure you wait more than a minute to not execute again
                 time.sleep(100)
@@ -216,7 +221,10 @@ class IntradayMomentum(ibkr.IBBaseApp):
             whyHeld,
             mktCapPrice,
         )
-        self.curr_position += filled
+        position = self.gateway.position
+        self.gateway.on_order_status(orderId, status, filled)
+        if self.gateway.position != position:
+            self.save_checkpoint()
 
     def get_order_aux_price(self):
         # TODO: get like last price from contract and do some +/- 1% stuff
@@ -226,76 +234,26 @@ class IntradayMomentum(ibkr.IBBaseApp):
         # TODO: get last price from contract and set as limit price
         return 0
 
-    def manage_positions(self, orders_queue: Queue, contract: Contract):
-        def calculate_position_size(strategy_capital, max_leverage, volatility_target):
-            """
-            Returns the abs. value of position size.
-            """
-            capital = strategy_capital * min(
-                max_leverage, volatility_target / self.historical_data.iloc[-1, "sigma"]
-            )
-            return capital / self.current_open
+    def calculate_position_size(self):
+        """
+        Returns the abs. value of position size, in whole shares.
+        """
+        capital = self.capital * min(
+            self.max_leverage, self.volatility_target / self.sigma
+        )
+        return Decimal(int(capital / self.current_open))
+
+    def send_target(self, direction: int):
+        """Sends the order, if any, to move the position to `direction`."""
+        self.gateway.on_decision(
+            direction,
+            lmt_price=self.get_order_lmt_price(),
+            aux_price=self.get_order_aux_price(),
+        )
 
+    def manage_positions(self, orders_queue: Queue):
         while True:
-            instruction = orders_queue.get(block=True, timeout=None)
-            if instruction == ENTER_LONG:
-                if self.curr_position != 0:
-                    print(
-                        f"Incorrect instruction: {instruction} when curr_position is {self.curr_position}"
-                    )
-                else:
-                    order_total_quantity = calculate_position_size(
-                        self.capital, self.max_leverage, self.volatility_target
-                    )
-                    order = Order()
-                    order.action = "BUY"
-                    order.auxPrice = self.get_order_aux_price()
-                    order.lmtPrice = self.get_order_lmt_price()
-                    order.orderType = "LMT"
-                    order.totalQuantity = order_total_quantity
-
-                    self.placeOrder(self.nextId(), contract, order)
-                    pass
-            elif instruction == ENTER_SHORT:
-                if self.curr_position != 0:
-                    print(
-                        f"Incorrect instruction: {instruction} when curr_position is {self.curr_position}"
-                    )
-                else:
-                    order_total_quantity = calculate_position_size(
-                        self.capital, self.max_leverage, self.volatility_target
-                    )
-                    order = Order()
-                    order.action = "SELL"
-                    order.auxPrice = self.get_order_aux_price()
-                    order.lmtPrice = self.get_order_lmt_price()
-                    order.orderType = "LMT"
-                    order.totalQuantity = order_total_quantity
-
-                    self.placeOrder(self.nextId(), contract, order)
-                    pass
-            elif instruction == EXIT_LONG:
-                if self.curr_position > 1:
-                    # TODO:
-                    # get curr position
-                    # place exit order
-                    pass
-                else:
-                    print(
-                        f"Incorrect instruction: {instruction} when curr_position is {self.curr_position}"
-                    )
-            elif instruction == EXIT_SHORT:
-                if self.curr_position < 1:
-                    # TODO:
-                    # get curr position
-                    # place exit order
-                    pass
-                else:
-                    print(
-                        f"Incorrect instruction: {instruction} when curr_position is {self.curr_position}"
-                    )
-
-        return
+            self.send_target(orders_queue.get(block=True, timeout=None))
 
     def init_historical_data_to_strategy(self):
         """Loads historical data and manipulate as required for the strategy."""
@@ -306,10 +264,100 @@ class IntradayMomentum(ibkr.IBBaseApp):
             volatility_multiplier=self.config["strategy"]["volatility_multiplier"],
         )
         last_close = df.iloc[-1]["day_close"]
-        return df, latest_avg.to_frame(), last_close
+        return df, latest_avg, last_close
+
+    # Checkpoint related functions
+    def checkpoint_state(self) -> dict:
+        """Returns the intraday state needed to resume trading, as arrays and scalars."""
+        with self.gateway.lock:
+            orders = json.dumps(
+                {
+                    order_id: [str(qty), str(filled), done]
+                    for order_id, (qty, filled, done) in self.gateway.orders.items()
+                }
+            )
+            position = str(self.gateway.position)
+        order_size = self.gateway.order_size
+        return {
+            "symbol": self.contract.symbol,
+            "session": self.bars.session.isoformat(),
+            "bars": self.bars.values,
+            "current_open": np.nan if self.current_open is None else self.current_open,
+            "last_close": self.last_close,
+            "sigma": self.sigma,
+            "latest_avg_minutes": [
+                t.hour * 60 + t.minute for t in self.latest_avg.index
+            ],
+            "latest_avg": self.latest_avg.to_numpy(dtype=float),
+            "upper_scale": self.upper_scale,
+            "lower_scale": self.lower_scale,
+            "order_size": "" if order_size is None else str(order_size),
+            "position": position,
+            "orders": orders,
+            "order_id": self.orderId,
+        }
+
+    def save_checkpoint(self):
+        """Checkpoints the intraday state to `checkpoint_path`, if set (about a ms).
+
+        Thread safe, concurrent calls (for ex. a tick from the market data bus thread and an
+        order status from the messages thread) write one after the other.
+        """
+        if self.checkpoint_path is None or self.bars.session is None:
+            return
+        with self.checkpoint_lock:
+            save_checkpoint(self.checkpoint_path, self.checkpoint_state())
+
+    def load_checkpoint(self) -> dict | None:
+        """Returns the checkpoint of the current session and contract, if any."""
+        if self.checkpoint_path is None:
+            return None
+        state = load_checkpoint(self.checkpoint_path)
+        if state is None:
+            return None
+        session = datetime.date.fromisoformat(str(state["session"]))
+        if (
+            session != datetime.datetime.now(self.timezone).date()
+            or str(state["symbol"]) != self.contract.symbol
+        ):
+            # stale checkpoint, start from the history
+            return None
+        return state
+
+    def restore_checkpoint(self, state: dict):
+        """Restores the intraday state from `checkpoint_state`, without loading any history."""
+        self.historical_data = None
+        self.last_close = float(state["last_close"])
+        self.sigma = float(state["sigma"])
+        self.latest_avg = pd.Series(
+            state["latest_avg"],
+            index=pd.DatetimeIndex(
+                state["latest_avg_minutes"] * np.timedelta64(1, "m")
+                + np.datetime64(0, "ns")
+            ).time,
+        )
+        self.upper_scale, self.lower_scale = state["upper_scale"], state["lower_scale"]
+
+        session = datetime.date.fromisoformat(str(state["session"]))
+        self.bars.restore(state["bars"], session)
+        if not np.isnan(state["current_open"]):
+            self.current_open = float(state["current_open"])
+            self.upper_limits, self.lower_limits = self.load_strategy_limits()
+
+        gateway = self.gateway
+        if str(state["order_size"]):
+            gateway.order_size = Decimal(str(state["order_size"]))
+        gateway.position = Decimal(str(state["position"]))
+        gateway.orders = {
+            int(order_id): [Decimal(qty), Decimal(filled), done]
+            for order_id, (qty, filled, done) in json.loads(
+                str(state["orders"])
+            ).items()
+        }
+        self.orderId = int(state["order_id"])
 
 
-def main(config_path: str, is_docker_run: bool):
+def main(config_path: str, is_docker_run: bool, engine: str = "threads"):
     """
     Example Config:
     {
@@ -319,7 +367,14 @@ def main(config_path: str, is_docker_run: bool):
         },
         "strategy": {
             "lookback_days": 20,
-            "volatility_multiplier": 0.8
+            "volatility_multiplier": 0.8,
+            "checkpoint_path": "/tmp/intraday_momentum_spy.npz"  # optional, for warm restarts
+        },
+        "market_data_bus": "mdbus",  # optional, read ticks from `trading.market_data_bus`
+        "profiler": {  # optional, on demand sampling profiles, see `trading.profiler.install`
+            "output_dir": "/tmp/profiles",
+            "duration": 30,
+            "socket_path": "/tmp/intraday_momentum_spy.sock"
         },
         "ibkr_params": {
             "genericTickList": "",
@@ -341,29 +396,58 @@ def main(config_path: str, is_docker_run: bool):
     host = "host.docker.internal" if is_docker_run else "127.0.0.1"
 
     app = IntradayMomentum(config)
+
+    if "profiler" in config:
+        from trading.profiler import install
+
+        # `kill -USR1 <pid>` or `python -m trading.profiler <socket_path>` to profile
+        install(config["profiler"])
+
+    if engine == "asyncio":
+        from trading.engine import AsyncEngine
+
+        AsyncEngine(app, host, 4002, client_id=1).run_forever()
+        return
+
     app.connect(host, 4002, clientId=1)
 
     orders_queue = Queue()
 
-    threading.Thread(target=app.run).start()
+    # threads are named for the profiles, the EReader thread is started by connect
+    if getattr(app, "reader", None) is not None:
+        app.reader.name = "ereader"
+    threading.Thread(target=app.run, name="messages").start()
     time.sleep(1)
     threading.Thread(
-        target=app.run_strategy, kwargs=dict(orders_queue=orders_queue)
+        target=app.run_strategy,
+        kwargs=dict(orders_queue=orders_queue),
+        name="strategy",
     ).start()
     time.sleep(1)
 
+    threading.Thread(
+        target=app.manage_positions,
+        kwargs=dict(orders_queue=orders_queue),
+        name="order_manager",
+    ).start()
+    time.sleep(1)
+
+    if "market_data_bus" in config:
+        # ticks come from the feed handler, no market data line of our own
+        from trading.market_data_bus import BusReader
+
+        reader = BusReader(app.contract.symbol, config["market_data_bus"])
+        threading.Thread(
+            target=reader.follow, kwargs=dict(app=app), name="market_data_bus"
+        ).start()
+        return
+
     ibkr_params = config["ibkr_params"]
     ibkr_params["reqId"] = app.nextId()
     ibkr_params["contract"] = Contract()
     for k, v in config["contract"].items():
         setattr(ibkr_params["contract"], k, v)
 
-    threading.Thread(
-        target=app.manage_positions,
-        kwargs=dict(orders_queue=orders_queue, contract=ibkr_params["contract"]),
-    ).start()
-    time.sleep(1)
-
     # Gotta start paper trading soon
     app.reqMarketDataType(3)
     app.reqMktData(**ibkr_params)
@@ -373,4 +457,4 @@ if __name__ == "__main__":
     args = parser.parse_args()
     print(f"Input args: {args.__dict__}")
 
-    main(args.config_path, args.docker_run)
+    main(args.config_path, args.docker_run, args.engine)